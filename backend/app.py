@@ -1,25 +1,140 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify, session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from expert_system import MedicalExpertSystem
+from diagnosis_pool import DiagnosisPool
+from knowledge_base_loader import load_knowledge_base, KnowledgeBaseWatcher
+from preload import preload_knowledge_base
+from rules import Diagnosis, Rule
 from user_database import UserDatabase
+from session_store import create_session_store
 from datetime import datetime
+import hmac
+import json
+import metrics
+import os
 import secrets
 
+class JSONProvider(DefaultJSONProvider):
+    """Serializes Rule and Diagnosis objects (see rules.py) as plain dicts"""
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, (Rule, Diagnosis)):
+            return value.to_dict()
+        return DefaultJSONProvider.default(value)
+
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.secret_key = secrets.token_hex(32)  # Generate secret key for sessions
 CORS(app, supports_credentials=True)
 
+# Rules come from KNOWLEDGE_BASE_PATH (JSON/YAML) when set, else the built-in ones
+KNOWLEDGE_BASE_PATH = os.environ.get('KNOWLEDGE_BASE_PATH')
+
+def build_expert_system(knowledge_base=None):
+    """Create the expert system, loading the knowledge base file if configured"""
+    if knowledge_base is None and KNOWLEDGE_BASE_PATH:
+        knowledge_base = load_knowledge_base(KNOWLEDGE_BASE_PATH)
+    return MedicalExpertSystem(
+        knowledge_base=knowledge_base,
+        diagnosis_cache_size=int(os.environ.get('DIAGNOSIS_CACHE_SIZE', 1024)),
+        top_k=int(os.environ.get('DIAGNOSIS_TOP_K', 5)),
+        min_confidence=float(os.environ.get('DIAGNOSIS_MIN_CONFIDENCE', 0)),
+        inference_mode=os.environ.get('INFERENCE_MODE', 'direct')
+    )
+
+def build_diagnosis_pool(expert_system):
+    """Worker processes for /api/diagnose/batch (DIAGNOSIS_WORKERS, 0 for none)"""
+    workers = os.environ.get('DIAGNOSIS_WORKERS')
+    return DiagnosisPool(expert_system, workers=int(workers) if workers else None)
+
+def swap_expert_system(knowledge_base=None):
+    """
+    Atomically replace the expert system with one built from a new knowledge base
+    Requests read the module-level expert_system once, so in-flight requests
+    finish on the old one while new requests use the new one.
+    """
+    global expert_system, diagnosis_pool
+    expert_system = build_expert_system(knowledge_base)
+    old_pool, diagnosis_pool = diagnosis_pool, build_diagnosis_pool(expert_system)
+    old_pool.close(wait=False)
+    if user_db.knowledge_base is not None:
+        user_db.knowledge_base = expert_system.knowledge_base
+    return expert_system
+
 # Initialize the expert system and user database
-expert_system = MedicalExpertSystem()
-user_db = UserDatabase()
+expert_system = build_expert_system()
+diagnosis_pool = build_diagnosis_pool(expert_system)
+if KNOWLEDGE_BASE_PATH and os.environ.get('KNOWLEDGE_BASE_WATCH') == '1':
+    KnowledgeBaseWatcher(KNOWLEDGE_BASE_PATH, swap_expert_system).start()
+# USER_DB_PATH ending in .db/.sqlite/.sqlite3 selects the SQLite backend;
+# USER_DB_MODE ('json', 'journal', 'sharded' or 'sqlite') overrides the choice;
+# 'sharded' splits users across USER_DB_SHARDS files (default 8) and USER_DB_FSYNC
+# ('always', 'interval' or 'never') sets when 'journal' syncs its journal to disk.
+# History entries reference knowledge base conditions by ID unless HISTORY_COMPACT=0,
+# and are written in background batches unless HISTORY_WRITE_BEHIND=0
+user_db = UserDatabase(os.environ.get('USER_DB_PATH', 'users_db.json'),
+                       mode=os.environ.get('USER_DB_MODE'),
+                       shard_count=int(os.environ.get('USER_DB_SHARDS', 8)),
+                       fsync=os.environ.get('USER_DB_FSYNC', 'interval'),
+                       knowledge_base=(expert_system.knowledge_base
+                                       if os.environ.get('HISTORY_COMPACT', '1') != '0' else None),
+                       write_behind=os.environ.get('HISTORY_WRITE_BEHIND', '1') != '0',
+                       write_behind_options={
+                           'batch_size': int(os.environ.get('HISTORY_BATCH_SIZE', 100)),
+                           'batch_delay': int(os.environ.get('HISTORY_BATCH_DELAY_MS', 50)) / 1000,
+                           'max_pending': int(os.environ.get('HISTORY_MAX_PENDING', 10000))
+                       })
 
-# Store conversation sessions
-sessions = {}
+# Store conversation sessions (bounded, idle sessions expire). SESSION_STORE=sqlite
+# shares them between worker processes through SESSION_DB_PATH.
+sessions = create_session_store(
+    os.environ.get('SESSION_STORE', 'memory'),
+    db_path=os.environ.get('SESSION_DB_PATH', 'sessions.db'),
+    max_sessions=int(os.environ.get('SESSION_MAX_COUNT', 10000)),
+    idle_ttl=int(os.environ.get('SESSION_IDLE_TTL', 30 * 60)),
+    max_history=int(os.environ.get('SESSION_MAX_HISTORY', 100))
+)
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """Handle chat interactions"""
-    data = request.json
+MAX_DIAGNOSIS_TOP_K = 50
+
+# Request parsing below is shared by the Flask routes and the ASGI entry point
+# (asgi.py): helpers take the decoded JSON body or query parameters and raise
+# ValueError with a message for the client, answered with a 400.
+
+def json_object(data):
+    """The JSON body of a request, which must be an object; raises ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    return data
+
+def parse_diagnosis_options(data):
+    """
+    Validate the optional top_k and min_confidence fields of a chat request
+    Returns (top_k, min_confidence), None where absent; raises ValueError
+    with a message for the client.
+    """
+    top_k = data.get('top_k')
+    min_confidence = data.get('min_confidence')
+    if top_k is not None and (
+            not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_DIAGNOSIS_TOP_K):
+        raise ValueError(f'top_k must be an integer from 1 to {MAX_DIAGNOSIS_TOP_K}')
+    if min_confidence is not None and (
+            not isinstance(min_confidence, (int, float)) or isinstance(min_confidence, bool)
+            or not 0 <= min_confidence <= 100):
+        raise ValueError('min_confidence must be a number from 0 to 100')
+    return top_k, min_confidence
+
+def process_chat(data):
+    """
+    Run one chat turn against the conversation session
+    Returns (reply, history_entry): the JSON reply for the client, and the
+    (username, diagnosis_data) to save to medical history, or None. Shared by
+    the Flask route and the ASGI entry point (asgi.py). Raises ValueError
+    for invalid top_k/min_confidence.
+    """
+    top_k, min_confidence = parse_diagnosis_options(json_object(data))
     session_id = data.get('session_id')
     user_message = data.get('message', '').strip()
     username = data.get('username')  # Get username for history tracking
@@ -27,60 +142,111 @@ def chat():
     if not session_id:
         session_id = f"session_{datetime.now().timestamp()}"
     
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'symptoms': [],
-            'history': [],
-            'state': 'initial',
-            'username': username
-        }
-    
-    session = sessions[session_id]
-    
-    # Add user message to history
-    session['history'].append({
-        'role': 'user',
-        'message': user_message,
-        'timestamp': datetime.now().isoformat()
-    })
-    
-    # Process the message and get response
-    response = expert_system.process_input(user_message, session)
-    
-    # Add bot response to history
-    session['history'].append({
-        'role': 'bot',
-        'message': response['message'],
-        'timestamp': datetime.now().isoformat()
-    })
+    with sessions.session(session_id, username) as session:
+        # Add user message to history
+        session['history'].append({
+            'role': 'user',
+            'message': user_message,
+            'timestamp': datetime.now().isoformat()
+        })
+        
+        # Process the message and get response
+        response = expert_system.process_input(user_message, session, top_k, min_confidence)
+        
+        # Add bot response to history
+        session['history'].append({
+            'role': 'bot',
+            'message': response['message'],
+            'timestamp': datetime.now().isoformat()
+        })
+        
+        state = session['state']
+        symptoms = list(session['symptoms'])
     
     # Save diagnosis to user's medical history if diagnosis is complete and user is logged in
-    if response.get('diagnosis') and username and session['state'] == 'diagnosis_complete':
-        diagnosis_data = {
+    history_entry = None
+    if response.get('diagnosis') and username and state == 'diagnosis_complete':
+        history_entry = (username, {
             'session_id': session_id,
-            'symptoms': session['symptoms'],
+            'symptoms': symptoms,
             'diagnoses': response['diagnosis']
-        }
-        user_db.add_diagnosis_to_history(username, diagnosis_data)
+        })
     
-    return jsonify({
+    reply = {
         'session_id': session_id,
         'message': response['message'],
         'diagnosis': response.get('diagnosis'),
         'suggestions': response.get('suggestions', []),
-        'state': session['state']
-    })
+        'state': state
+    }
+    return reply, history_entry
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """
+    Handle chat interactions
+    Optional top_k (1-50) and min_confidence (0-100) narrow the diagnoses
+    returned, overriding DIAGNOSIS_TOP_K and DIAGNOSIS_MIN_CONFIDENCE.
+    """
+    try:
+        reply, history_entry = process_chat(request.json)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if history_entry is not None:
+        user_db.add_diagnosis_to_history(*history_entry)
+    return jsonify(reply)
+
+MAX_DIAGNOSIS_BATCH = int(os.environ.get('MAX_DIAGNOSIS_BATCH', 10000))
+
+def process_diagnose_batch(data):
+    """
+    Diagnose every input of a POST /api/diagnose/batch body
+    Returns the JSON reply; raises ValueError with a message for the client.
+    Shared by the Flask route and the ASGI entry point (asgi.py).
+    """
+    inputs = json_object(data).get('inputs')
+    if not isinstance(inputs, list) or not inputs:
+        raise ValueError('inputs must be a non-empty list')
+    if len(inputs) > MAX_DIAGNOSIS_BATCH:
+        raise ValueError(f'at most {MAX_DIAGNOSIS_BATCH} inputs per batch')
+    for number, item in enumerate(inputs):
+        if not isinstance(item, str) and not (
+                isinstance(item, list) and all(isinstance(symptom, str) for symptom in item)):
+            raise ValueError(f'input {number} must be a message or a list of symptoms')
+    top_k, min_confidence = parse_diagnosis_options(data)
+    
+    results = diagnosis_pool.diagnose(inputs, top_k, min_confidence)
+    return {'success': True, 'results': results, 'count': len(results)}
+
+@app.route('/api/diagnose/batch', methods=['POST'])
+def diagnose_batch():
+    """
+    Stateless diagnosis of many inputs at once
+    Each input is a free-text message or a list of symptoms; results are
+    structured diagnoses only, in input order. Large batches are spread over
+    worker processes.
+    """
+    try:
+        return jsonify(process_diagnose_batch(request.json))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+def process_reset(data):
+    """Delete the conversation session of a POST /api/reset body; returns the JSON reply"""
+    session_id = json_object(data).get('session_id')
+    
+    if session_id:
+        sessions.delete(session_id)
+    
+    return {'message': 'Session reset successfully'}
 
 @app.route('/api/reset', methods=['POST'])
 def reset_session():
     """Reset a conversation session"""
-    data = request.json
-    session_id = data.get('session_id')
-    
-    if session_id and session_id in sessions:
-        del sessions[session_id]
-    
-    return jsonify({'message': 'Session reset successfully'})
+    try:
+        return jsonify(process_reset(request.json))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
 @app.route('/api/symptoms', methods=['GET'])
 def get_symptoms():
@@ -96,21 +262,100 @@ def get_conditions():
         'conditions': expert_system.get_all_conditions()
     })
 
+@app.route('/api/admin/reload-knowledge-base', methods=['POST'])
+def reload_knowledge_base():
+    """Reload the knowledge base file without restarting (requires ADMIN_TOKEN)"""
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token or not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        return jsonify({'success': False, 'message': 'Forbidden'}), 403
+    if not KNOWLEDGE_BASE_PATH:
+        return jsonify({'success': False, 'message': 'KNOWLEDGE_BASE_PATH is not set'}), 400
+    
+    try:
+        new_expert_system = swap_expert_system()
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Failed to load knowledge base: {e}'}), 500
+    
+    return jsonify({
+        'success': True,
+        'message': 'Knowledge base reloaded',
+        'conditions': len(new_expert_system.get_all_conditions())
+    })
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
+def render_metrics():
+    """Prometheus text for /metrics: stage timings plus store, cache and writer counters"""
+    lines = metrics.stats_samples('sessions', sessions.stats(),
+                                  counters=('created', 'evicted_capacity', 'evicted_expired', 'history_trimmed'))
+    cache = expert_system.inference_engine.cache
+    if cache is not None:
+        lines += metrics.stats_samples('diagnosis_cache', cache.stats(),
+                                       counters=('hits', 'misses', 'evictions', 'invalidations'))
+    writer_stats = user_db.stats()
+    if writer_stats is not None:
+        lines += metrics.stats_samples('history_writer', writer_stats,
+                                       counters=('flushes', 'entries_flushed', 'flush_seconds', 'failures',
+                                                 'retried', 'entries_lost', 'backpressure_waits',
+                                                 'backpressure_seconds'))
+    return metrics.render(lines)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def parse_credentials(data, fields):
+    """
+    Read string fields of an auth request body, stripping all but the password
+    Missing or empty fields come back as ''; raises ValueError for a non-object
+    body or a field that is not a string.
+    """
+    data = json_object(data)
+    values = []
+    for field in fields:
+        value = data.get(field, '')
+        if not isinstance(value, str):
+            raise ValueError(f'{field} must be a string')
+        values.append(value if field == 'password' else value.strip())
+    return values
+
+def parse_signup(data):
+    """Validate a POST /api/auth/signup body; returns (username, email, password)"""
+    username, email, password = parse_credentials(data, ('username', 'email', 'password'))
+    if not username or not email or not password:
+        raise ValueError('All fields are required')
+    return username, email, password
+
+def parse_login(data):
+    """Validate a POST /api/auth/login body; returns (username, password)"""
+    username, password = parse_credentials(data, ('username', 'password'))
+    if not username or not password:
+        raise ValueError('Username and password required')
+    return username, password
+
+def login_reply(username, user_data):
+    """JSON reply for a successful login"""
+    return {
+        'success': True,
+        'message': 'Authentication successful',
+        'user': {
+            'username': username,
+            'email': user_data.get('email'),
+            'created_at': user_data.get('created_at')
+        }
+    }
+
 @app.route('/api/auth/signup', methods=['POST'])
 def signup():
     """User registration endpoint"""
-    data = request.json
-    username = data.get('username', '').strip()
-    email = data.get('email', '').strip()
-    password = data.get('password', '')
-    
-    if not username or not email or not password:
-        return jsonify({'success': False, 'message': 'All fields are required'}), 400
+    try:
+        username, email, password = parse_signup(request.json)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
     success, message = user_db.create_user(username, email, password)
     
@@ -122,26 +367,15 @@ def signup():
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     """User login endpoint"""
-    data = request.json
-    username = data.get('username', '').strip()
-    password = data.get('password', '')
-    
-    if not username or not password:
-        return jsonify({'success': False, 'message': 'Username and password required'}), 400
+    try:
+        username, password = parse_login(request.json)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     
     success, message = user_db.authenticate_user(username, password)
     
     if success:
-        user_data = user_db.get_user(username)
-        return jsonify({
-            'success': True,
-            'message': message,
-            'user': {
-                'username': username,
-                'email': user_data.get('email'),
-                'created_at': user_data.get('created_at')
-            }
-        }), 200
+        return jsonify(login_reply(username, user_db.get_account(username))), 200
     else:
         return jsonify({'success': False, 'message': message}), 401
 
@@ -150,20 +384,87 @@ def logout():
     """User logout endpoint"""
     return jsonify({'success': True, 'message': 'Logged out successfully'}), 200
 
-@app.route('/api/history/<username>', methods=['GET'])
-def get_history(username):
-    """Get user's medical history"""
-    history = user_db.get_medical_history(username)
-    return jsonify({
+# Largest page size accepted by GET /api/history/<username>
+MAX_HISTORY_PAGE_SIZE = 500
+
+def parse_history_timestamp(value):
+    """Normalize an ISO date/time query parameter; None when absent"""
+    if value is None:
+        return None
+    return datetime.fromisoformat(value).isoformat()
+
+def parse_history_query(args):
+    """
+    Validate the query parameters of GET /api/history/<username>
+    Returns (mode, since, until, limit, cursor) where mode is 'ndjson',
+    'all' or 'page'; raises ValueError with a message for the client.
+    """
+    try:
+        since = parse_history_timestamp(args.get('since'))
+        until = parse_history_timestamp(args.get('until'))
+    except ValueError:
+        raise ValueError('since/until must be ISO dates')
+    
+    if args.get('format') == 'ndjson':
+        return 'ndjson', since, until, None, None
+    if not any(key in args for key in ('limit', 'cursor', 'since', 'until')):
+        return 'all', since, until, None, None
+    
+    try:
+        limit = int(args.get('limit', 50))
+        cursor = int(args['cursor']) if args.get('cursor') else None
+    except ValueError:
+        raise ValueError('limit and cursor must be integers')
+    if not 1 <= limit <= MAX_HISTORY_PAGE_SIZE or (cursor is not None and cursor < 0):
+        raise ValueError(f'limit must be 1-{MAX_HISTORY_PAGE_SIZE} and cursor non-negative')
+    return 'page', since, until, limit, cursor
+
+def history_page_reply(history, next_cursor):
+    """JSON reply for one page of GET /api/history/<username>"""
+    return {
         'success': True,
         'history': history,
-        'count': len(history)
-    })
+        'count': len(history),
+        'next_cursor': str(next_cursor) if next_cursor is not None else None
+    }
+
+@app.route('/api/history/<username>', methods=['GET'])
+def get_history(username):
+    """
+    Get user's medical history
+    Without query parameters the whole history is returned. With limit,
+    cursor, since or until it is paginated (pass next_cursor back as cursor),
+    and format=ndjson streams every matching entry, one JSON object per line.
+    """
+    try:
+        mode, since, until, limit, cursor = parse_history_query(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    if mode == 'ndjson':
+        def generate():
+            for entry in user_db.iter_medical_history(username, since, until):
+                yield json.dumps(entry) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    if mode == 'all':
+        history = user_db.get_medical_history(username)
+        return jsonify({
+            'success': True,
+            'history': history,
+            'count': len(history)
+        })
+    
+    history, next_cursor = user_db.get_history_page(username, cursor, limit, since, until)
+    return jsonify(history_page_reply(history, next_cursor))
 
 @app.route('/api/history/<username>', methods=['POST'])
 def save_diagnosis(username):
     """Save diagnosis to user's medical history"""
-    data = request.json
+    try:
+        data = json_object(request.json)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     success, message = user_db.add_diagnosis_to_history(username, data)
     
     if success:
@@ -181,5 +482,11 @@ def clear_history(username):
     else:
         return jsonify({'success': False, 'message': 'User not found'}), 404
 
+# With PRELOAD_KNOWLEDGE_BASE=1 and a preloading server (gunicorn --preload),
+# the knowledge base built above is frozen in the master process and shared
+# copy-on-write by every forked worker instead of being rebuilt per worker
+if os.environ.get('PRELOAD_KNOWLEDGE_BASE') == '1':
+    preload_knowledge_base(expert_system.knowledge_base)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
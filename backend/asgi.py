@@ -0,0 +1,376 @@
+"""
+ASGI entry point serving the same API as app.py
+
+    pip install uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+The expert system, user database and session store are the ones set up in
+app.py, so configuration (environment variables) is shared, and so is
+request parsing and validation: handlers call the same app.py helpers as
+the Flask routes and answer their ValueErrors with a 400.
+
+Inference runs inline on the event loop; it is CPU-bound and short. Chat
+turns with SESSION_STORE=sqlite, which may wait for another process to
+release the session, and batch diagnosis, which waits for its worker
+processes, run on a thread instead. UserDatabase calls run on a single
+writer thread: they never block the loop, stay in order (a history read
+sees earlier writes) and the JSON backends are never written from two
+threads at once. Password hashing and checks, which are slow on purpose,
+run on the default executor so they do not hold up that thread; only the
+storage calls around them go through it. /api/chat replies without waiting
+for its history write.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import app as flask_app
+from passwords import hash_password, needs_rehash, verify_password
+from rules import json_default
+from session_store import InMemorySessionStore
+
+logger = logging.getLogger(__name__)
+
+user_db_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-db')
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def run_user_db(function, *args):
+    """Run a UserDatabase call on the writer thread and wait for its result"""
+    return await asyncio.get_running_loop().run_in_executor(user_db_writer, function, *args)
+
+
+async def run_hashing(function, *args):
+    """
+    Run a password hash or check on the default executor
+    They take hundreds of milliseconds by design, so they are kept off the
+    writer thread where they would hold up every other UserDatabase call.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+def _log_write_failure(future):
+    if future.exception() is not None:
+        logger.error("History write failed", exc_info=future.exception())
+
+
+# Handlers take (request, *path groups) and return (status, payload) or a
+# coroutine producing it; payload is JSON-serialized unless it is a Stream.
+
+class Stream:
+    """Streamed response body: an async iterator of bytes chunks"""
+
+    def __init__(self, chunks, content_type):
+        self.chunks = chunks
+        self.content_type = content_type
+
+
+async def chat(request):
+    try:
+        if isinstance(flask_app.sessions, InMemorySessionStore):
+            reply, history_entry = flask_app.process_chat(request['json'])
+        else:
+            # A shared session store may wait for another request holding the session
+            reply, history_entry = await asyncio.get_running_loop().run_in_executor(
+                None, flask_app.process_chat, request['json']
+            )
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+    if history_entry is not None:
+        user_db_writer.submit(flask_app.user_db.add_diagnosis_to_history, *history_entry) \
+            .add_done_callback(_log_write_failure)
+    return 200, reply
+
+
+async def diagnose_batch(request):
+    try:
+        # Splitting the batch across the pool blocks until it is done
+        reply = await asyncio.get_running_loop().run_in_executor(
+            None, flask_app.process_diagnose_batch, request['json']
+        )
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+    return 200, reply
+
+
+def reset_session(request):
+    try:
+        return 200, flask_app.process_reset(request['json'])
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+
+
+def get_symptoms(request):
+    return 200, {'symptoms': flask_app.expert_system.get_all_symptoms()}
+
+
+def get_conditions(request):
+    return 200, {'conditions': flask_app.expert_system.get_all_conditions()}
+
+
+async def reload_knowledge_base(request):
+    admin_token = os.environ.get('ADMIN_TOKEN')
+    if not admin_token or not hmac.compare_digest(request['headers'].get('x-admin-token', ''), admin_token):
+        return 403, {'success': False, 'message': 'Forbidden'}
+    if not flask_app.KNOWLEDGE_BASE_PATH:
+        return 400, {'success': False, 'message': 'KNOWLEDGE_BASE_PATH is not set'}
+
+    try:
+        new_expert_system = await asyncio.get_running_loop().run_in_executor(None, flask_app.swap_expert_system)
+    except Exception as e:
+        return 500, {'success': False, 'message': f'Failed to load knowledge base: {e}'}
+
+    return 200, {
+        'success': True,
+        'message': 'Knowledge base reloaded',
+        'conditions': len(new_expert_system.get_all_conditions())
+    }
+
+
+def health_check(request):
+    return 200, {'status': 'healthy', 'timestamp': datetime.now().isoformat()}
+
+
+def metrics_endpoint(request):
+    async def body():
+        yield flask_app.render_metrics().encode('utf-8')
+    return 200, Stream(body(), 'text/plain; version=0.0.4')
+
+
+async def signup(request):
+    try:
+        username, email, password = flask_app.parse_signup(request['json'])
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+
+    user_db = flask_app.user_db
+    # Skip the hash for names already taken; create_user checks again
+    if await run_user_db(user_db.get_account, username) is not None:
+        return 400, {'success': False, 'message': 'Username already exists'}
+    password_hash = await run_hashing(hash_password, password, user_db.password_iterations)
+    success, message = await run_user_db(user_db.create_user, username, email, password, password_hash)
+    if success:
+        return 201, {'success': True, 'message': message, 'username': username}
+    return 400, {'success': False, 'message': message}
+
+
+async def login(request):
+    try:
+        username, password = flask_app.parse_login(request['json'])
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+
+    # UserDatabase.authenticate_user, with the hashing moved off the writer thread
+    user_db = flask_app.user_db
+    user_data = await run_user_db(user_db.get_account, username)
+    if user_data is None:
+        return 401, {'success': False, 'message': 'User not found'}
+    if not await run_hashing(verify_password, password, user_data['password']):
+        return 401, {'success': False, 'message': 'Invalid password'}
+    if needs_rehash(user_data['password'], user_db.password_iterations):
+        password_hash = await run_hashing(hash_password, password, user_db.password_iterations)
+        await run_user_db(user_db.set_password_hash, username, password_hash)
+
+    return 200, flask_app.login_reply(username, user_data)
+
+
+def logout(request):
+    return 200, {'success': True, 'message': 'Logged out successfully'}
+
+
+async def get_history(request, username):
+    try:
+        mode, since, until, limit, cursor = flask_app.parse_history_query(request['query'])
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+
+    user_db = flask_app.user_db
+    if mode == 'ndjson':
+        async def chunks():
+            cursor = None
+            while True:
+                entries, cursor = await run_user_db(
+                    user_db.get_history_page, username, cursor, flask_app.MAX_HISTORY_PAGE_SIZE, since, until
+                )
+                if entries:
+                    yield ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+                if cursor is None:
+                    return
+        return 200, Stream(chunks(), 'application/x-ndjson')
+
+    if mode == 'all':
+        history = await run_user_db(user_db.get_medical_history, username)
+        return 200, {'success': True, 'history': history, 'count': len(history)}
+
+    history, next_cursor = await run_user_db(user_db.get_history_page, username, cursor, limit, since, until)
+    return 200, flask_app.history_page_reply(history, next_cursor)
+
+
+async def save_diagnosis(request, username):
+    try:
+        data = flask_app.json_object(request['json'])
+    except ValueError as e:
+        return 400, {'success': False, 'message': str(e)}
+    success, message = await run_user_db(flask_app.user_db.add_diagnosis_to_history, username, data)
+    if success:
+        return 201, {'success': True, 'message': message}
+    return 400, {'success': False, 'message': message}
+
+
+async def clear_history(request, username):
+    if await run_user_db(flask_app.user_db.clear_history, username):
+        return 200, {'success': True, 'message': 'History cleared'}
+    return 404, {'success': False, 'message': 'User not found'}
+
+
+ROUTES = [
+    ('POST', r'/api/chat', chat),
+    ('POST', r'/api/diagnose/batch', diagnose_batch),
+    ('POST', r'/api/reset', reset_session),
+    ('GET', r'/api/symptoms', get_symptoms),
+    ('GET', r'/api/conditions', get_conditions),
+    ('POST', r'/api/admin/reload-knowledge-base', reload_knowledge_base),
+    ('GET', r'/health', health_check),
+    ('GET', r'/metrics', metrics_endpoint),
+    ('POST', r'/api/auth/signup', signup),
+    ('POST', r'/api/auth/login', login),
+    ('POST', r'/api/auth/logout', logout),
+    ('GET', r'/api/history/([^/]+)', get_history),
+    ('POST', r'/api/history/([^/]+)', save_diagnosis),
+    ('DELETE', r'/api/history/([^/]+)', clear_history),
+]
+ROUTES = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in ROUTES]
+
+
+def route(method, path):
+    """Return (handler, path groups); raise HTTPError 404/405 when nothing matches"""
+    allowed = False
+    for route_method, pattern, handler in ROUTES:
+        match = pattern.match(path)
+        if match is None:
+            continue
+        if route_method == method:
+            return handler, match.groups()
+        allowed = True
+    if allowed:
+        raise HTTPError(405, 'Method not allowed')
+    raise HTTPError(404, 'Not found')
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def cors_headers(headers):
+    """Same policy as flask_cors with supports_credentials: echo the caller's origin"""
+    origin = headers.get('origin')
+    if origin is None:
+        return []
+    return [(b'access-control-allow-origin', origin.encode('latin-1')),
+            (b'access-control-allow-credentials', b'true'),
+            (b'vary', b'Origin')]
+
+
+async def send_json(send, status, payload, extra_headers):
+    body = json.dumps(payload, default=json_default).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode('ascii'))] + extra_headers
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def handle_http(scope, receive, send):
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    extra_headers = cors_headers(headers)
+    method = scope['method']
+
+    if method == 'OPTIONS':
+        await read_body(receive)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': extra_headers + [
+                (b'access-control-allow-methods', b'GET, POST, DELETE, OPTIONS'),
+                (b'access-control-allow-headers',
+                 headers.get('access-control-request-headers', 'Content-Type').encode('latin-1')),
+                (b'content-length', b'0')
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    try:
+        handler, groups = route(method, scope['path'])
+        body = await read_body(receive)
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            raise HTTPError(400, 'Invalid JSON body')
+        query = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        # The decoded body as is; handlers validate it with the app.py helpers
+        request = {'json': data, 'query': query, 'headers': headers}
+
+        result = handler(request, *groups)
+        if asyncio.iscoroutine(result):
+            result = await result
+        status, payload = result
+    except HTTPError as e:
+        await send_json(send, e.status, {'success': False, 'message': str(e)}, extra_headers)
+        return
+    except Exception:
+        logger.exception("Unhandled error for %s %s", method, scope['path'])
+        await send_json(send, 500, {'success': False, 'message': 'Internal server error'}, extra_headers)
+        return
+
+    if not isinstance(payload, Stream):
+        await send_json(send, status, payload, extra_headers)
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', payload.content_type.encode('latin-1'))] + extra_headers
+    })
+    async for chunk in payload.chunks:
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Let queued history writes finish before the database is closed
+            await asyncio.get_running_loop().run_in_executor(None, user_db_writer.shutdown)
+            flask_app.user_db.close()
+            flask_app.diagnosis_pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
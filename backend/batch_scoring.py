@@ -0,0 +1,178 @@
+import numpy as np
+
+
+class BatchScorer:
+    """Vectorized scoring of many symptom lists against a compiled knowledge base
+
+    The rules are held as a sparse symptom x rule incidence matrix in CSR
+    form (and a second one for required symptoms). For a chunk of patients,
+    every symptom occurrence is expanded into (patient, rule) pairs, so only
+    pairs sharing a symptom are ever materialised; matched counts, required
+    flags, penalties and top-k selection are then computed for all pairs of
+    the chunk with array operations.
+    """
+
+    def __init__(self, compiled, chunk_size=50_000, max_cached_texts=100_000):
+        self.compiled = compiled
+        self.chunk_size = chunk_size
+
+        # Raw symptom text -> ID, so repeated spellings skip lower() and lookup
+        self._ids_by_text = dict(compiled.symptom_ids)
+        self.max_cached_texts = max_cached_texts
+
+        # Unknown symptoms get an extra ID with no rules attached
+        self.unknown_id = len(compiled.symptoms)
+        rules_by_symptom = [[] for _ in range(self.unknown_id + 1)]
+        required_by_symptom = [[] for _ in range(self.unknown_id + 1)]
+        for rule_index in range(len(compiled.rules)):
+            for symptom_id in set(compiled.rule_symptom_ids[rule_index]):
+                rules_by_symptom[symptom_id].append(rule_index)
+            for symptom_id in compiled.required_ids[rule_index]:
+                required_by_symptom[symptom_id].append(rule_index)
+        self.incidence = _csr(rules_by_symptom)
+        self.required_incidence = _csr(required_by_symptom)
+
+        self.rule_sizes = np.array([len(s) for s in compiled.rule_symptoms], dtype=np.float64)
+        self.required_counts = np.array(
+            [len(required_ids) for required_ids in compiled.required_ids], dtype=np.int64
+        )
+        self.has_required = self.required_counts > 0
+
+    def diagnose(self, symptom_lists, top_k=5):
+        """Return one diagnosis list per symptom list"""
+        symptom_lists = list(symptom_lists)
+        if not self.compiled.rules or top_k <= 0:
+            return [[] for _ in symptom_lists]
+
+        results = []
+        chunk_size = self.chunk_size
+        for start in range(0, len(symptom_lists), chunk_size):
+            results.extend(self._diagnose_chunk(symptom_lists[start:start + chunk_size], top_k))
+        return results
+
+    def _symptom_ids(self, symptom_lists):
+        """Flat array of symptom IDs for every symptom in the chunk"""
+        ids_by_text = self._ids_by_text
+        flat_ids = [ids_by_text.get(s, -1) for symptoms in symptom_lists for s in symptoms]
+        if -1 in flat_ids:
+            flat_texts = [s for symptoms in symptom_lists for s in symptoms]
+            for position, symptom_id in enumerate(flat_ids):
+                if symptom_id == -1:
+                    text = flat_texts[position]
+                    symptom_id = self.compiled.symptom_ids.get(text.lower(), self.unknown_id)
+                    if len(ids_by_text) < self.max_cached_texts:
+                        ids_by_text[text] = symptom_id
+                    flat_ids[position] = symptom_id
+        return np.array(flat_ids, dtype=np.int64)
+
+    def _diagnose_chunk(self, symptom_lists, top_k):
+        compiled = self.compiled
+        patient_count = len(symptom_lists)
+        rule_count = len(compiled.rules)
+
+        flat_ids = self._symptom_ids(symptom_lists)
+        lengths = np.fromiter(map(len, symptom_lists), dtype=np.int64, count=patient_count)
+        patient_ids = np.repeat(np.arange(patient_count), lengths)
+
+        # Repeated symptoms count towards matches and penalties, but the
+        # required-symptom check is about presence, so drop repeats there
+        order = np.lexsort((flat_ids, patient_ids))
+        repeated = np.zeros(len(flat_ids), dtype=bool)
+        repeated[order[1:]] = (
+            (flat_ids[order[1:]] == flat_ids[order[:-1]])
+            & (patient_ids[order[1:]] == patient_ids[order[:-1]])
+        )
+        distinct = ~repeated
+
+        # Candidate (patient, rule) pairs are those sharing at least one
+        # symptom; count matches and required hits per pair
+        matched_keys = _pair_keys(self.incidence, flat_ids, patient_ids, rule_count)
+        required_keys = _pair_keys(
+            self.required_incidence, flat_ids[distinct], patient_ids[distinct], rule_count
+        )
+        pairs, inverse = np.unique(np.concatenate((matched_keys, required_keys)), return_inverse=True)
+        inverse = inverse.ravel()
+        matched = np.bincount(inverse[:len(matched_keys)], minlength=len(pairs))
+        required_hits = np.bincount(inverse[len(matched_keys):], minlength=len(pairs))
+        patients, rules = np.divmod(pairs, rule_count)
+
+        rule_sizes = self.rule_sizes[rules]
+        has_required = self.has_required[rules]
+        user_counts = lengths[patients]
+
+        # Same arithmetic, in the same order, as calculate_match_score
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidence = (matched / rule_sizes) * 100
+        # min(100, x + 10) hands back the int 100 when capped, and the
+        # penalty keeps it an int; diagnose() reports those scores as ints
+        capped = has_required & (confidence + 10 >= 100)
+        confidence = np.where(has_required, np.minimum(100, confidence + 10), confidence)
+        extra = user_counts - matched
+        penalty = np.minimum(20, extra * 5)
+        confidence = np.where(extra > 0, np.maximum(0, confidence - penalty), confidence)
+        confidence[rule_sizes == 0] = 0
+        confidence[has_required & (required_hits < self.required_counts[rules])] = 0
+
+        # Rank each patient's pairs by confidence, then rule order
+        positive = confidence > 0
+        patients, rules, confidence, capped = (
+            patients[positive], rules[positive], confidence[positive], capped[positive]
+        )
+        order = np.lexsort((rules, -confidence, patients))
+        patients, rules, confidence, capped = (
+            patients[order], rules[order], confidence[order], capped[order]
+        )
+
+        # Keep everything within rounding distance of each patient's k-th
+        # best score; the final rounding and tie-break on rule order is done
+        # in Python on those few survivors so results match diagnose() exactly
+        group_starts = np.searchsorted(patients, patients, side='left')
+        group_ends = np.searchsorted(patients, patients, side='right')
+        kth_positions = group_starts + top_k - 1
+        has_kth = kth_positions < group_ends
+        kth_best = np.full(len(confidence), -np.inf)
+        kth_best[has_kth] = confidence[kth_positions[has_kth]]
+        keep = confidence >= kth_best - 0.01
+
+        survivors = [[] for _ in symptom_lists]
+        for patient, rule_index, value, is_int in zip(
+            patients[keep].tolist(), rules[keep].tolist(),
+            confidence[keep].tolist(), capped[keep].tolist()
+        ):
+            rounded = int(value) if is_int else round(value, 2)
+            if rounded > 0:
+                survivors[patient].append((rounded, rule_index))
+
+        results = []
+        for symptoms, scored in zip(symptom_lists, survivors):
+            if not scored:
+                results.append([])
+                continue
+            scored.sort(key=lambda x: (-x[0], x[1]))
+            user_symptoms = [s.lower() for s in symptoms]
+            user_ids, user_set = compiled.lookup(user_symptoms)
+            results.append([
+                compiled.diagnosis(rule_index, rounded, user_symptoms, user_ids, user_set)
+                for rounded, rule_index in scored[:top_k]
+            ])
+        return results
+
+
+def _csr(rows):
+    """Compressed sparse rows (indptr, indices) from a list of index lists"""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=indptr[1:])
+    indices = np.fromiter((i for row in rows for i in row), dtype=np.int64, count=int(indptr[-1]))
+    return indptr, indices
+
+
+def _pair_keys(incidence, symptom_ids, patient_ids, rule_count):
+    """patient * rule_count + rule for every (symptom occurrence, rule) pair in a CSR incidence"""
+    indptr, indices = incidence
+    starts = indptr[symptom_ids]
+    widths = indptr[symptom_ids + 1] - starts
+    total = int(widths.sum())
+
+    # Positions of every pair's rule in `indices`
+    offsets = np.repeat(starts - (np.cumsum(widths) - widths), widths) + np.arange(total)
+    return np.repeat(patient_ids, widths) * rule_count + indices[offsets]
@@ -0,0 +1,108 @@
+"""
+Signup and login latency with a large user database
+
+Seeds a database with --users accounts, then times --samples signups and
+logins through UserDatabase and reports p50/p99 latency per storage mode.
+Run from the backend directory:
+    python -m benchmarks.auth_latency --users 1000000 --modes journal,sqlite
+
+Login time is dominated by the password hash cost; --target-ms prints the
+PASSWORD_HASH_ITERATIONS that keeps one check within a latency budget.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from passwords import DEFAULT_ITERATIONS, calibrate_iterations, hash_password
+from user_database import UserDatabase
+from user_storage import SQLiteStorageBackend
+
+PATHS = {'json': 'users_db.json', 'journal': 'users_db.json', 'sqlite': 'users.db'}
+
+
+def seed(path, mode, count, password_hash, chunk_size=100_000):
+    """Write count accounts straight to storage, all with the same password hash"""
+    def records(start, stop):
+        return {f'user{n}': {'email': f'user{n}@example.com', 'password': password_hash,
+                             'created_at': '2024-01-01T00:00:00', 'medical_history': []}
+                for n in range(start, stop)}
+
+    if mode == 'sqlite':
+        backend = SQLiteStorageBackend(path)
+        for start in range(0, count, chunk_size):
+            backend.import_users(records(start, min(count, start + chunk_size)))
+        backend.close()
+    else:
+        with open(path, 'w') as f:
+            json.dump(records(0, count), f)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(users, modes, samples, iterations):
+    password_hash = hash_password('password', iterations)
+    rng = random.Random(0)
+    print(f"{users} users, hash cost {iterations} iterations")
+    print(f"{'mode':>8} {'seed (s)':>9} {'signup p50':>11} {'signup p99':>11} "
+          f"{'login p50':>10} {'login p99':>10} {'logins/s':>9}")
+
+    for mode in modes:
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, PATHS[mode])
+            start = time.perf_counter()
+            seed(path, mode, users, password_hash)
+            user_db = UserDatabase(path, mode=mode, password_iterations=iterations)
+            seed_seconds = time.perf_counter() - start
+
+            signups = []
+            for n in range(samples):
+                start = time.perf_counter()
+                success, message = user_db.create_user(f'new{n}', f'new{n}@example.com', 'password')
+                signups.append(time.perf_counter() - start)
+                if not success:
+                    raise SystemExit(f"signup failed: {message}")
+
+            logins = []
+            for _ in range(samples):
+                username = f'user{rng.randrange(users)}'
+                start = time.perf_counter()
+                success, message = user_db.authenticate_user(username, 'password')
+                logins.append(time.perf_counter() - start)
+                if not success:
+                    raise SystemExit(f"login failed: {message}")
+            user_db.close()
+        finally:
+            shutil.rmtree(directory)
+
+        print(f"{mode:>8} {seed_seconds:>9.1f} "
+              f"{percentile(signups, 0.5) * 1000:>9.2f}ms {percentile(signups, 0.99) * 1000:>9.2f}ms "
+              f"{percentile(logins, 0.5) * 1000:>8.2f}ms {percentile(logins, 0.99) * 1000:>8.2f}ms "
+              f"{len(logins) / sum(logins):>9.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000,
+                        help='accounts to seed (default: %(default)s)')
+    parser.add_argument('--modes', default='journal,sqlite',
+                        help='comma-separated storage modes: json, journal, sqlite (default: %(default)s)')
+    parser.add_argument('--samples', type=int, default=200,
+                        help='signups and logins to time per mode (default: %(default)s)')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help='password hash cost (default: PASSWORD_HASH_ITERATIONS or %(default)s)')
+    parser.add_argument('--target-ms', type=float,
+                        help='also print the hash cost that keeps one login within this many milliseconds')
+    args = parser.parse_args()
+
+    if args.target_ms:
+        print(f"PASSWORD_HASH_ITERATIONS={calibrate_iterations(args.target_ms / 1000)} "
+              f"fits a {args.target_ms:g}ms login budget on this machine")
+    run(args.users, args.modes.split(','), args.samples, args.iterations)
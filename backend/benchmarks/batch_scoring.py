@@ -0,0 +1,50 @@
+"""
+Throughput of InferenceEngine.diagnose_batch against looping diagnose()
+
+Run from the backend directory:
+    python -m benchmarks.batch_scoring --sizes 10000,1000000
+"""
+import argparse
+import random
+import time
+
+from knowledge_base import KnowledgeBase
+from inference_engine import InferenceEngine
+
+
+def make_symptom_lists(knowledge_base, count, seed=0):
+    """Random patients with 1-6 symptoms drawn from the knowledge base"""
+    rng = random.Random(seed)
+    vocabulary = knowledge_base.get_all_symptoms()
+    return [rng.sample(vocabulary, rng.randint(1, 6)) for _ in range(count)]
+
+
+def run(sizes):
+    engine = InferenceEngine(KnowledgeBase())
+    print(f"{'inputs':>10} {'loop (s)':>10} {'batch (s)':>10} {'loop/s':>12} {'batch/s':>12} {'speedup':>8}")
+
+    for size in sizes:
+        symptom_lists = make_symptom_lists(engine.knowledge_base, size)
+
+        start = time.perf_counter()
+        looped = [engine.diagnose(symptoms) for symptoms in symptom_lists]
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = engine.diagnose_batch(symptom_lists)
+        batch_seconds = time.perf_counter() - start
+
+        if looped != batched:
+            raise SystemExit(f"diagnose_batch disagrees with diagnose at {size} inputs")
+
+        print(f"{size:>10} {loop_seconds:>10.2f} {batch_seconds:>10.2f} "
+              f"{size / loop_seconds:>12.0f} {size / batch_seconds:>12.0f} "
+              f"{loop_seconds / batch_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10000,1000000',
+                        help='comma-separated batch sizes (default: %(default)s)')
+    args = parser.parse_args()
+    run([int(size) for size in args.sizes.split(',')])
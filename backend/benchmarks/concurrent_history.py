@@ -0,0 +1,96 @@
+"""
+Concurrent history writes: throughput and a check that no update is lost
+
+--threads threads each append --entries history entries for users picked at
+random from --users accounts, all through one UserDatabase, as a threaded
+WSGI server would. Afterwards the database is reopened from disk and every
+user's history is compared with what was written; the script exits with an
+error if any entry is missing or duplicated. Run from the backend directory:
+    python -m benchmarks.concurrent_history --modes json,sharded --threads 16
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from user_database import UserDatabase
+
+PATHS = {'json': 'users_db.json', 'journal': 'users_db.json', 'sharded': 'users_db.json', 'sqlite': 'users.db'}
+
+
+def hammer(user_db, usernames, thread_number, count, written):
+    """Append count entries, recording (username, session_id) of each one stored"""
+    rng = random.Random(thread_number)
+    for number in range(count):
+        username = rng.choice(usernames)
+        session_id = f'{thread_number}-{number}'
+        ok, _ = user_db.add_diagnosis_to_history(username, {'symptoms': ['fever'], 'session_id': session_id})
+        if ok:
+            written.append((username, session_id))
+
+
+def check(user_db, usernames, written):
+    """Number of entries missing from and duplicated in the stored histories"""
+    expected = {}
+    for username, session_id in written:
+        expected.setdefault(username, []).append(session_id)
+    missing = duplicated = 0
+    for username in usernames:
+        stored = [entry['session_id'] for entry in user_db.get_medical_history(username)]
+        duplicated += len(stored) - len(set(stored))
+        missing += len(set(expected.get(username, [])) - set(stored))
+    return missing, duplicated
+
+
+def run(modes, user_count, threads, entries, shard_count):
+    usernames = [f'user{n}' for n in range(user_count)]
+    print(f"{user_count} users, {threads} threads x {entries} entries")
+    print(f"{'mode':>8} {'seconds':>8} {'writes/s':>9} {'missing':>8} {'duplicated':>11}")
+
+    failed = False
+    for mode in modes:
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, PATHS[mode])
+            user_db = UserDatabase(path, mode=mode, password_iterations=1, shard_count=shard_count)
+            for username in usernames:
+                user_db.create_user(username, f'{username}@example.com', 'password')
+
+            written = []
+            workers = [threading.Thread(target=hammer, args=(user_db, usernames, n, entries, written))
+                       for n in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            seconds = time.perf_counter() - start
+            user_db.close()
+
+            # Read back from disk, not from the instance that did the writing
+            reopened = UserDatabase(path, mode=mode, shard_count=shard_count)
+            missing, duplicated = check(reopened, usernames, written)
+            reopened.close()
+
+            failed = failed or missing or duplicated or len(written) != threads * entries
+            print(f"{mode:>8} {seconds:>8.2f} {len(written) / seconds:>9.0f} {missing:>8} {duplicated:>11}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    if failed:
+        sys.exit('history updates were lost')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='json,sharded,sqlite')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--entries', type=int, default=200)
+    parser.add_argument('--shards', type=int, default=8)
+    args = parser.parse_args()
+    run(args.modes.split(','), args.users, args.threads, args.entries, args.shards)
@@ -0,0 +1,70 @@
+"""
+Forward chaining through derivation rules: the naive fixed-point loop
+(InferenceEngine.forward_chain) against the agenda-based ReteNetwork
+
+Run from the backend directory:
+    python -m benchmarks.forward_chaining --rules 1000,10000 --depth 3
+"""
+import argparse
+import random
+import time
+
+from benchmarks.synthetic import make_derivation_rules, symptom_vocabulary
+from inference_engine import InferenceEngine
+from knowledge_base import KnowledgeBase
+from rete import ReteNetwork
+
+
+def make_fact_sets(rules, vocabulary, count, seed=0):
+    """
+    Initial facts: the conditions of a few random first-layer rules plus
+    noise, so that chains actually fire
+    """
+    rng = random.Random(seed)
+    first_layer = [rule for rule in rules if rule['conclusion'].startswith('finding 1-')]
+    fact_sets = []
+    for _ in range(count):
+        facts = rng.sample(vocabulary, 4)
+        for rule in rng.sample(first_layer, min(len(first_layer), 8)):
+            facts += rule['conditions']
+        fact_sets.append(facts)
+    return fact_sets
+
+
+def run(sizes, depth, count, vocabulary_size):
+    engine = InferenceEngine(KnowledgeBase())
+    vocabulary = symptom_vocabulary(vocabulary_size)
+    print(f"{'rules':>8} {'derived':>8} {'loop (ms)':>10} {'rete (ms)':>10} {'speedup':>8}")
+
+    for size in sizes:
+        rules = make_derivation_rules(vocabulary, size, depth)
+        fact_sets = make_fact_sets(rules, vocabulary, count)
+
+        start = time.perf_counter()
+        looped = [engine.forward_chain(facts, rules) for facts in fact_sets]
+        loop_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        network = ReteNetwork(rules)
+        results = [network.run(facts) for facts in fact_sets]
+        rete_seconds = time.perf_counter() - start
+
+        if looped != [known for known, derivations in results]:
+            raise SystemExit("ReteNetwork disagrees with forward_chain")
+        derived = sum(len(derivations) for known, derivations in results) / count
+        print(f"{size:>8} {derived:>8.1f} {loop_seconds * 1000 / count:>10.3f} "
+              f"{rete_seconds * 1000 / count:>10.3f} {loop_seconds / rete_seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', default='100,1000,10000',
+                        help='comma-separated derivation rule counts (default: %(default)s)')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='layers of derived facts (default: %(default)s)')
+    parser.add_argument('--runs', type=int, default=100,
+                        help='fact sets chained per rule count (default: %(default)s)')
+    parser.add_argument('--vocabulary', type=int, default=500,
+                        help='distinct base facts (default: %(default)s)')
+    args = parser.parse_args()
+    run([int(size) for size in args.rules.split(',')], args.depth, args.runs, args.vocabulary)
@@ -0,0 +1,148 @@
+"""
+Per-message latency of symptom extraction with and without fuzzy matching,
+and how many misspelled symptoms the fuzzy matcher recovers
+
+The vocabulary mixes generated symptom phrases with made-up single-word
+terms (so the spelling index holds tens of thousands of distinct words).
+Messages name 1-4 terms; in the misspelled set one word of each has a
+random deletion, insertion, substitution or transposition.
+
+First the matcher of the bundled knowledge base is checked against
+CORRECTIONS, messages with the symptoms they must (and must only) yield:
+ordinary English one edit from a symptom word ("rough" / "cough") must not
+become a symptom. The script exits with an error if any check fails.
+
+Run from the backend directory:
+    python -m benchmarks.fuzzy_matching --terms 50000 --messages 5000
+"""
+import argparse
+import random
+import string
+import sys
+import time
+
+from benchmarks.synthetic import MESSAGE_TEMPLATES, symptom_vocabulary
+from knowledge_base import KnowledgeBase
+from symptom_matcher import SymptomMatcher
+
+SYLLABLES = ['ba', 'co', 'di', 'fe', 'ga', 'hy', 'ki', 'lo', 'ma', 'ne', 'po', 'ra', 'si', 'te',
+             'vu', 'xe', 'zo', 'tri', 'plo', 'scla', 'pneu', 'derm', 'itis', 'osis', 'algia']
+
+CORRECTIONS = [
+    ("i had a rough night", []),
+    ("it has been a tough week", []),
+    ("there were fewer people", []),
+    ("i could never sleep", []),
+    ("i have a feever and diarhea", ['diarrhea', 'fever']),
+    ("terrible headahce since monday", ['headache']),
+    ("i have a sore threat", ['sore throat']),
+    ("shortness of breth when walking", ['shortness of breath'])
+]
+
+
+def check_corrections():
+    """Messages of CORRECTIONS whose symptoms differ from the expected ones"""
+    matcher = KnowledgeBase().get_symptom_matcher()
+    failures = []
+    for text, expected in CORRECTIONS:
+        detected = matcher.find(text)
+        if sorted(detected) != sorted(expected):
+            failures.append((text, expected, detected))
+    return failures
+
+
+def make_terms(count, seed=0):
+    """count distinct terms: half symptom phrases, half made-up words"""
+    rng = random.Random(seed)
+    terms = set(symptom_vocabulary(count // 2, seed))
+    while len(terms) < count:
+        terms.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))))
+    return sorted(terms)
+
+
+def misspell(word, rng):
+    position = rng.randrange(len(word))
+    edit = rng.choice(('delete', 'insert', 'substitute', 'transpose'))
+    if edit == 'delete':
+        return word[:position] + word[position + 1:]
+    if edit == 'insert':
+        return word[:position] + rng.choice(string.ascii_lowercase) + word[position:]
+    if edit == 'substitute':
+        return word[:position] + rng.choice(string.ascii_lowercase) + word[position + 1:]
+    position = min(position, len(word) - 2)
+    return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+
+
+def make_messages(terms, count, typos, seed=0):
+    """(message, terms it names) pairs"""
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        picked = rng.sample(terms, rng.randint(1, 4))
+        written = list(picked)
+        if typos:
+            # One misspelled word per term, among words long enough to be corrected
+            for number, term in enumerate(picked):
+                words = term.split()
+                candidates = [i for i, word in enumerate(words) if len(word) >= 6]
+                if candidates:
+                    i = rng.choice(candidates)
+                    words[i] = misspell(words[i], rng)
+                written[number] = ' '.join(words)
+        text = ', '.join(written[:-1]) + ' and ' + written[-1] if len(written) > 1 else written[0]
+        messages.append((rng.choice(MESSAGE_TEMPLATES).format(symptoms=text).lower(), picked))
+    return messages
+
+
+def time_matcher(matcher, messages):
+    latencies, found = [], 0
+    for text, picked in messages:
+        start = time.perf_counter_ns()
+        detected = matcher.find(text)
+        latencies.append(time.perf_counter_ns() - start)
+        found += len(set(picked).intersection(detected))
+    latencies.sort()
+    return {
+        'p50': latencies[len(latencies) // 2] / 1000,
+        'p99': latencies[int(len(latencies) * 0.99)] / 1000,
+        'mean': sum(latencies) / len(latencies) / 1000,
+        'found': found
+    }
+
+
+def run(term_count, message_count):
+    failures = check_corrections()
+    for text, expected, detected in failures:
+        print(f"{text!r}: expected {expected}, got {detected}")
+    if failures:
+        sys.exit('misspelling corrections are wrong')
+    print(f"{len(CORRECTIONS)} correction checks passed")
+
+    terms = make_terms(term_count)
+    synonyms = KnowledgeBase().symptom_variations
+
+    start = time.perf_counter()
+    exact = SymptomMatcher(terms, synonyms, fuzzy=False)
+    exact_build = time.perf_counter() - start
+    start = time.perf_counter()
+    fuzzy = SymptomMatcher(terms, synonyms)
+    fuzzy_build = time.perf_counter() - start
+
+    print(f"{len(terms)} terms, {len(fuzzy._spelling.words)} distinct words; "
+          f"build {exact_build:.2f}s exact, {fuzzy_build:.2f}s fuzzy")
+    print(f"{'messages':<12} {'matcher':<8} {'p50 us':>8} {'p99 us':>8} {'mean us':>8} {'terms found':>12}")
+    for label, typos in (('clean', False), ('misspelled', True)):
+        messages = make_messages(terms, message_count, typos)
+        total = sum(len(picked) for text, picked in messages)
+        for name, matcher in (('exact', exact), ('fuzzy', fuzzy)):
+            result = time_matcher(matcher, messages)
+            print(f"{label:<12} {name:<8} {result['p50']:>8.1f} {result['p99']:>8.1f} {result['mean']:>8.1f} "
+                  f"{result['found'] / total:>11.1%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--terms', type=int, default=50000)
+    parser.add_argument('--messages', type=int, default=5000)
+    args = parser.parse_args()
+    run(args.terms, args.messages)
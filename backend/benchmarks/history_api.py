@@ -0,0 +1,72 @@
+"""
+Check that malformed history entries posted by clients are stored as sent
+
+Each body of BODIES is posted to /api/history/<user> of the Flask app (with
+history compaction on, the default); the post must succeed and the user's
+history must then read back with every entry as it was sent. The script
+exits with an error if any request fails or an entry comes back changed.
+
+Run from the backend directory:
+    python -m benchmarks.history_api
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+# Lists that look like compact diagnoses, diagnoses that are not a list,
+# values of the wrong type, and one well-formed entry that does get compacted
+BODIES = [
+    {'symptoms': ['fever'], 'diagnoses': [['x']]},
+    {'symptoms': ['fever'], 'diagnoses': [['COVID-19', 5, [7]]]},
+    {'symptoms': ['fever'], 'diagnoses': [['COVID-19', 5, [0]], {'condition': 'Common Cold'}]},
+    {'symptoms': [1], 'diagnoses': [{'condition': 'Common Cold', 'matched_symptoms': [1]}]},
+    {'symptoms': ['fever'], 'diagnoses': [{'condition': 5}]},
+    {'symptoms': ['fever'], 'diagnoses': 'Common Cold'},
+    {'symptoms': ['fever'], 'diagnoses': {'condition': 'Common Cold'}},
+    {'symptoms': ['fever'], 'diagnoses': 5},
+    {'symptoms': ['fever', 'cough'], 'diagnoses': [{
+        'condition': 'Influenza (Flu)', 'confidence': 50.0, 'matched_symptoms': ['fever', 'cough'],
+        'missing_symptoms': ['body ache', 'fatigue', 'headache', 'sore throat'],
+        'description': 'Viral infection affecting respiratory system',
+        'recommendations': 'Rest, fluids, antiviral medication if prescribed within 48 hours'
+    }]}
+]
+
+
+def run():
+    directory = tempfile.mkdtemp()
+    os.environ['USER_DB_PATH'] = os.path.join(directory, 'users_db.json')
+    try:
+        import app
+        client = app.app.test_client()
+        client.post('/api/auth/signup', json={'username': 'checker', 'email': 'checker@example.com',
+                                              'password': 'password'})
+        failures = []
+        for body in BODIES:
+            response = client.post('/api/history/checker', json=body)
+            if response.status_code != 201:
+                failures.append(f"POST {body!r}: status {response.status_code}")
+
+        response = client.get('/api/history/checker')
+        if response.status_code != 200:
+            failures.append(f"GET: status {response.status_code}")
+        else:
+            history = response.get_json()['history']
+            for body, entry in zip(BODIES, history):
+                stored = {key: entry.get(key) for key in body}
+                if stored != body:
+                    failures.append(f"{body!r} read back as {stored!r}")
+        app.user_db.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit('history entries were not stored as sent')
+    print(f"{len(BODIES)} history bodies stored and read back as sent")
+
+
+if __name__ == '__main__':
+    run()
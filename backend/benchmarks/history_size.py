@@ -0,0 +1,60 @@
+"""
+Stored size of medical history entries, full versus compact
+
+Run from the backend directory:
+    python -m benchmarks.history_size --entries 10000
+"""
+import argparse
+import json
+import time
+
+from benchmarks.batch_scoring import make_symptom_lists
+from history_compaction import compact_entry, hydrate_entry
+from inference_engine import InferenceEngine
+from knowledge_base import KnowledgeBase
+
+
+def make_entries(engine, count):
+    """History entries as /api/chat saves them"""
+    entries = []
+    for number, symptoms in enumerate(make_symptom_lists(engine.knowledge_base, count)):
+        entries.append({
+            'timestamp': f'2024-01-01T00:00:{number % 60:02d}.{number:06d}',
+            'symptoms': symptoms,
+            'diagnoses': [diagnosis.to_dict() for diagnosis in engine.diagnose(symptoms)],
+            'session_id': f'session-{number}'
+        })
+    return entries
+
+
+def run(count):
+    knowledge_base = KnowledgeBase()
+    entries = make_entries(InferenceEngine(knowledge_base), count)
+
+    start = time.perf_counter()
+    compacted = [compact_entry(entry, knowledge_base) for entry in entries]
+    compact_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hydrated = [hydrate_entry(entry, knowledge_base) for entry in compacted]
+    hydrate_seconds = time.perf_counter() - start
+
+    if hydrated != entries:
+        raise SystemExit("re-hydrated entries differ from the originals")
+
+    full_bytes = len(json.dumps(entries))
+    compact_bytes = len(json.dumps(compacted))
+    print(f"entries:        {count}")
+    print(f"full:           {full_bytes:>12} bytes ({full_bytes / count:.0f} per entry)")
+    print(f"compact:        {compact_bytes:>12} bytes ({compact_bytes / count:.0f} per entry)")
+    print(f"reduction:      {full_bytes / compact_bytes:>11.1f}x")
+    print(f"compact time:   {compact_seconds * 1e6 / count:>9.1f} us per entry")
+    print(f"hydrate time:   {hydrate_seconds * 1e6 / count:>9.1f} us per entry")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=10000,
+                        help='number of history entries (default: %(default)s)')
+    args = parser.parse_args()
+    run(args.entries)
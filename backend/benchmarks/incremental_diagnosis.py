@@ -0,0 +1,72 @@
+"""
+Multi-turn consultations: diagnose() from scratch each turn versus
+diagnose_incremental() carrying match state between turns
+
+Run from the backend directory:
+    python -m benchmarks.incremental_diagnosis --conditions 10000 --turns 20
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.synthetic import make_knowledge_base
+from inference_engine import InferenceEngine
+
+
+def make_consultations(knowledge_base, count, turns, seed=0):
+    """Symptom lists growing by 1-2 distinct symptoms per turn"""
+    rng = random.Random(seed)
+    vocabulary = knowledge_base.get_all_symptoms()
+    consultations = []
+    for _ in range(count):
+        symptoms = rng.sample(vocabulary, turns * 2)
+        steps, size = [], 0
+        for _ in range(turns):
+            size += rng.randint(1, 2)
+            steps.append(symptoms[:size])
+        consultations.append(steps)
+    return consultations
+
+
+def run(conditions, count, turns):
+    knowledge_base = make_knowledge_base(conditions)
+    engine = InferenceEngine(knowledge_base)
+    consultations = make_consultations(knowledge_base, count, turns)
+
+    start = time.perf_counter()
+    full = [[engine.diagnose(step) for step in steps] for steps in consultations]
+    full_seconds = time.perf_counter() - start
+
+    calls = count * turns
+    print(f"{len(knowledge_base.rules)} conditions, {count} consultations x {turns} turns")
+    print(f"from scratch:        {full_seconds * 1e6 / calls:8.1f} us per turn")
+
+    # The in-memory session store keeps the state as is; the SQLite one
+    # stores it as JSON between requests
+    for label, persist in (('incremental', False), ('incremental, JSON', True)):
+        start = time.perf_counter()
+        incremental = []
+        for steps in consultations:
+            state, results = None, []
+            for step in steps:
+                diagnoses, state = engine.diagnose_incremental(step, state)
+                if persist:
+                    state = json.loads(json.dumps(state))
+                results.append(diagnoses)
+            incremental.append(results)
+        seconds = time.perf_counter() - start
+
+        if full != incremental:
+            raise SystemExit("diagnose_incremental disagrees with diagnose")
+        print(f"{label + ':':<20} {seconds * 1e6 / calls:8.1f} us per turn ({full_seconds / seconds:.2f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--conditions', type=int, default=10000,
+                        help='generated conditions added to the built-in ones (default: %(default)s)')
+    parser.add_argument('--consultations', type=int, default=200)
+    parser.add_argument('--turns', type=int, default=20)
+    args = parser.parse_args()
+    run(args.conditions, args.consultations, args.turns)
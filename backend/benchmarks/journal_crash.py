@@ -0,0 +1,128 @@
+"""
+Crash safety of the journaled JSON store: a torn last journal line is ignored
+
+Two checks, each exiting with an error on failure:
+- torn: a journal is written, then cut at every byte of its last record (as
+  a crash partway through the append would leave it). Reopening must give
+  every earlier entry and no part of the cut one, and a record appended
+  afterwards must survive another reopen.
+- kill: --kills child processes append entries until they are killed with
+  SIGKILL at a random moment. Reopening must give a gapless run of entries
+  (0, 1, ..., n) for each of them.
+
+Run from the backend directory:
+    python -m benchmarks.journal_crash --entries 50 --kills 20
+"""
+import argparse
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+from user_storage import JournaledJSONStorageBackend
+
+USERNAME = 'crash-test'
+
+
+def open_store(directory):
+    return JournaledJSONStorageBackend(os.path.join(directory, 'users_db.json'), fsync='never')
+
+
+def numbers(store):
+    return [entry['number'] for entry in store.get_history(USERNAME)]
+
+
+def check_torn(entries):
+    """Failure messages of the torn-line check"""
+    failures = []
+    template = tempfile.mkdtemp()
+    try:
+        store = open_store(template)
+        store.create_user(USERNAME, {'email': 'crash@example.com', 'password': ''})
+        for number in range(entries):
+            store.append_history(USERNAME, {'number': number})
+        store.close()
+        with open(os.path.join(template, 'users_db.json.journal'), 'rb') as f:
+            journal = f.read()
+        last_record = journal.rindex(b'\n', 0, len(journal) - 1) + 1
+
+        for cut in range(last_record, len(journal)):
+            directory = tempfile.mkdtemp()
+            try:
+                if os.path.exists(os.path.join(template, 'users_db.json')):
+                    shutil.copy(os.path.join(template, 'users_db.json'), directory)
+                with open(os.path.join(directory, 'users_db.json.journal'), 'wb') as f:
+                    f.write(journal[:cut])
+
+                store = open_store(directory)
+                found = numbers(store)
+                store.append_history(USERNAME, {'number': 'after'})
+                store.close()
+                reopened = open_store(directory)
+                after = numbers(reopened)
+                reopened.close()
+
+                expected = list(range(entries - 1))
+                if found != expected:
+                    failures.append(f"cut at byte {cut}: replayed {found[-3:]} instead of ending at {entries - 2}")
+                elif after != expected + ['after']:
+                    failures.append(f"cut at byte {cut}: record appended after the cut was lost or mangled")
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+        print(f"torn: {len(journal) - last_record} cut points checked")
+    finally:
+        shutil.rmtree(template, ignore_errors=True)
+    return failures
+
+
+def check_kill(kills, seed=0):
+    """Failure messages of the kill check"""
+    failures = []
+    rng = random.Random(seed)
+    total = 0
+    for attempt in range(kills):
+        directory = tempfile.mkdtemp()
+        try:
+            store = open_store(directory)
+            store.create_user(USERNAME, {'email': 'crash@example.com', 'password': ''})
+            store.close()
+
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    store = open_store(directory)
+                    number = 0
+                    while True:
+                        store.append_history(USERNAME, {'number': number, 'padding': 'x' * rng.randint(0, 4096)})
+                        number += 1
+                finally:
+                    os._exit(1)
+            time.sleep(rng.uniform(0.01, 0.2))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+            store = open_store(directory)
+            found = numbers(store)
+            store.close()
+            total += len(found)
+            if found != list(range(len(found))):
+                failures.append(f"kill {attempt}: entries are not a gapless run")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(f"kill: {kills} writers killed, {total} entries recovered")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=50)
+    parser.add_argument('--kills', type=int, default=20)
+    args = parser.parse_args()
+    failures = check_torn(args.entries) + check_kill(args.kills)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit('journal recovery is not crash safe')
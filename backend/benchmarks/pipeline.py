@@ -0,0 +1,199 @@
+"""
+Latency and throughput of each stage of the diagnosis pipeline
+
+Stages: symptom extraction, diagnosis (uncached), formatting, UserDatabase
+history writes per storage mode, and end-to-end POST /api/chat through the
+Flask test client. Results are printed as JSON (p50/p99/mean latency in
+microseconds and calls per second per benchmark); with --baseline the run
+fails if any p50 or p99 is more than --max-regression slower.
+
+Run from the backend directory:
+    python -m benchmarks.pipeline --conditions 10000 --output results.json
+    python -m benchmarks.pipeline --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic import make_knowledge_base, make_messages
+from expert_system import MedicalExpertSystem
+from knowledge_base_loader import export_rules_file
+from user_database import UserDatabase
+
+STAGES = ('extract', 'diagnose', 'format', 'storage', 'chat')
+STORAGE_MODES = {'json': 'users_db.json', 'journal': 'users_db.json', 'sharded': 'users_db.json', 'sqlite': 'users.db'}
+
+
+def summarize(latencies_ns, elapsed):
+    ordered = sorted(latencies_ns)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] / 1000
+
+    return {
+        'calls': len(ordered),
+        'p50_us': round(percentile(0.50), 2),
+        'p99_us': round(percentile(0.99), 2),
+        'mean_us': round(sum(ordered) / len(ordered) / 1000, 2),
+        'throughput_per_s': round(len(ordered) / elapsed, 1)
+    }
+
+
+def measure(function, inputs, warmup=50):
+    """Time function(item) for each input, after a few untimed calls"""
+    for item in inputs[:warmup]:
+        function(item)
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        call_start = time.perf_counter_ns()
+        function(item)
+        latencies.append(time.perf_counter_ns() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def bench_storage(expert_system, symptom_lists, users, writes):
+    results = {}
+    entries = [{'symptoms': symptoms, 'diagnoses': expert_system.inference_engine.diagnose(symptoms)}
+               for symptoms in symptom_lists[:writes]]
+    for mode, filename in STORAGE_MODES.items():
+        directory = tempfile.mkdtemp()
+        try:
+            user_db = UserDatabase(os.path.join(directory, filename), mode=mode,
+                                   knowledge_base=expert_system.knowledge_base, password_iterations=1000)
+            for n in range(users):
+                user_db.create_user(f'user{n}', f'user{n}@example.com', 'password')
+            numbered = list(enumerate(entries))
+            results[f'storage_{mode}'] = measure(
+                lambda item: user_db.add_diagnosis_to_history(f'user{item[0] % users}', item[1]),
+                numbered, warmup=0
+            )
+            user_db.close()
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+def bench_chat(knowledge_base, messages, directory):
+    """End-to-end /api/chat; each timed request completes a diagnosis for a logged-in user"""
+    rules_path = os.path.join(directory, 'knowledge_base.json')
+    export_rules_file(knowledge_base, rules_path)
+    os.environ.update({
+        'KNOWLEDGE_BASE_PATH': rules_path,
+        'USER_DB_PATH': os.path.join(directory, 'users.db'),
+        'PASSWORD_HASH_ITERATIONS': '1000'
+    })
+    import app
+
+    client = app.app.test_client()
+    client.post('/api/auth/signup', json={'username': 'bench', 'email': 'bench@example.com', 'password': 'pw'})
+
+    latencies = []
+    for number, message in enumerate(messages):
+        session_id = f'bench-{number}'
+        client.post('/api/chat', json={'session_id': session_id, 'message': 'hello', 'username': 'bench'})
+        call_start = time.perf_counter_ns()
+        response = client.post('/api/chat', json={'session_id': session_id, 'message': message, 'username': 'bench'})
+        latencies.append(time.perf_counter_ns() - call_start)
+        if response.status_code != 200:
+            raise SystemExit(f"/api/chat returned {response.status_code}")
+    app.user_db.close()
+    # Only the diagnosing requests count; the greetings that open each session are untimed
+    return {'chat': summarize(latencies, sum(latencies) / 1e9)}
+
+
+def run(conditions, message_count, stages, users, writes, seed=0):
+    knowledge_base = make_knowledge_base(conditions, seed=seed)
+    expert_system = MedicalExpertSystem(knowledge_base, diagnosis_cache_size=0)
+    messages = make_messages(knowledge_base, message_count, seed)
+    symptom_lists = [expert_system.extract_symptoms(message.lower()) for message in messages]
+    symptom_lists = [symptoms for symptoms in symptom_lists if symptoms]
+    diagnoses = [expert_system.inference_engine.diagnose(symptoms) for symptoms in symptom_lists]
+
+    results = {}
+    if 'extract' in stages:
+        results['extract_symptoms'] = measure(lambda m: expert_system.extract_symptoms(m.lower()), messages)
+    if 'diagnose' in stages:
+        results['diagnose'] = measure(expert_system.inference_engine.diagnose, symptom_lists)
+    if 'format' in stages:
+        results['format_diagnoses'] = measure(expert_system.format_diagnoses, diagnoses)
+    if 'storage' in stages:
+        results.update(bench_storage(expert_system, symptom_lists, users, writes))
+    if 'chat' in stages:
+        directory = tempfile.mkdtemp()
+        try:
+            results.update(bench_chat(knowledge_base, messages, directory))
+        finally:
+            shutil.rmtree(directory)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'conditions': len(knowledge_base.rules),
+            'symptoms': len(knowledge_base.get_all_symptoms()),
+            'messages': len(messages),
+            'seed': seed
+        },
+        'results': results
+    }
+
+
+def find_regressions(report, baseline, max_regression):
+    """Human-readable lines for each p50/p99 more than max_regression slower than the baseline"""
+    regressions = []
+    for name, current in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_us', 'p99_us'):
+            if current[metric] > previous[metric] * (1 + max_regression):
+                regressions.append(f"{name} {metric}: {previous[metric]} -> {current[metric]} "
+                                   f"(+{(current[metric] / previous[metric] - 1) * 100:.0f}%)")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--conditions', type=int, default=1000,
+                        help='generated conditions added to the built-in ones (default: %(default)s)')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='chat messages in the corpus (default: %(default)s)')
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help='comma-separated stages to run (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=100,
+                        help='accounts in the storage benchmark (default: %(default)s)')
+    parser.add_argument('--writes', type=int, default=500,
+                        help='history writes per storage mode (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='allowed slowdown against the baseline, as a fraction (default: %(default)s)')
+    args = parser.parse_args()
+
+    stages = args.stages.split(',')
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    report = run(args.conditions, args.messages, stages, args.users, args.writes, args.seed)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.max_regression)
+        if regressions:
+            print('Performance regressions:', *regressions, sep='\n  ', file=sys.stderr)
+            sys.exit(1)
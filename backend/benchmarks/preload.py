@@ -0,0 +1,144 @@
+"""
+Worker startup time and memory with and without a preloaded knowledge base
+
+Forks --workers processes the way a preforking server does, in three modes:
+- cold: each worker loads the knowledge base itself (from the compiled cache)
+- fork: the parent loads it and the workers inherit it
+- frozen: as fork, after preload_knowledge_base (KnowledgeBase.freeze + gc.freeze)
+
+Each worker handles --messages chat messages and runs a full garbage
+collection (as a long-lived worker eventually does), then reports how long
+it took to be ready and its memory from /proc/self/smaps_rollup: USS (pages
+only it holds, i.e. what each extra worker costs) and PSS (its fair share of
+pages shared with the parent and the other workers). Linux only.
+
+Run from the backend directory:
+    python -m benchmarks.preload --conditions 100000 --workers 4
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import make_knowledge_base, make_messages
+from expert_system import MedicalExpertSystem
+from knowledge_base_loader import export_rules_file, load_knowledge_base
+from preload import preload_knowledge_base
+
+MODES = ('cold', 'fork', 'frozen')
+
+
+def memory_kb():
+    """{'rss', 'pss', 'uss'} of the current process in KiB"""
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty']
+    }
+
+
+def build_system(rules_path):
+    knowledge_base = load_knowledge_base(rules_path)
+    return MedicalExpertSystem(knowledge_base, diagnosis_cache_size=0)
+
+
+def worker(expert_system, rules_path, messages, forked_at, pipe):
+    if expert_system is None:
+        expert_system = build_system(rules_path)
+    ready = time.perf_counter() - forked_at
+
+    for message in messages:
+        session = {'state': 'collecting_symptoms', 'symptoms': []}
+        expert_system.process_input(message, session)
+    gc.collect()
+
+    os.write(pipe, json.dumps(dict(memory_kb(), ready=ready)).encode('utf-8'))
+    os.close(pipe)
+
+
+def run_mode(mode, rules_path, messages, workers):
+    """Fork workers in mode and return their reports plus the parent's setup time"""
+    start = time.perf_counter()
+    expert_system = None
+    if mode != 'cold':
+        expert_system = build_system(rules_path)
+        if mode == 'frozen':
+            preload_knowledge_base(expert_system.knowledge_base)
+    setup = time.perf_counter() - start
+
+    children = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        forked_at = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            try:
+                worker(expert_system, rules_path, messages, forked_at, write_end)
+            finally:
+                os._exit(0)
+        os.close(write_end)
+        children.append((pid, read_end))
+
+    reports = []
+    for pid, read_end in children:
+        with os.fdopen(read_end, 'rb') as f:
+            reports.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return setup, reports
+
+
+def run(conditions, workers, message_count):
+    directory = tempfile.mkdtemp()
+    try:
+        rules_path = os.path.join(directory, 'rules.json')
+        knowledge_base = make_knowledge_base(conditions)
+        messages = make_messages(knowledge_base, message_count)
+        export_rules_file(knowledge_base, rules_path)
+        del knowledge_base
+        # Write the compiled cache so cold workers measure a warm-cache load
+        load_knowledge_base(rules_path)
+
+        print(f"{conditions} generated conditions, {workers} workers, {message_count} messages each")
+        print(f"{'mode':<8} {'parent s':>9} {'ready ms':>9} {'USS MiB':>8} {'PSS MiB':>8} {'RSS MiB':>8}")
+        for mode in MODES:
+            # Each mode runs in its own child so earlier modes do not leave
+            # their objects in the parent that the next one forks from
+            read_end, write_end = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_end)
+                try:
+                    setup, reports = run_mode(mode, rules_path, messages, workers)
+                    os.write(write_end, json.dumps([setup, reports]).encode('utf-8'))
+                finally:
+                    os._exit(0)
+            os.close(write_end)
+            with os.fdopen(read_end, 'rb') as f:
+                setup, reports = json.loads(f.read())
+            os.waitpid(pid, 0)
+
+            def mean(key):
+                return sum(report[key] for report in reports) / len(reports)
+            print(f"{mode:<8} {setup:>9.2f} {mean('ready') * 1000:>9.1f} {mean('uss') / 1024:>8.1f} "
+                  f"{mean('pss') / 1024:>8.1f} {mean('rss') / 1024:>8.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--conditions', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=200)
+    args = parser.parse_args()
+    run(args.conditions, args.workers, args.messages)
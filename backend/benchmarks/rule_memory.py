@@ -0,0 +1,97 @@
+"""
+Memory held by rules and diagnosis results, as dicts versus Rule/Diagnosis
+
+Rules are measured as loaded from a rules file: the dicts parse_rules_file
+returns against the Rule objects KnowledgeBase keeps. Diagnoses are the
+results of --consultations diagnose() calls, as Diagnosis objects and as the
+equivalent dicts; objects owned by the knowledge base (rules, symptom
+strings) are not counted against them. Sizes are deep sizes: every object
+reachable from the measured ones, each counted once.
+
+Run from the backend directory:
+    python -m benchmarks.rule_memory --conditions 100000
+"""
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.batch_scoring import make_symptom_lists
+from benchmarks.synthetic import make_knowledge_base
+from inference_engine import InferenceEngine
+from knowledge_base import KnowledgeBase
+from knowledge_base_loader import export_rules_file, parse_rules_file
+from rules import Rule
+
+
+def deep_size(root, exclude=frozenset()):
+    """Bytes of root and everything it references, skipping the ids in exclude"""
+    seen = set(exclude)
+    pending = [root]
+    total = 0
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return total
+
+
+def reachable_ids(root):
+    """ids of root and everything it references"""
+    seen = set()
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        pending.extend(gc.get_referents(obj))
+    return seen
+
+
+def run(conditions, consultations):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'rules.json')
+        export_rules_file(make_knowledge_base(conditions), path)
+        rule_dicts, symptom_variations, derivation_rules = parse_rules_file(path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    dict_bytes = deep_size(rule_dicts)
+    rule_objects = [Rule.from_dict(rule) for rule in rule_dicts]
+    rule_bytes = deep_size(rule_objects)
+
+    knowledge_base = KnowledgeBase(rule_objects, symptom_variations, derivation_rules)
+    del rule_dicts
+    engine = InferenceEngine(knowledge_base)
+    compiled_bytes = deep_size(knowledge_base.get_compiled(), reachable_ids(rule_objects))
+
+    diagnoses = [engine.diagnose(symptoms) for symptoms in make_symptom_lists(knowledge_base, consultations)]
+    owned = reachable_ids(knowledge_base)
+    objects_bytes = deep_size(diagnoses, owned)
+    as_dicts = [[diagnosis.to_dict() for diagnosis in result] for result in diagnoses]
+    dicts_bytes = deep_size(as_dicts, owned)
+    count = sum(len(result) for result in diagnoses)
+
+    mib = 1024 * 1024
+    print(f"{len(rule_objects)} rules, {consultations} consultations ({count} diagnoses)")
+    print(f"{'':<22} {'dicts MiB':>10} {'objects MiB':>12} {'bytes/item':>16}")
+    print(f"{'rules':<22} {dict_bytes / mib:>10.1f} {rule_bytes / mib:>12.1f} "
+          f"{dict_bytes // len(rule_objects):>7} -> {rule_bytes // len(rule_objects):<6}")
+    print(f"{'diagnoses':<22} {dicts_bytes / mib:>10.1f} {objects_bytes / mib:>12.1f} "
+          f"{dicts_bytes // max(1, count):>7} -> {objects_bytes // max(1, count):<6}")
+    print(f"{'compiled index':<22} {'':>10} {compiled_bytes / mib:>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--conditions', type=int, default=100000)
+    parser.add_argument('--consultations', type=int, default=10000)
+    args = parser.parse_args()
+    run(args.conditions, args.consultations)
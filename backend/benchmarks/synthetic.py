@@ -0,0 +1,97 @@
+"""
+Synthetic knowledge bases and chat messages for benchmarks
+
+Generated knowledge bases keep the built-in rules (so real symptom names
+still match) and add as many generated conditions as asked for, over a
+vocabulary of made-up but plausible symptom phrases.
+"""
+import itertools
+import random
+
+from knowledge_base import KnowledgeBase
+
+QUALIFIERS = ['sharp', 'dull', 'chronic', 'sudden', 'mild', 'severe', 'recurring', 'throbbing',
+              'burning', 'intermittent', 'persistent', 'radiating', 'localized', 'nocturnal']
+BODY_PARTS = ['chest', 'back', 'knee', 'wrist', 'neck', 'shoulder', 'hip', 'ankle', 'jaw', 'ear',
+              'eye', 'scalp', 'elbow', 'stomach', 'pelvic', 'calf', 'thigh', 'finger', 'toe', 'lower back']
+COMPLAINTS = ['pain', 'swelling', 'stiffness', 'numbness', 'tingling', 'itching', 'cramping',
+              'weakness', 'redness', 'tenderness', 'spasms', 'rash']
+
+MESSAGE_TEMPLATES = [
+    "I have {symptoms}",
+    "Hi, I've been having {symptoms} since yesterday",
+    "For the last three days I've had {symptoms} and it's getting worse",
+    "My kid woke up with {symptoms}, what could it be?",
+    "{symptoms}. Also I feel tired all the time",
+    "I think I have {symptoms} but I'm not sure",
+    "Started with {symptoms} this morning after lunch",
+]
+
+
+def symptom_vocabulary(size, seed=0):
+    """size distinct symptom phrases such as 'sudden knee swelling'"""
+    phrases = [' '.join(parts) for parts in itertools.product(QUALIFIERS, BODY_PARTS, COMPLAINTS)]
+    phrases += [' '.join(parts) for parts in itertools.product(BODY_PARTS, COMPLAINTS)]
+    if size > len(phrases):
+        phrases += [f'{phrase} type {n}' for n in range(2, size // len(phrases) + 2) for phrase in phrases]
+    random.Random(seed).shuffle(phrases)
+    return phrases[:size]
+
+
+def make_knowledge_base(conditions, vocabulary_size=None, seed=0):
+    """The built-in knowledge base plus `conditions` generated rules"""
+    rng = random.Random(seed)
+    knowledge_base = KnowledgeBase()
+    vocabulary = symptom_vocabulary(vocabulary_size or max(200, conditions // 2), seed)
+    # Mix in real symptoms so generated conditions overlap with the built-in ones
+    vocabulary += list(knowledge_base.get_all_symptoms())
+
+    rules = list(knowledge_base.rules)
+    for number in range(conditions):
+        symptoms = rng.sample(vocabulary, rng.randint(3, 8))
+        rules.append({
+            'condition': f'Synthetic Condition {number}',
+            'symptoms': symptoms,
+            'required_symptoms': symptoms[:rng.randint(0, 2)],
+            'description': f'Generated condition number {number} for benchmarking.',
+            'recommendations': 'Rest, fluids, and see a doctor if symptoms persist.'
+        })
+    return KnowledgeBase(rules, knowledge_base.symptom_variations)
+
+
+def make_messages(knowledge_base, count, seed=0):
+    """Chat messages naming 1-4 symptoms (or their synonyms) in free text"""
+    rng = random.Random(seed)
+    symptoms = knowledge_base.get_all_symptoms()
+    synonyms = list(knowledge_base.symptom_variations)
+    messages = []
+    for _ in range(count):
+        picked = rng.sample(symptoms, rng.randint(1, 4))
+        if synonyms and rng.random() < 0.3:
+            picked.append(rng.choice(synonyms))
+        text = ', '.join(picked[:-1]) + ' and ' + picked[-1] if len(picked) > 1 else picked[0]
+        messages.append(rng.choice(MESSAGE_TEMPLATES).format(symptoms=text))
+    return messages
+
+
+def make_derivation_rules(vocabulary, count, depth=3, seed=0):
+    """
+    count derivation rules in depth layers: the first concludes findings
+    from 2-4 vocabulary facts, each later layer from 2-4 facts of the layer
+    below plus an occasional one from the vocabulary. Rules are shuffled,
+    so layers are not in firing order.
+    """
+    rng = random.Random(seed)
+    per_layer = max(1, count // depth)
+    lower = list(vocabulary)
+    rules = []
+    for layer in range(1, depth + 1):
+        conclusions = [f'finding {layer}-{number}' for number in range(per_layer)]
+        for conclusion in conclusions:
+            conditions = rng.sample(lower, min(len(lower), rng.randint(2, 4)))
+            if layer > 1 and rng.random() < 0.3:
+                conditions.append(rng.choice(vocabulary))
+            rules.append({'conditions': conditions, 'conclusion': conclusion})
+        lower = conclusions
+    rng.shuffle(rules)
+    return rules
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import sys
+from array import array
+
+from rules import Diagnosis
+
+
+class CompiledKnowledgeBase:
+    """Integer-indexed form of the knowledge base used by the inference engine
+
+    Every symptom gets an integer ID. Each rule's symptoms and required
+    symptoms are stored as small int arrays of those IDs, tested against the
+    set of the user's IDs, so their size follows the rule rather than the
+    vocabulary. An inverted index maps each symptom ID to the rules that
+    mention it, so only rules sharing at least one symptom with the user
+    are ever scored.
+    """
+
+    # score() stops penalizing extra user symptoms once a rule has this many
+    # (min(20, extra * 5)), so further symptoms outside the rule leave its score alone
+    PENALTY_SATURATION = 4
+
+    def __init__(self, rules, version=0):
+        self.version = version
+
+        # Symptom vocabulary (lowercased) <-> integer ID
+        self.symptom_ids = {}
+        self.symptoms = []
+
+        # Per-rule data, indexed by position in the rule list
+        self.rules = list(rules)
+        self.rule_symptoms = []       # lowercased symptoms, original order
+        self.rule_symptom_ids = []    # IDs matching rule_symptoms, as int arrays
+        self.required_ids = []        # sorted distinct IDs of the required symptoms, () if none
+
+        # Inverted index: symptom ID -> rule indexes mentioning it
+        self.symptom_rules = {}
+
+        for rule_index, rule in enumerate(self.rules):
+            symptoms = tuple(sys.intern(s.lower()) for s in rule['symptoms'])
+            if symptoms == rule['symptoms']:
+                # Already lowercase: share the rule's tuple
+                symptoms = rule['symptoms']
+            symptom_ids = array('i', [self._intern(s) for s in symptoms])
+            required_ids = sorted({self._intern(s.lower()) for s in rule.get('required_symptoms', [])})
+
+            self.rule_symptoms.append(symptoms)
+            self.rule_symptom_ids.append(symptom_ids)
+            self.required_ids.append(array('i', required_ids) if required_ids else ())
+
+            # Required symptoms are indexed too: a rule whose required
+            # symptoms are all present scores even without other matches
+            for symptom_id in set(symptom_ids).union(required_ids):
+                self.symptom_rules.setdefault(symptom_id, []).append(rule_index)
+
+        # Identifies the rule set across processes and reloads, for state
+        # that refers to rules by index (see InferenceEngine.diagnose_incremental)
+        self.fingerprint = hashlib.sha1(json.dumps(
+            [[rule['condition'], rule['symptoms'], rule.get('required_symptoms', [])] for rule in self.rules]
+        ).encode('utf-8')).hexdigest()
+
+    def freeze(self):
+        """Replace the per-rule lists with tuples and the ID lists with int arrays (see KnowledgeBase.freeze)"""
+        self.symptoms = tuple(self.symptoms)
+        self.rules = tuple(self.rules)
+        self.rule_symptoms = tuple(self.rule_symptoms)
+        self.rule_symptom_ids = tuple(self.rule_symptom_ids)
+        self.required_ids = tuple(self.required_ids)
+        self.symptom_rules = {symptom_id: array('i', rule_indexes)
+                              for symptom_id, rule_indexes in self.symptom_rules.items()}
+
+    def _intern(self, symptom):
+        """Return the ID for a lowercased symptom, assigning one if new"""
+        symptom_id = self.symptom_ids.get(symptom)
+        if symptom_id is None:
+            symptom_id = len(self.symptoms)
+            self.symptom_ids[symptom] = symptom_id
+            self.symptoms.append(symptom)
+        return symptom_id
+
+    def lookup(self, user_symptoms):
+        """Symptom IDs (None when unknown) and the set of known IDs for lowercased user symptoms"""
+        user_ids = [self.symptom_ids.get(s) for s in user_symptoms]
+        user_set = set(user_ids)
+        user_set.discard(None)
+        return user_ids, user_set
+
+    def match(self, user_symptoms):
+        """
+        Match lowercased user symptoms against the rules
+        Returns (symptom IDs, user ID set, {rule index: matched count}) where
+        the IDs list holds None for symptoms unknown to the knowledge base.
+        Counts follow the user's list, so repeated symptoms count repeatedly.
+        """
+        user_ids, user_set = self.lookup(user_symptoms)
+        matched_counts = {}
+        self.add_matches(user_ids, matched_counts)
+        return user_ids, user_set, matched_counts
+
+    def add_matches(self, symptom_ids, matched_counts):
+        """Count more symptom IDs (None is skipped) into a {rule index: matched count} dict"""
+        for symptom_id in symptom_ids:
+            if symptom_id is None:
+                continue
+            for rule_index in self.symptom_rules.get(symptom_id, ()):
+                if symptom_id in self.rule_symptom_ids[rule_index]:
+                    matched_counts[rule_index] = matched_counts.get(rule_index, 0) + 1
+                else:
+                    # Only a required symptom of this rule; make it a candidate
+                    matched_counts.setdefault(rule_index, 0)
+
+    def score(self, rule_index, matched_count, user_set, user_count):
+        """
+        Confidence for one rule, identical to InferenceEngine.calculate_match_score
+        """
+        required_ids = self.required_ids[rule_index]
+        if required_ids and not user_set.issuperset(required_ids):
+            return 0
+
+        rule_size = len(self.rule_symptoms[rule_index])
+        if rule_size > 0:
+            base_confidence = (matched_count / rule_size) * 100
+
+            # Bonus for matching required symptoms
+            if required_ids:
+                base_confidence = min(100, base_confidence + 10)
+
+            # Penalty if user has many symptoms not in the rule
+            extra_symptoms = user_count - matched_count
+            if extra_symptoms > 0:
+                penalty = min(20, extra_symptoms * 5)
+                base_confidence = max(0, base_confidence - penalty)
+        else:
+            base_confidence = 0
+
+        return round(base_confidence, 2)
+
+    def matched_symptoms(self, rule_index, user_symptoms, user_ids):
+        """User symptoms present in the rule, in the user's order"""
+        rule_ids = self.rule_symptom_ids[rule_index]
+        return [
+            symptom for symptom, symptom_id in zip(user_symptoms, user_ids)
+            if symptom_id is not None and symptom_id in rule_ids
+        ]
+
+    def missing_symptoms(self, rule_index, user_set):
+        """Rule symptoms the user does not have, in the rule's order"""
+        return [
+            symptom for symptom, symptom_id
+            in zip(self.rule_symptoms[rule_index], self.rule_symptom_ids[rule_index])
+            if symptom_id not in user_set
+        ]
+
+    def diagnosis(self, rule_index, confidence, user_symptoms, user_ids, user_set):
+        """Build the Diagnosis returned by InferenceEngine.diagnose for one rule"""
+        return Diagnosis(
+            self.rules[rule_index],
+            confidence,
+            self.matched_symptoms(rule_index, user_symptoms, user_ids),
+            self.missing_symptoms(rule_index, user_set)
+        )
@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from expert_system import MedicalExpertSystem
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# The expert system of a worker process, built once by _init_worker
+_worker_system = None
+
+
+def _init_worker(knowledge_base, top_k, min_confidence, inference_mode):
+    global _worker_system
+    _worker_system = MedicalExpertSystem(
+        knowledge_base, diagnosis_cache_size=0,
+        top_k=top_k, min_confidence=min_confidence, inference_mode=inference_mode
+    )
+    # Build the compiled rules and symptom matcher before the first batch
+    knowledge_base.get_compiled()
+    knowledge_base.get_symptom_matcher()
+
+
+def _diagnose_chunk(inputs, top_k, min_confidence):
+    # Diagnoses reference their rules; send plain dicts rather than pickling those
+    results = _worker_system.diagnose_many(inputs, top_k, min_confidence)
+    for result in results:
+        result['diagnoses'] = [diagnosis.to_dict() for diagnosis in result['diagnoses']]
+    return results
+
+
+def _start_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class DiagnosisPool:
+    """Runs MedicalExpertSystem.diagnose_many for large batches on worker processes
+
+    Each worker is started with its own copy of the expert system's
+    knowledge base, so a batch only ships its inputs and results between
+    processes. Batches smaller than min_parallel, or any batch when workers
+    is 0, run in the calling process. workers defaults to one per CPU. The processes are started on first
+    use and restarted if the knowledge base's rules change afterwards.
+
+    Workers are started with forkserver (spawn where it is unavailable)
+    rather than fork: the server process runs background threads (history
+    writer, knowledge base watcher) and forking it could copy a lock one of
+    them holds into a worker.
+    """
+
+    def __init__(self, expert_system, workers=None, min_parallel=256, min_chunk_size=64):
+        self.expert_system = expert_system
+        if workers is None:
+            # One worker per CPU; with a single CPU the processes only add overhead
+            cpus = os.cpu_count() or 1
+            workers = cpus if cpus > 1 else 0
+        self.workers = workers
+        self.min_parallel = min_parallel
+        self.min_chunk_size = min_chunk_size
+        self._executor = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        knowledge_base = self.expert_system.knowledge_base
+        with self._lock:
+            if self._executor is not None and self._version != knowledge_base.version:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=_start_context(),
+                    initializer=_init_worker,
+                    initargs=(knowledge_base, self.expert_system.top_k, self.expert_system.min_confidence,
+                              self.expert_system.inference_mode)
+                )
+                self._version = knowledge_base.version
+            return self._executor
+
+    @timed('diagnosis_pool')
+    def diagnose(self, inputs, top_k=None, min_confidence=None):
+        """Same results as expert_system.diagnose_many(inputs, top_k, min_confidence)"""
+        inputs = list(inputs)
+        if self.workers <= 0 or len(inputs) < self.min_parallel:
+            return self.expert_system.diagnose_many(inputs, top_k, min_confidence)
+
+        # One chunk per worker, unless that makes chunks too small to be
+        # worth the round trip
+        chunk_size = max(self.min_chunk_size, -(-len(inputs) // self.workers))
+        chunks = [inputs[start:start + chunk_size] for start in range(0, len(inputs), chunk_size)]
+        executor = self._get_executor()
+        futures = [executor.submit(_diagnose_chunk, chunk, top_k, min_confidence) for chunk in chunks]
+
+        results = []
+        try:
+            for future in futures:
+                results.extend(future.result())
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next batch
+            logger.error("Diagnosis worker pool broke; it will be restarted")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        return results
+
+    def close(self, wait=True):
+        """Stop the worker processes; with wait=False, batches in progress still finish"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
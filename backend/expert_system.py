@@ -1,18 +1,33 @@
-import re
 from knowledge_base import KnowledgeBase
 from inference_engine import InferenceEngine
+from metrics import timed
 
 class MedicalExpertSystem:
     """Main expert system for medical diagnosis"""
     
-    def __init__(self):
-        self.knowledge_base = KnowledgeBase()
-        self.inference_engine = InferenceEngine(self.knowledge_base)
+    # 'direct' matches symptoms against the diagnostic rules; 'forward_chaining'
+    # first derives intermediate facts with the knowledge base's derivation rules
+    INFERENCE_MODES = ('direct', 'forward_chaining')
+    
+    def __init__(self, knowledge_base=None, diagnosis_cache_size=1024, top_k=5, min_confidence=0,
+                 inference_mode='direct'):
+        if inference_mode not in self.INFERENCE_MODES:
+            raise ValueError(f"inference_mode must be one of {', '.join(self.INFERENCE_MODES)}")
+        self.inference_mode = inference_mode
+        self.knowledge_base = knowledge_base if knowledge_base is not None else KnowledgeBase()
+        self.inference_engine = InferenceEngine(self.knowledge_base, cache_size=diagnosis_cache_size)
+        # Default number of diagnoses shown and the lowest confidence shown
+        self.top_k = top_k
+        self.min_confidence = min_confidence
         self.greeting_keywords = ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening']
         self.symptom_keywords = ['symptom', 'feel', 'pain', 'ache', 'hurt', 'sick', 'fever', 'cough']
     
-    def process_input(self, user_input, session):
-        """Process user input and return appropriate response"""
+    @timed('process_input')
+    def process_input(self, user_input, session, top_k=None, min_confidence=None):
+        """
+        Process user input and return appropriate response
+        top_k and min_confidence override the system defaults for this call
+        """
         user_input_lower = user_input.lower().strip()
         
         # Handle greetings
@@ -33,17 +48,29 @@ class MedicalExpertSystem:
                     if symptom not in session['symptoms']:
                         session['symptoms'].append(symptom)
                 
-                # Run inference to get possible diagnoses
-                diagnoses = self.inference_engine.diagnose(session['symptoms'])
+                top_k = self.top_k if top_k is None else top_k
+                min_confidence = self.min_confidence if min_confidence is None else min_confidence
+                derived = []
+                if self.inference_mode == 'forward_chaining':
+                    diagnoses, derived = self.inference_engine.diagnose_chained(
+                        session['symptoms'], top_k, min_confidence
+                    )
+                else:
+                    # Run inference to get possible diagnoses, re-matching only
+                    # the rules affected by the symptoms added since last turn
+                    diagnoses, session['match_state'] = self.inference_engine.diagnose_incremental(
+                        session['symptoms'], session.get('match_state'), top_k, min_confidence
+                    )
                 
                 if diagnoses:
                     # Format diagnosis results
                     diagnosis_text = self.format_diagnoses(diagnoses)
                     
                     session['state'] = 'diagnosis_complete'
+                    findings = f", which point to {', '.join(derived)}" if derived else ''
                     
                     return {
-                        'message': f"Based on the symptoms you've described ({', '.join(session['symptoms'])}), here are the possible conditions:\n\n{diagnosis_text}\n\n⚠️ **Important:** This is an AI-assisted preliminary assessment and should not replace professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment.\n\nWould you like to start a new consultation?",
+                        'message': f"Based on the symptoms you've described ({', '.join(session['symptoms'])}){findings}, here are the possible conditions:\n\n{diagnosis_text}\n\n⚠️ **Important:** This is an AI-assisted preliminary assessment and should not replace professional medical advice. Please consult a healthcare provider for proper diagnosis and treatment.\n\nWould you like to start a new consultation?",
                         'diagnosis': diagnoses,
                         'suggestions': ['Start new consultation', 'Tell me more about these conditions', 'What should I do next?']
                     }
@@ -62,6 +89,7 @@ class MedicalExpertSystem:
         if session['state'] == 'diagnosis_complete':
             if 'new' in user_input_lower or 'start' in user_input_lower or 'again' in user_input_lower:
                 session['symptoms'] = []
+                session.pop('match_state', None)
                 session['state'] = 'collecting_symptoms'
                 return {
                     'message': "Let's start fresh. What symptoms are you experiencing?",
@@ -78,48 +106,51 @@ class MedicalExpertSystem:
             'suggestions': ['Start consultation', 'List my symptoms', 'Get help']
         }
     
+    @timed('extract_symptoms')
     def extract_symptoms(self, text):
         """Extract symptoms from user input text"""
-        detected_symptoms = []
-        all_symptoms = self.knowledge_base.get_all_symptoms()
-        
-        # Check for each known symptom in the text
-        for symptom in all_symptoms:
-            # Create pattern that matches the symptom with word boundaries
-            pattern = r'\b' + re.escape(symptom.lower()) + r'\b'
-            if re.search(pattern, text):
-                detected_symptoms.append(symptom)
-        
-        # Also check for common variations and synonyms
-        symptom_variations = {
-            'fever': ['temperature', 'hot', 'burning up'],
-            'headache': ['head pain', 'head hurts', 'migraine'],
-            'cough': ['coughing', 'coughed'],
-            'fatigue': ['tired', 'exhausted', 'weak', 'weakness'],
-            'nausea': ['feel sick', 'queasy', 'sick to stomach'],
-            'sore throat': ['throat pain', 'throat hurts'],
-            'runny nose': ['nose running', 'nasal discharge'],
-            'body ache': ['body pain', 'muscle pain', 'aches'],
-            'shortness of breath': ['hard to breathe', 'breathing difficulty', 'can\'t breathe'],
-            'chest pain': ['chest hurts', 'chest discomfort'],
-            'dizziness': ['dizzy', 'lightheaded', 'vertigo'],
-            'vomiting': ['throwing up', 'vomit', 'puking'],
-            'diarrhea': ['loose stool', 'stomach runs'],
-            'abdominal pain': ['stomach pain', 'belly pain', 'stomach ache'],
-            'loss of appetite': ['not hungry', 'don\'t want to eat'],
-            'chills': ['shivering', 'cold sweats'],
-            'confusion': ['confused', 'disoriented'],
-            'rash': ['skin rash', 'skin irritation', 'red spots']
-        }
-        
-        for symptom, variations in symptom_variations.items():
-            for variation in variations:
-                if variation in text and symptom not in detected_symptoms:
-                    detected_symptoms.append(symptom)
-                    break
-        
-        return detected_symptoms
-    
+        # Known symptoms (whole words) and their common variations and
+        # synonyms are all found in a single pass over the text
+        return self.knowledge_base.get_symptom_matcher().find(text)
+
+    @timed('diagnose_many')
+    def diagnose_many(self, inputs, top_k=None, min_confidence=None):
+        """
+        Stateless diagnosis of independent inputs, each a list of symptoms or
+        a free-text message to extract them from
+        Returns one {'symptoms', 'diagnoses'} dict per input (plus
+        'derived_facts' in the forward_chaining mode), without any text
+        formatting. top_k and min_confidence default to the system's.
+        """
+        top_k = self.top_k if top_k is None else top_k
+        min_confidence = self.min_confidence if min_confidence is None else min_confidence
+
+        symptom_lists = [
+            self.extract_symptoms(item.lower()) if isinstance(item, str) else list(item)
+            for item in inputs
+        ]
+        scored_lists = symptom_lists
+        if self.inference_mode == 'forward_chaining':
+            derived_lists = [
+                [fact for fact, rule in self.inference_engine.derive_facts(symptoms)]
+                for symptoms in symptom_lists
+            ]
+            scored_lists = [symptoms + derived for symptoms, derived in zip(symptom_lists, derived_lists)]
+
+        # Rankings are sorted, so dropping low scores after the top-k cut
+        # gives the same result as diagnose(..., min_confidence)
+        results = []
+        for number, diagnoses in enumerate(self.inference_engine.diagnose_batch(scored_lists, top_k)):
+            result = {
+                'symptoms': symptom_lists[number],
+                'diagnoses': [d for d in diagnoses if d['confidence'] >= min_confidence]
+            }
+            if scored_lists is not symptom_lists:
+                result['derived_facts'] = derived_lists[number]
+            results.append(result)
+        return results
+
+    @timed('format_diagnoses')
     def format_diagnoses(self, diagnoses):
         """Format diagnosis results for display"""
         if not diagnoses:
@@ -0,0 +1,134 @@
+"""
+Compact storage form for medical history entries
+
+A history entry saved by /api/chat embeds full diagnosis dicts, including
+the description, recommendations and missing symptoms that are already in
+the knowledge base. In compact form each diagnosis is stored as
+
+    [condition ID, confidence, [indexes of matched symptoms in entry['symptoms']]]
+
+and the rest is re-hydrated from the knowledge base when the entry is read.
+A diagnosis is only compacted when re-hydrating it reproduces it exactly;
+anything else (e.g. a condition the knowledge base does not know) is kept
+as the original dict. Entries come from clients, so a diagnosis whose
+condition or an entry whose symptoms are not strings is kept as is too, and
+so is an entry whose diagnoses already contain lists.
+
+Entries holding compact diagnoses carry COMPACT_KEY, and only those are
+hydrated: lists a client stored in an unmarked entry are returned as
+stored. A compact diagnosis that does not have the expected shape is
+returned as stored as well.
+
+Existing databases can be converted in place with:
+    python history_compaction.py users_db.json
+"""
+import sys
+
+# Marks entries whose diagnoses were compacted, with the format version
+COMPACT_KEY = 'compact'
+COMPACT_FORMAT = 1
+
+
+def compact_diagnosis(diagnosis, symptoms, knowledge_base):
+    """Compact form of one diagnosis dict, or the dict itself if it can't be compacted"""
+    if not isinstance(diagnosis, dict) or not isinstance(diagnosis.get('condition', ''), str):
+        return diagnosis
+    rule = knowledge_base.get_condition_info(diagnosis.get('condition', ''))
+    if rule is None:
+        return diagnosis
+
+    user_symptoms = [s.lower() for s in symptoms]
+    positions = {}
+    for index, symptom in enumerate(user_symptoms):
+        positions.setdefault(symptom, index)
+    try:
+        matched = [positions[s] for s in diagnosis['matched_symptoms']]
+    except (KeyError, TypeError):
+        return diagnosis
+
+    compact = [knowledge_base.get_condition_id(rule), diagnosis.get('confidence'), matched]
+    if hydrate_diagnosis(compact, user_symptoms, knowledge_base) != diagnosis:
+        return diagnosis
+    return compact
+
+
+def hydrate_diagnosis(compact, user_symptoms, knowledge_base):
+    """Full diagnosis dict from its compact form (user_symptoms lowercased), or compact as is if malformed"""
+    if not _is_compact(compact, len(user_symptoms)):
+        return compact
+    condition_id, confidence, matched = compact
+    rule = knowledge_base.get_rule_by_id(condition_id)
+    if rule is None:
+        # The condition has since been removed from the knowledge base
+        return {
+            'condition': condition_id,
+            'confidence': confidence,
+            'matched_symptoms': [user_symptoms[i] for i in matched],
+            'missing_symptoms': [],
+            'description': '',
+            'recommendations': ''
+        }
+    return {
+        'condition': rule['condition'],
+        'confidence': confidence,
+        'matched_symptoms': [user_symptoms[i] for i in matched],
+        'missing_symptoms': [s.lower() for s in rule['symptoms'] if s.lower() not in user_symptoms],
+        'description': rule.get('description', ''),
+        'recommendations': rule.get('recommendations', '')
+    }
+
+
+def _is_compact(compact, symptom_count):
+    """True if compact is a [condition ID, confidence, matched indexes] list that fits the entry"""
+    if not isinstance(compact, list) or len(compact) != 3:
+        return False
+    condition_id, confidence, matched = compact
+    if not isinstance(condition_id, (str, int)) or not isinstance(matched, list):
+        return False
+    return all(type(i) is int and 0 <= i < symptom_count for i in matched)
+
+
+def compact_entry(entry, knowledge_base):
+    """Copy of a history entry with its diagnoses in compact form where possible"""
+    if COMPACT_KEY in entry:
+        return entry
+    symptoms = entry.get('symptoms', [])
+    diagnoses = entry.get('diagnoses', [])
+    if not isinstance(symptoms, list) or not isinstance(diagnoses, list):
+        return entry
+    if not all(isinstance(s, str) for s in symptoms) or any(isinstance(d, list) for d in diagnoses):
+        return entry
+    compacted_diagnoses = [compact_diagnosis(d, symptoms, knowledge_base) for d in diagnoses]
+    if not any(isinstance(d, list) for d in compacted_diagnoses):
+        return entry
+    compacted = dict(entry, diagnoses=compacted_diagnoses)
+    compacted[COMPACT_KEY] = COMPACT_FORMAT
+    return compacted
+
+
+def hydrate_entry(entry, knowledge_base):
+    """Copy of a history entry with compact diagnoses expanded to full dicts"""
+    if entry.get(COMPACT_KEY) != COMPACT_FORMAT:
+        return entry
+    user_symptoms = [s.lower() for s in entry['symptoms']]
+    hydrated = {key: value for key, value in entry.items() if key != COMPACT_KEY}
+    hydrated['diagnoses'] = [hydrate_diagnosis(d, user_symptoms, knowledge_base) for d in entry['diagnoses']]
+    return hydrated
+
+
+if __name__ == '__main__':
+    from knowledge_base import KnowledgeBase
+    from user_database import UserDatabase
+
+    if len(sys.argv) not in (2, 3):
+        sys.exit('usage: python history_compaction.py <users db> [knowledge base file]')
+    if len(sys.argv) == 3:
+        from knowledge_base_loader import load_knowledge_base
+        knowledge_base = load_knowledge_base(sys.argv[2])
+    else:
+        knowledge_base = KnowledgeBase()
+
+    user_db = UserDatabase(sys.argv[1], knowledge_base=knowledge_base)
+    entries = user_db.compact_history()
+    user_db.close()
+    print(f'Compacted {entries} history entries in {sys.argv[1]}')
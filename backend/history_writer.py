@@ -0,0 +1,216 @@
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Writers to reset in forked children, which inherit their queue but not their thread
+_writers = weakref.WeakSet()
+
+
+class HistoryWriteBehind:
+    """Background batching of history appends for UserDatabase
+
+    submit() queues an entry and returns at once. A flusher thread writes
+    queued entries with one StorageBackend.append_history_batch call as soon
+    as batch_size entries are waiting or the oldest has waited batch_delay
+    seconds. When max_pending entries are queued, submit() blocks until the
+    flusher catches up (backpressure). close() writes everything still queued.
+
+    A batch whose write fails goes back to the front of the queue and is
+    tried again after batch_delay, up to retries more times per entry.
+    Entries still failing after that are dropped and logged; they are counted
+    in stats() ('entries_lost'), and flush() and close() return how many were
+    dropped while they waited.
+
+    The flusher thread starts on the first submit(). A process forked from
+    one using the writer (e.g. a gunicorn --preload worker) starts with an
+    empty queue and its own flusher; entries queued before the fork are
+    written by the parent.
+    """
+
+    def __init__(self, backend, batch_size=100, batch_delay=0.05, max_pending=10000, retries=3):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_pending = max_pending
+        self.retries = retries
+
+        self._closed = False
+        self._reset()
+        _writers.add(self)
+
+    def _reset(self):
+        """Empty queue, zeroed counters and no flusher thread yet"""
+        # (username, entry, failed attempts so far)
+        self._pending = []
+        # Entries taken by the flusher but not yet written
+        self._in_flight = []
+        self._pending_users = Counter()
+        self._oldest = None
+        # Threads blocked in flush(); while any are, batches are written without delay
+        self._flush_waiters = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+        self.flushes = 0
+        self.entries_flushed = 0
+        self.largest_batch = 0
+        self.flush_seconds = 0.0
+        self.failures = 0
+        self.retried = 0
+        self.entries_lost = 0
+        self.backpressure_waits = 0
+        self.backpressure_seconds = 0.0
+
+    def submit(self, username, entry):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("history writer is closed")
+            if len(self._pending) + len(self._in_flight) >= self.max_pending:
+                self.backpressure_waits += 1
+                start = time.monotonic()
+                while len(self._pending) + len(self._in_flight) >= self.max_pending:
+                    self._condition.wait()
+                self.backpressure_seconds += time.monotonic() - start
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((username, entry, 0))
+            self._pending_users[username] += 1
+            # Wake the flusher to start the batch_delay timer or write a full batch
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._condition.notify_all()
+
+    def has_pending(self, username):
+        """True while an entry for username is queued or being written"""
+        with self._condition:
+            return self._pending_users[username] > 0
+
+    def flush(self):
+        """
+        Block until everything submitted so far has been written or given up on
+        Returns the number of entries dropped after failed writes meanwhile.
+        """
+        with self._condition:
+            lost_before = self.entries_lost
+            self._flush_waiters += 1
+            self._condition.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    self._condition.wait()
+            finally:
+                self._flush_waiters -= 1
+            return self.entries_lost - lost_before
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending:
+                        wait = self._oldest + self.batch_delay - time.monotonic()
+                        if (self._closed or self._flush_waiters or len(self._pending) >= self.batch_size
+                                or wait <= 0):
+                            break
+                        self._condition.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._condition.wait()
+
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                self._in_flight = batch
+                self._oldest = time.monotonic() if self._pending else None
+
+            start = time.monotonic()
+            try:
+                self.backend.append_history_batch([(username, entry) for username, entry, _ in batch])
+            except Exception:
+                logger.exception("Failed to write %d history entries", len(batch))
+                failed = True
+            else:
+                failed = False
+            elapsed = time.monotonic() - start
+            metrics.observe('history_flush', elapsed)
+
+            with self._condition:
+                self._in_flight = []
+                done = batch
+                if failed:
+                    self.failures += 1
+                    retry = [(username, entry, attempts + 1) for username, entry, attempts in batch
+                             if attempts < self.retries]
+                    done = [item for item in batch if item[2] >= self.retries]
+                    if retry:
+                        # Back to the front of the queue, written again after batch_delay
+                        self.retried += len(retry)
+                        self._pending[:0] = retry
+                        self._oldest = time.monotonic()
+                    if done:
+                        self.entries_lost += len(done)
+                        logger.error("Dropped %d history entries after %d failed writes: %r",
+                                     len(done), self.retries + 1, [(username, entry) for username, entry, _ in done])
+                for username, _, _ in done:
+                    self._pending_users[username] -= 1
+                    if not self._pending_users[username]:
+                        del self._pending_users[username]
+                self.flushes += 1
+                self.flush_seconds += elapsed
+                if not failed:
+                    self.entries_flushed += len(batch)
+                    self.largest_batch = max(self.largest_batch, len(batch))
+                self._condition.notify_all()
+
+    def close(self):
+        """
+        Write everything still queued and stop the flusher
+        Returns the number of entries dropped after failed writes meanwhile.
+        """
+        with self._condition:
+            if self._closed:
+                return 0
+            self._closed = True
+            lost_before = self.entries_lost
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        lost = self.entries_lost - lost_before
+        if lost:
+            logger.error("%d history entries could not be written before closing", lost)
+        return lost
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._pending) + len(self._in_flight),
+                'max_pending': self.max_pending,
+                'flushes': self.flushes,
+                'entries_flushed': self.entries_flushed,
+                'largest_batch': self.largest_batch,
+                'average_batch': self.entries_flushed / self.flushes if self.flushes else 0.0,
+                'flush_seconds': self.flush_seconds,
+                'failures': self.failures,
+                'retried': self.retried,
+                'entries_lost': self.entries_lost,
+                'backpressure_waits': self.backpressure_waits,
+                'backpressure_seconds': self.backpressure_seconds
+            }
+
+
+def _reset_after_fork():
+    for writer in list(_writers):
+        if not writer._closed:
+            writer._reset()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,13 +1,25 @@
+import heapq
+
+from batch_scoring import BatchScorer
+from diagnosis_cache import DiagnosisCache
+from metrics import timed
+
 class InferenceEngine:
     """Rule-based inference engine using forward chaining"""
     
-    def __init__(self, knowledge_base):
+    def __init__(self, knowledge_base, cache_size=0):
         self.knowledge_base = knowledge_base
+        self._batch_scorer = None
+        
+        # Optional LRU cache of rankings keyed on the set of symptoms
+        self.cache = DiagnosisCache(cache_size) if cache_size > 0 else None
     
-    def diagnose(self, user_symptoms):
+    @timed('diagnose')
+    def diagnose(self, user_symptoms, top_k=5, min_confidence=0):
         """
         Perform diagnosis using forward chaining algorithm
-        Returns a list of possible conditions with confidence scores
+        Returns up to top_k possible conditions with confidence scores of at
+        least min_confidence, highest first
         """
         if not user_symptoms:
             return []
@@ -15,28 +27,176 @@ class InferenceEngine:
         # Normalize user symptoms to lowercase for comparison
         user_symptoms_lower = [s.lower() for s in user_symptoms]
         
-        diagnoses = []
-        rules = self.knowledge_base.get_rules()
+        compiled = self.knowledge_base.get_compiled()
+        user_ids, user_set = compiled.lookup(user_symptoms_lower)
         
-        for rule in rules:
-            # Check if this rule matches the symptoms
-            match_score = self.calculate_match_score(user_symptoms_lower, rule)
-            
-            if match_score['confidence'] > 0:
-                diagnoses.append({
-                    'condition': rule['condition'],
-                    'confidence': match_score['confidence'],
-                    'matched_symptoms': match_score['matched_symptoms'],
-                    'missing_symptoms': match_score['missing_symptoms'],
-                    'description': rule.get('description', ''),
-                    'recommendations': rule.get('recommendations', '')
-                })
-        
-        # Sort by confidence score (highest first)
-        diagnoses.sort(key=lambda x: x['confidence'], reverse=True)
-        
-        # Return top 5 diagnoses
-        return diagnoses[:5]
+        cache_key = self._cache_key(user_symptoms_lower, top_k, min_confidence)
+        ranking = self.cache.get(cache_key, compiled.version) if cache_key is not None else None
+        if ranking is None:
+            ranking = self._rank(compiled, user_symptoms_lower, top_k, min_confidence)
+            if cache_key is not None:
+                self.cache.put(cache_key, compiled.version, ranking)
+        
+        return [
+            compiled.diagnosis(rule_index, confidence, user_symptoms_lower, user_ids, user_set)
+            for confidence, rule_index in ranking
+        ]
+    
+    @timed('diagnose')
+    def diagnose_incremental(self, user_symptoms, state=None, top_k=5, min_confidence=0):
+        """
+        diagnose() for a symptom list that only grows between calls, such as
+        a consultation's accumulated symptoms
+        Returns (diagnoses, state); pass state back on the next call. Matched
+        counts and scores of candidate rules are kept in the state, and only
+        rules mentioning a newly added symptom, or whose extra-symptom
+        penalty can still grow, are scored again. The state is a
+        JSON-serializable dict tied to the knowledge base it was built for,
+        and is rebuilt when that changes or the list no longer starts with
+        the symptoms it has seen.
+        A first call (no state) shares the diagnosis cache with diagnose().
+        A cache hit has no state to return (the cache only keeps rankings),
+        so it returns None and the next call, if any, starts afresh.
+        """
+        if not user_symptoms:
+            return [], None
+        
+        user_symptoms_lower = [s.lower() for s in user_symptoms]
+        user_count = len(user_symptoms_lower)
+        compiled = self.knowledge_base.get_compiled()
+        
+        cache_key = self._cache_key(user_symptoms_lower, top_k, min_confidence) if state is None else None
+        if cache_key is not None:
+            ranking = self.cache.get(cache_key, compiled.version)
+            if ranking is not None:
+                user_ids, user_set = compiled.lookup(user_symptoms_lower)
+                return [
+                    compiled.diagnosis(rule_index, confidence, user_symptoms_lower, user_ids, user_set)
+                    for confidence, rule_index in ranking
+                ], None
+        
+        seen = state['symptoms'] if state and state.get('kb') == compiled.fingerprint else None
+        if seen is None or user_symptoms_lower[:len(seen)] != seen:
+            seen, matched_counts, scores, unsaturated = [], {}, {}, ()
+        else:
+            matched_counts = dict(zip(state['rules'], state['counts']))
+            scores = dict(zip(state['rules'], state['scores']))
+            unsaturated = state['unsaturated']
+        seen_count = len(seen)
+        
+        new_ids = [compiled.symptom_ids.get(s) for s in user_symptoms_lower[seen_count:]]
+        touched = set()
+        for symptom_id in new_ids:
+            if symptom_id is not None:
+                touched.update(compiled.symptom_rules.get(symptom_id, ()))
+        compiled.add_matches(new_ids, matched_counts)
+        user_ids, user_set = compiled.lookup(user_symptoms_lower)
+        
+        # Other rules keep their match count and already take the full
+        # penalty for extra symptoms, so their scores cannot have changed
+        touched.update(unsaturated)
+        for rule_index in touched:
+            scores[rule_index] = compiled.score(rule_index, matched_counts[rule_index], user_set, user_count)
+        unsaturated = [
+            rule_index for rule_index in touched
+            if user_count - matched_counts[rule_index] < compiled.PENALTY_SATURATION
+        ]
+        
+        # Highest confidence first; ties keep rule order
+        ranking = heapq.nsmallest(top_k, (
+            (-confidence, rule_index) for rule_index, confidence in scores.items()
+            if confidence > 0 and confidence >= min_confidence
+        ))
+        diagnoses = [
+            compiled.diagnosis(rule_index, -confidence, user_symptoms_lower, user_ids, user_set)
+            for confidence, rule_index in ranking
+        ]
+        if cache_key is not None:
+            self.cache.put(cache_key, compiled.version,
+                           tuple((-confidence, rule_index) for confidence, rule_index in ranking))
+        state = {
+            'kb': compiled.fingerprint,
+            'symptoms': user_symptoms_lower,
+            'rules': list(matched_counts),
+            'counts': list(matched_counts.values()),
+            'scores': [scores[rule_index] for rule_index in matched_counts],
+            'unsaturated': unsaturated
+        }
+        return diagnoses, state
+    
+    def _cache_key(self, user_symptoms_lower, top_k, min_confidence):
+        """
+        Key of the ranking for lowercased user symptoms in the diagnosis
+        cache, or None when it is not cached
+        Rankings only depend on the set of symptoms (and the selection
+        knobs), so they can be shared between consultations (repeated
+        symptoms change the scores, so those lists bypass the cache).
+        """
+        if self.cache is None:
+            return None
+        symptom_set = frozenset(user_symptoms_lower)
+        if len(symptom_set) != len(user_symptoms_lower):
+            return None
+        return (symptom_set, top_k, min_confidence)
+    
+    def _rank(self, compiled, user_symptoms_lower, top_k=5, min_confidence=0):
+        """
+        Top top_k (confidence, rule index) pairs for lowercased user symptoms
+        Highest confidence first; ties keep rule order.
+        """
+        if top_k <= 0:
+            return ()
+        
+        # Only rules sharing at least one symptom with the user can score
+        user_ids, user_set, matched_counts = compiled.match(user_symptoms_lower)
+        user_count = len(user_symptoms_lower)
+        
+        # Bounded min-heap of (confidence, -rule index): the weakest of the
+        # best top_k so far is on top and is replaced by anything better
+        heap = []
+        for rule_index, matched_count in matched_counts.items():
+            confidence = compiled.score(rule_index, matched_count, user_set, user_count)
+            if confidence <= 0 or confidence < min_confidence:
+                continue
+            item = (confidence, -rule_index)
+            if len(heap) < top_k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+        
+        return tuple((confidence, -negated_index) for confidence, negated_index in sorted(heap, reverse=True))
+    
+    def derive_facts(self, facts):
+        """
+        Facts derived from the given ones by the knowledge base's derivation
+        rules, as a list of (fact, derivation rule) in the order they were
+        concluded
+        """
+        network = self.knowledge_base.get_rete()
+        known, derivations = network.run(facts)
+        return [(fact, network.rules[rule_index]) for fact, rule_index in derivations]
+    
+    @timed('diagnose_chained')
+    def diagnose_chained(self, user_symptoms, top_k=5, min_confidence=0):
+        """
+        diagnose() after forward chaining through the derivation rules
+        Derived facts (syndromes and other intermediate findings) are added
+        after the user's symptoms and count as symptoms the user has.
+        Returns (diagnoses, derived facts in the order they were concluded).
+        """
+        derived = [fact for fact, rule in self.derive_facts(user_symptoms)]
+        return self.diagnose(list(user_symptoms) + derived, top_k, min_confidence), derived
+    
+    def diagnose_batch(self, symptom_lists, top_k=5):
+        """
+        Diagnose many independent symptom lists at once
+        Returns one list per input, each identical to what diagnose() returns
+        (with top_k results instead of 5)
+        """
+        compiled = self.knowledge_base.get_compiled()
+        if self._batch_scorer is None or self._batch_scorer.compiled is not compiled:
+            self._batch_scorer = BatchScorer(compiled)
+        return self._batch_scorer.diagnose(symptom_lists, top_k)
     
     def calculate_match_score(self, user_symptoms, rule):
         """
@@ -93,6 +253,8 @@ class InferenceEngine:
         """
         Generic forward chaining algorithm
         Start with facts (symptoms) and apply rules to derive conclusions
+        Re-checks every rule on each pass; ReteNetwork (see derive_facts)
+        computes the same facts (lowercased) incrementally.
         """
         inferred_facts = set(facts)
         new_facts_added = True
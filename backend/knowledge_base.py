@@ -1,7 +1,16 @@
+from compiled_knowledge_base import CompiledKnowledgeBase
+from rete import ReteNetwork
+from rules import Rule
+from symptom_matcher import SymptomMatcher
+
 class KnowledgeBase:
     """Medical knowledge base containing rules for diagnosis"""
     
-    def __init__(self):
+    def __init__(self, rules=None, symptom_variations=None, derivation_rules=None):
+        # Rules and synonyms can be passed in (see knowledge_base_loader.py
+        # for loading them from a JSON/YAML file); otherwise the built-in
+        # medical content below is used.
+        #
         # Define medical rules in the format:
         # {
         #   'condition': 'Disease Name',
@@ -11,129 +20,194 @@ class KnowledgeBase:
         #   'recommendations': 'What to do'
         # }
         
-        self.rules = [
-            {
-                'condition': 'Common Cold',
-                'symptoms': ['runny nose', 'sneezing', 'sore throat', 'cough', 'mild fever', 'fatigue'],
-                'required_symptoms': ['runny nose'],
-                'description': 'A viral infection of the upper respiratory tract',
-                'recommendations': 'Rest, drink plenty of fluids, use over-the-counter cold medications. Usually resolves in 7-10 days.'
-            },
-            {
-                'condition': 'Influenza (Flu)',
-                'symptoms': ['fever', 'cough', 'sore throat', 'body ache', 'headache', 'fatigue', 'chills'],
-                'required_symptoms': ['fever', 'body ache'],
-                'description': 'A viral infection affecting the respiratory system',
-                'recommendations': 'Rest, stay hydrated, antiviral medications may help if started early. Seek medical attention if symptoms worsen.'
-            },
-            {
-                'condition': 'COVID-19',
-                'symptoms': ['fever', 'cough', 'fatigue', 'loss of taste', 'loss of smell', 'shortness of breath', 'body ache', 'headache', 'sore throat'],
-                'required_symptoms': ['fever', 'cough'],
-                'description': 'Respiratory illness caused by SARS-CoV-2 virus',
-                'recommendations': 'Self-isolate, get tested, rest, monitor oxygen levels. Seek immediate medical care if breathing becomes difficult.'
-            },
-            {
-                'condition': 'Migraine',
-                'symptoms': ['severe headache', 'nausea', 'sensitivity to light', 'sensitivity to sound', 'vomiting', 'dizziness'],
-                'required_symptoms': ['severe headache'],
-                'description': 'Intense headache often accompanied by nausea and sensitivity',
-                'recommendations': 'Rest in a dark, quiet room. Take prescribed migraine medication. Consult a neurologist for persistent migraines.'
-            },
-            {
-                'condition': 'Gastroenteritis (Stomach Flu)',
-                'symptoms': ['nausea', 'vomiting', 'diarrhea', 'abdominal pain', 'fever', 'headache', 'fatigue'],
-                'required_symptoms': ['diarrhea'],
-                'description': 'Inflammation of the digestive tract',
-                'recommendations': 'Stay hydrated with oral rehydration solutions, rest, eat bland foods. Seek medical care if dehydration occurs.'
-            },
-            {
-                'condition': 'Pneumonia',
-                'symptoms': ['cough', 'fever', 'shortness of breath', 'chest pain', 'fatigue', 'chills', 'confusion'],
-                'required_symptoms': ['cough', 'fever', 'shortness of breath'],
-                'description': 'Infection that inflames air sacs in the lungs',
-                'recommendations': 'Seek immediate medical attention. Requires antibiotics or antiviral medications. May need hospitalization.'
-            },
-            {
-                'condition': 'Bronchitis',
-                'symptoms': ['persistent cough', 'mucus production', 'fatigue', 'shortness of breath', 'mild fever', 'chest discomfort'],
-                'required_symptoms': ['persistent cough'],
-                'description': 'Inflammation of the bronchial tubes',
-                'recommendations': 'Rest, drink fluids, use a humidifier. See a doctor if symptoms persist beyond 3 weeks or worsen.'
-            },
-            {
-                'condition': 'Strep Throat',
-                'symptoms': ['severe sore throat', 'fever', 'swollen lymph nodes', 'difficulty swallowing', 'headache', 'rash'],
-                'required_symptoms': ['severe sore throat', 'fever'],
-                'description': 'Bacterial infection of the throat',
-                'recommendations': 'Requires antibiotics. See a doctor for proper diagnosis and treatment to prevent complications.'
-            },
-            {
-                'condition': 'Sinusitis',
-                'symptoms': ['facial pain', 'nasal congestion', 'runny nose', 'headache', 'cough', 'fever', 'fatigue'],
-                'required_symptoms': ['facial pain', 'nasal congestion'],
-                'description': 'Inflammation or infection of the sinuses',
-                'recommendations': 'Use saline nasal spray, apply warm compresses. See a doctor if symptoms persist beyond 10 days.'
-            },
-            {
-                'condition': 'Allergic Rhinitis',
-                'symptoms': ['sneezing', 'runny nose', 'itchy eyes', 'nasal congestion', 'fatigue'],
-                'required_symptoms': ['sneezing', 'runny nose'],
-                'description': 'Allergic reaction affecting the nose and eyes',
-                'recommendations': 'Avoid allergens, use antihistamines, consider allergy testing. See an allergist for persistent symptoms.'
-            },
-            {
-                'condition': 'Tension Headache',
-                'symptoms': ['headache', 'pressure around forehead', 'neck pain', 'fatigue', 'difficulty concentrating'],
-                'required_symptoms': ['headache'],
-                'description': 'Most common type of headache caused by muscle tension',
-                'recommendations': 'Rest, stress management, over-the-counter pain relievers. Practice good posture.'
-            },
-            {
-                'condition': 'Urinary Tract Infection (UTI)',
-                'symptoms': ['burning urination', 'frequent urination', 'abdominal pain', 'cloudy urine', 'fever', 'pelvic pain'],
-                'required_symptoms': ['burning urination', 'frequent urination'],
-                'description': 'Bacterial infection of the urinary system',
-                'recommendations': 'Drink plenty of water, see a doctor for antibiotics. Don\'t delay treatment to prevent kidney infection.'
-            },
-            {
-                'condition': 'Asthma Attack',
-                'symptoms': ['shortness of breath', 'wheezing', 'cough', 'chest tightness', 'difficulty breathing'],
-                'required_symptoms': ['shortness of breath', 'wheezing'],
-                'description': 'Narrowing of airways causing breathing difficulty',
-                'recommendations': 'Use rescue inhaler immediately. Seek emergency care if symptoms don\'t improve or worsen.'
-            },
-            {
-                'condition': 'Food Poisoning',
-                'symptoms': ['nausea', 'vomiting', 'diarrhea', 'abdominal pain', 'fever', 'weakness'],
-                'required_symptoms': ['nausea', 'diarrhea'],
-                'description': 'Illness from consuming contaminated food',
-                'recommendations': 'Stay hydrated, rest. Seek medical care if symptoms are severe or persistent, or if blood in stool.'
-            },
-            {
-                'condition': 'Dehydration',
-                'symptoms': ['dizziness', 'fatigue', 'dry mouth', 'decreased urination', 'headache', 'confusion'],
-                'required_symptoms': ['dizziness', 'dry mouth'],
-                'description': 'Excessive loss of body fluids',
-                'recommendations': 'Drink water or oral rehydration solutions. Seek medical care if severe symptoms persist.'
-            },
-            {
-                'condition': 'Anxiety Disorder',
-                'symptoms': ['rapid heartbeat', 'sweating', 'trembling', 'shortness of breath', 'dizziness', 'nausea', 'fear'],
-                'required_symptoms': ['rapid heartbeat', 'fear'],
-                'description': 'Mental health condition characterized by excessive worry',
-                'recommendations': 'Practice relaxation techniques, consider therapy. Consult a mental health professional for proper treatment.'
+        if rules is None:
+            rules = [
+                {
+                    'condition': 'Common Cold',
+                    'symptoms': ['runny nose', 'sneezing', 'sore throat', 'cough', 'mild fever', 'fatigue'],
+                    'required_symptoms': ['runny nose'],
+                    'description': 'A viral infection of the upper respiratory tract',
+                    'recommendations': 'Rest, drink plenty of fluids, use over-the-counter cold medications. Usually resolves in 7-10 days.'
+                },
+                {
+                    'condition': 'Influenza (Flu)',
+                    'symptoms': ['fever', 'cough', 'sore throat', 'body ache', 'headache', 'fatigue', 'chills'],
+                    'required_symptoms': ['fever', 'body ache'],
+                    'description': 'A viral infection affecting the respiratory system',
+                    'recommendations': 'Rest, stay hydrated, antiviral medications may help if started early. Seek medical attention if symptoms worsen.'
+                },
+                {
+                    'condition': 'COVID-19',
+                    'symptoms': ['fever', 'cough', 'fatigue', 'loss of taste', 'loss of smell', 'shortness of breath', 'body ache', 'headache', 'sore throat'],
+                    'required_symptoms': ['fever', 'cough'],
+                    'description': 'Respiratory illness caused by SARS-CoV-2 virus',
+                    'recommendations': 'Self-isolate, get tested, rest, monitor oxygen levels. Seek immediate medical care if breathing becomes difficult.'
+                },
+                {
+                    'condition': 'Migraine',
+                    'symptoms': ['severe headache', 'nausea', 'sensitivity to light', 'sensitivity to sound', 'vomiting', 'dizziness'],
+                    'required_symptoms': ['severe headache'],
+                    'description': 'Intense headache often accompanied by nausea and sensitivity',
+                    'recommendations': 'Rest in a dark, quiet room. Take prescribed migraine medication. Consult a neurologist for persistent migraines.'
+                },
+                {
+                    'condition': 'Gastroenteritis (Stomach Flu)',
+                    'symptoms': ['nausea', 'vomiting', 'diarrhea', 'abdominal pain', 'fever', 'headache', 'fatigue'],
+                    'required_symptoms': ['diarrhea'],
+                    'description': 'Inflammation of the digestive tract',
+                    'recommendations': 'Stay hydrated with oral rehydration solutions, rest, eat bland foods. Seek medical care if dehydration occurs.'
+                },
+                {
+                    'condition': 'Pneumonia',
+                    'symptoms': ['cough', 'fever', 'shortness of breath', 'chest pain', 'fatigue', 'chills', 'confusion'],
+                    'required_symptoms': ['cough', 'fever', 'shortness of breath'],
+                    'description': 'Infection that inflames air sacs in the lungs',
+                    'recommendations': 'Seek immediate medical attention. Requires antibiotics or antiviral medications. May need hospitalization.'
+                },
+                {
+                    'condition': 'Bronchitis',
+                    'symptoms': ['persistent cough', 'mucus production', 'fatigue', 'shortness of breath', 'mild fever', 'chest discomfort'],
+                    'required_symptoms': ['persistent cough'],
+                    'description': 'Inflammation of the bronchial tubes',
+                    'recommendations': 'Rest, drink fluids, use a humidifier. See a doctor if symptoms persist beyond 3 weeks or worsen.'
+                },
+                {
+                    'condition': 'Strep Throat',
+                    'symptoms': ['severe sore throat', 'fever', 'swollen lymph nodes', 'difficulty swallowing', 'headache', 'rash'],
+                    'required_symptoms': ['severe sore throat', 'fever'],
+                    'description': 'Bacterial infection of the throat',
+                    'recommendations': 'Requires antibiotics. See a doctor for proper diagnosis and treatment to prevent complications.'
+                },
+                {
+                    'condition': 'Sinusitis',
+                    'symptoms': ['facial pain', 'nasal congestion', 'runny nose', 'headache', 'cough', 'fever', 'fatigue'],
+                    'required_symptoms': ['facial pain', 'nasal congestion'],
+                    'description': 'Inflammation or infection of the sinuses',
+                    'recommendations': 'Use saline nasal spray, apply warm compresses. See a doctor if symptoms persist beyond 10 days.'
+                },
+                {
+                    'condition': 'Allergic Rhinitis',
+                    'symptoms': ['sneezing', 'runny nose', 'itchy eyes', 'nasal congestion', 'fatigue'],
+                    'required_symptoms': ['sneezing', 'runny nose'],
+                    'description': 'Allergic reaction affecting the nose and eyes',
+                    'recommendations': 'Avoid allergens, use antihistamines, consider allergy testing. See an allergist for persistent symptoms.'
+                },
+                {
+                    'condition': 'Tension Headache',
+                    'symptoms': ['headache', 'pressure around forehead', 'neck pain', 'fatigue', 'difficulty concentrating'],
+                    'required_symptoms': ['headache'],
+                    'description': 'Most common type of headache caused by muscle tension',
+                    'recommendations': 'Rest, stress management, over-the-counter pain relievers. Practice good posture.'
+                },
+                {
+                    'condition': 'Urinary Tract Infection (UTI)',
+                    'symptoms': ['burning urination', 'frequent urination', 'abdominal pain', 'cloudy urine', 'fever', 'pelvic pain'],
+                    'required_symptoms': ['burning urination', 'frequent urination'],
+                    'description': 'Bacterial infection of the urinary system',
+                    'recommendations': 'Drink plenty of water, see a doctor for antibiotics. Don\'t delay treatment to prevent kidney infection.'
+                },
+                {
+                    'condition': 'Asthma Attack',
+                    'symptoms': ['shortness of breath', 'wheezing', 'cough', 'chest tightness', 'difficulty breathing'],
+                    'required_symptoms': ['shortness of breath', 'wheezing'],
+                    'description': 'Narrowing of airways causing breathing difficulty',
+                    'recommendations': 'Use rescue inhaler immediately. Seek emergency care if symptoms don\'t improve or worsen.'
+                },
+                {
+                    'condition': 'Food Poisoning',
+                    'symptoms': ['nausea', 'vomiting', 'diarrhea', 'abdominal pain', 'fever', 'weakness'],
+                    'required_symptoms': ['nausea', 'diarrhea'],
+                    'description': 'Illness from consuming contaminated food',
+                    'recommendations': 'Stay hydrated, rest. Seek medical care if symptoms are severe or persistent, or if blood in stool.'
+                },
+                {
+                    'condition': 'Dehydration',
+                    'symptoms': ['dizziness', 'fatigue', 'dry mouth', 'decreased urination', 'headache', 'confusion'],
+                    'required_symptoms': ['dizziness', 'dry mouth'],
+                    'description': 'Excessive loss of body fluids',
+                    'recommendations': 'Drink water or oral rehydration solutions. Seek medical care if severe symptoms persist.'
+                },
+                {
+                    'condition': 'Anxiety Disorder',
+                    'symptoms': ['rapid heartbeat', 'sweating', 'trembling', 'shortness of breath', 'dizziness', 'nausea', 'fear'],
+                    'required_symptoms': ['rapid heartbeat', 'fear'],
+                    'description': 'Mental health condition characterized by excessive worry',
+                    'recommendations': 'Practice relaxation techniques, consider therapy. Consult a mental health professional for proper treatment.'
+                }
+            ]
+        self.rules = [Rule.from_dict(rule) for rule in rules]
+        
+        # Common variations and synonyms that map onto a canonical symptom
+        if symptom_variations is None:
+            symptom_variations = {
+                'fever': ['temperature', 'hot', 'burning up'],
+                'headache': ['head pain', 'head hurts', 'migraine'],
+                'cough': ['coughing', 'coughed'],
+                'fatigue': ['tired', 'exhausted', 'weak', 'weakness'],
+                'nausea': ['feel sick', 'queasy', 'sick to stomach'],
+                'sore throat': ['throat pain', 'throat hurts'],
+                'runny nose': ['nose running', 'nasal discharge'],
+                'body ache': ['body pain', 'muscle pain', 'aches'],
+                'shortness of breath': ['hard to breathe', 'breathing difficulty', 'can\'t breathe'],
+                'chest pain': ['chest hurts', 'chest discomfort'],
+                'dizziness': ['dizzy', 'lightheaded', 'vertigo'],
+                'vomiting': ['throwing up', 'vomit', 'puking'],
+                'diarrhea': ['loose stool', 'stomach runs'],
+                'abdominal pain': ['stomach pain', 'belly pain', 'stomach ache'],
+                'loss of appetite': ['not hungry', 'don\'t want to eat'],
+                'chills': ['shivering', 'cold sweats'],
+                'confusion': ['confused', 'disoriented'],
+                'rash': ['skin rash', 'skin irritation', 'red spots']
             }
-        ]
+        self.symptom_variations = dict(symptom_variations)
         
-        # Create a set of all unique symptoms for quick lookup
+        # Derivation rules conclude intermediate facts (such as a syndrome
+        # from a cluster of symptoms) that diagnostic rules can list among
+        # their symptoms; they are used in the forward_chaining inference mode:
+        # {
+        #   'conditions': ['fact1', 'fact2', ...],
+        #   'conclusion': 'derived fact'
+        # }
+        self.derivation_rules = list(derivation_rules or [])
+        
+        # Create a set of all unique symptoms for quick lookup, plus the
+        # lookup indexes kept up to date by add_rule
         self.all_symptoms = set()
+        # Sorted all_symptoms, rebuilt by get_all_symptoms after a change
+        self._sorted_symptoms = None
+        self._rules_by_condition = {}
+        self._rules_by_id = {}
+        self._conditions_by_symptom = {}
         for rule in self.rules:
-            self.all_symptoms.update(rule['symptoms'])
+            self._index_rule(rule)
+        
+        # Bumped whenever the rule set changes so derived indexes can rebuild
+        self.version = 0
+        self._compiled = None
+        self._rete = None
+        self._symptom_matcher = None
+        self._symptom_matcher_version = None
+        self.frozen = False
+    
+    def _index_rule(self, rule):
+        """Add a rule to the symptom set and lookup indexes"""
+        new_symptoms = set(rule['symptoms']) - self.all_symptoms
+        if new_symptoms:
+            self.all_symptoms.update(new_symptoms)
+            self._sorted_symptoms = None
+        
+        # The first rule with a given name wins, as with the old linear scan
+        self._rules_by_condition.setdefault(rule['condition'].lower(), rule)
+        self._rules_by_id.setdefault(self.get_condition_id(rule), rule)
+        
+        for symptom in {s.lower() for s in rule['symptoms']}:
+            self._conditions_by_symptom.setdefault(symptom, []).append(rule['condition'])
     
     def get_all_symptoms(self):
-        """Return list of all symptoms in the knowledge base"""
-        return sorted(list(self.all_symptoms))
+        """Return all symptoms in the knowledge base, sorted"""
+        if self._sorted_symptoms is None:
+            self._sorted_symptoms = tuple(sorted(self.all_symptoms))
+        return self._sorted_symptoms
     
     def get_rules(self):
         """Return all diagnostic rules"""
@@ -141,20 +215,74 @@ class KnowledgeBase:
     
     def get_condition_info(self, condition_name):
         """Get detailed information about a specific condition"""
-        for rule in self.rules:
-            if rule['condition'].lower() == condition_name.lower():
-                return rule
-        return None
+        return self._rules_by_condition.get(condition_name.lower())
+    
+    def get_condition_id(self, rule):
+        """Stable ID of a rule: its 'id' field if it has one, else the condition name"""
+        return rule.get('id', rule['condition'])
+    
+    def get_rule_by_id(self, condition_id):
+        """Get the rule with the given ID (see get_condition_id)"""
+        return self._rules_by_id.get(condition_id)
     
     def add_rule(self, rule):
         """Add a new diagnostic rule to the knowledge base"""
+        self._check_not_frozen()
+        rule = Rule.from_dict(rule)
         self.rules.append(rule)
-        self.all_symptoms.update(rule['symptoms'])
+        self._index_rule(rule)
+        self.version += 1
+    
+    def add_derivation_rule(self, rule):
+        """Add a new derivation rule to the knowledge base"""
+        self._check_not_frozen()
+        self.derivation_rules.append(rule)
+        self.version += 1
+    
+    def _check_not_frozen(self):
+        if self.frozen:
+            raise RuntimeError("Knowledge base is frozen; build a new one to change its rules")
+    
+    def freeze(self):
+        """
+        Build every derived index and make the knowledge base read-only
+        For a knowledge base built once and shared with forked worker
+        processes (see preload.py): lists become tuples and integer arrays,
+        which hold fewer objects for workers to touch (and so copy) when
+        reading them. add_rule and add_derivation_rule raise afterwards.
+        """
+        if self.frozen:
+            return
+        self.get_compiled().freeze()
+        self.get_rete().freeze()
+        self.get_symptom_matcher().freeze()
+        self.rules = tuple(self.rules)
+        self.derivation_rules = tuple(self.derivation_rules)
+        self.all_symptoms = frozenset(self.all_symptoms)
+        self.get_all_symptoms()
+        self._conditions_by_symptom = {symptom: tuple(conditions)
+                                       for symptom, conditions in self._conditions_by_symptom.items()}
+        self.frozen = True
+    
+    def get_compiled(self):
+        """Return the compiled form of the rules, rebuilding it if the rules changed"""
+        if self._compiled is None or self._compiled.version != self.version:
+            self._compiled = CompiledKnowledgeBase(self.rules, self.version)
+        return self._compiled
+    
+    def get_rete(self):
+        """Return the network for the derivation rules, rebuilding it if the rules changed"""
+        if self._rete is None or self._rete.version != self.version:
+            self._rete = ReteNetwork(self.derivation_rules, self.version)
+        return self._rete
+    
+    def get_symptom_matcher(self):
+        """Return the symptom matcher for the current rules, rebuilding it if they changed"""
+        if self._symptom_matcher_version != self.version:
+            self._symptom_matcher = SymptomMatcher(self.all_symptoms, self.symptom_variations)
+            self._symptom_matcher_version = self.version
+        return self._symptom_matcher
     
     def get_conditions_by_symptom(self, symptom):
         """Get all conditions that include a specific symptom"""
-        conditions = []
-        for rule in self.rules:
-            if symptom.lower() in [s.lower() for s in rule['symptoms']]:
-                conditions.append(rule['condition'])
-        return conditions
+        return list(self._conditions_by_symptom.get(symptom.lower(), ()))
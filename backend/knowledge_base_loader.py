@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+
+from knowledge_base import KnowledgeBase
+
+try:
+    import yaml
+except ImportError:  # YAML files are optional; JSON needs nothing extra
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when KnowledgeBase or its compiled indexes change shape, so stale
+# binary caches are rebuilt instead of unpickled
+CACHE_FORMAT = 9
+
+
+def parse_rules_file(path):
+    """
+    Read rules, synonyms and derivation rules from a JSON or YAML file
+    The file holds {"rules": [...], "symptom_variations": {...},
+    "derivation_rules": [...]} (the last two optional) or just the list of
+    rules, in the KnowledgeBase formats.
+    Returns (rules, symptom_variations, derivation_rules).
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if path.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise RuntimeError("PyYAML is required to load YAML knowledge bases (pip install pyyaml)")
+        data = yaml.safe_load(raw)
+    else:
+        data = json.loads(raw)
+
+    if isinstance(data, list):
+        data = {'rules': data}
+    rules = data.get('rules')
+    if not isinstance(rules, list):
+        raise ValueError(f"{path}: expected a list of rules")
+    for number, rule in enumerate(rules, 1):
+        if not isinstance(rule, dict) or 'condition' not in rule or not isinstance(rule.get('symptoms'), list):
+            raise ValueError(f"{path}: rule {number} needs a 'condition' and a list of 'symptoms'")
+
+    derivation_rules = data.get('derivation_rules', [])
+    if not isinstance(derivation_rules, list):
+        raise ValueError(f"{path}: expected a list of derivation rules")
+    for number, rule in enumerate(derivation_rules, 1):
+        if not isinstance(rule, dict) or not rule.get('conclusion') or not isinstance(rule.get('conditions'), list):
+            raise ValueError(f"{path}: derivation rule {number} needs a 'conclusion' and a list of 'conditions'")
+
+    return rules, data.get('symptom_variations'), derivation_rules
+
+
+def load_knowledge_base(path, cache_path=None):
+    """
+    Build a KnowledgeBase from a rules file, using a compiled binary cache
+    The cache (<path>.compiled by default) holds the pickled KnowledgeBase
+    with its indexes, compiled rules and symptom matcher already built. It is
+    keyed on the SHA-256 of the rules file and rebuilt whenever that changes.
+    """
+    cache_path = cache_path or path + '.compiled'
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('format') == CACHE_FORMAT and cached.get('sha256') == digest:
+            return cached['knowledge_base']
+    except FileNotFoundError:
+        pass
+    except Exception:
+        logger.warning("Ignoring unreadable knowledge base cache %s", cache_path, exc_info=True)
+
+    rules, symptom_variations, derivation_rules = parse_rules_file(path)
+    knowledge_base = KnowledgeBase(rules, symptom_variations, derivation_rules)
+    knowledge_base.get_compiled()
+    knowledge_base.get_rete()
+    knowledge_base.get_symptom_matcher()
+
+    temp_path = cache_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump({'format': CACHE_FORMAT, 'sha256': digest, 'knowledge_base': knowledge_base},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        logger.warning("Could not write knowledge base cache %s", cache_path, exc_info=True)
+
+    return knowledge_base
+
+
+def export_rules_file(knowledge_base, path):
+    """Write a knowledge base's rules, synonyms and derivation rules as JSON"""
+    with open(path, 'w') as f:
+        json.dump({
+            'rules': [rule.to_dict() for rule in knowledge_base.rules],
+            'symptom_variations': knowledge_base.symptom_variations,
+            'derivation_rules': knowledge_base.derivation_rules
+        }, f, indent=2)
+
+
+class KnowledgeBaseWatcher:
+    """Background thread that reloads a rules file when it changes on disk
+
+    on_reload(knowledge_base) is called with the newly loaded knowledge base.
+    A file that fails to load is logged and the current one is kept.
+
+    A started watcher also runs in processes forked afterwards (e.g. gunicorn
+    --preload workers), each reloading its own copy of the knowledge base.
+    """
+
+    def __init__(self, path, on_reload, interval=2.0):
+        self.path = path
+        self.on_reload = on_reload
+        self.interval = interval
+        self._stop = threading.Event()
+        self._signature = self._file_signature()
+        self._thread = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            signature = self._file_signature()
+            if signature is None or signature == self._signature:
+                continue
+            self._signature = signature
+            try:
+                knowledge_base = load_knowledge_base(self.path)
+            except Exception:
+                logger.exception("Failed to reload knowledge base from %s", self.path)
+                continue
+            self.on_reload(knowledge_base)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='knowledge-base-watcher', daemon=True)
+        self._thread.start()
+        _watchers.add(self)
+        return self
+
+    def _restart_after_fork(self):
+        # Threads are not inherited by forked children
+        if not self._stop.is_set():
+            self._stop = threading.Event()
+            self.start()
+
+    def stop(self):
+        self._stop.set()
+        _watchers.discard(self)
+
+
+# Started watchers, restarted in forked children (held here, since nothing
+# else may reference a watcher once its thread is gone after a fork)
+_watchers = set()
+
+
+def _restart_watchers_after_fork():
+    for watcher in list(_watchers):
+        watcher._restart_after_fork()
+
+
+os.register_at_fork(after_in_child=_restart_watchers_after_fork)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit('usage: python knowledge_base_loader.py <rules.json>')
+    export_rules_file(KnowledgeBase(), sys.argv[1])
+    print(f'Wrote the built-in knowledge base to {sys.argv[1]}')
@@ -0,0 +1,112 @@
+"""
+Per-stage latency histograms in Prometheus text format
+
+Functions decorated with @timed('stage') record their duration in the
+healthbot_stage_duration_seconds histogram, which /metrics exposes together
+with session store, diagnosis cache and history writer counters.
+
+Set METRICS_ENABLED=0 to turn instrumentation off: @timed then returns the
+function unchanged and observe() returns immediately, so there is no
+per-call cost.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# Upper bounds in seconds, from 10 microseconds to 10 seconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value"""
+
+    def __init__(self, name, help_text, label, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [bucket counts..., +Inf count], sum
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {value: (list(counts), total) for value, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {total}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+stage_durations = Histogram('healthbot_stage_duration_seconds',
+                            'Time spent in each stage of request handling', 'stage')
+
+
+def observe(stage, seconds):
+    """Record a duration measured by the caller"""
+    if ENABLED:
+        stage_durations.observe(stage, seconds)
+
+
+def timed(stage):
+    """Decorator recording each call's duration under stage"""
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage_durations.observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def stats_samples(prefix, stats, counters=()):
+    """
+    Prometheus lines for a stats() dict such as SessionStore.stats()
+    Keys listed in counters are exposed as counters (with a _total suffix),
+    other numeric values as gauges.
+    """
+    lines = []
+    for key, value in stats.items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if key in counters:
+            name, kind = f'healthbot_{prefix}_{key}_total', 'counter'
+        else:
+            name, kind = f'healthbot_{prefix}_{key}', 'gauge'
+        lines += [f'# TYPE {name} {kind}', f'{name} {value}']
+    return lines
+
+
+def render(extra_lines=()):
+    """The full /metrics page"""
+    lines = stage_durations.render() if ENABLED else []
+    lines += extra_lines
+    return '\n'.join(lines) + '\n'
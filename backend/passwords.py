@@ -0,0 +1,81 @@
+"""
+Salted password hashing for UserDatabase
+
+Passwords are stored as "pbkdf2_sha256$<iterations>$<salt>$<hash>" (salt and
+hash base64). The iteration count is the hash cost: it defaults to
+PASSWORD_HASH_ITERATIONS from the environment and is recorded in each hash,
+so it can be raised later and older hashes are upgraded on the next login.
+
+To find the cost that keeps one hash under a login latency budget:
+    python passwords.py --target-ms 50
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import time
+
+ALGORITHM = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 600_000))
+SALT_BYTES = 16
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password, iterations=None):
+    """Hash a password with a fresh random salt"""
+    iterations = iterations or DEFAULT_ITERATIONS
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f'{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def is_hashed(stored):
+    return stored.startswith(ALGORITHM + '$')
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash in constant time
+    Accounts created before hashing was introduced store the plaintext
+    password; those are still accepted so they can be upgraded.
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    try:
+        _, iterations, salt, digest = stored.split('$')
+        salt, digest = base64.b64decode(salt), base64.b64decode(digest)
+        iterations = int(iterations)
+    except ValueError:
+        return False
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return hmac.compare_digest(candidate, digest)
+
+
+def needs_rehash(stored, iterations=None):
+    """True for plaintext passwords and hashes made with a different cost"""
+    if not is_hashed(stored):
+        return True
+    return stored.split('$')[1] != str(iterations or DEFAULT_ITERATIONS)
+
+
+def calibrate_iterations(target_seconds, sample_iterations=100_000):
+    """Largest iteration count (rounded down to 1000) whose hash takes at most target_seconds here"""
+    salt = os.urandom(SALT_BYTES)
+    start = time.perf_counter()
+    hashlib.pbkdf2_hmac('sha256', b'calibration', salt, sample_iterations)
+    per_iteration = (time.perf_counter() - start) / sample_iterations
+    return max(1000, int(target_seconds / per_iteration) // 1000 * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pick PASSWORD_HASH_ITERATIONS for a login latency budget')
+    parser.add_argument('--target-ms', type=float, default=50,
+                        help='time one password check may take, in milliseconds (default: %(default)s)')
+    args = parser.parse_args()
+    iterations = calibrate_iterations(args.target_ms / 1000)
+    print(f'PASSWORD_HASH_ITERATIONS={iterations}  '
+          f'(about {1000 / args.target_ms:.0f} logins/s per core)')
@@ -0,0 +1,19 @@
+import gc
+
+
+def preload_knowledge_base(knowledge_base):
+    """
+    Prepare a knowledge base built in a parent process to be shared by forked workers
+
+    Forked workers share the parent's memory pages copy-on-write: a page is
+    only copied once a worker writes to it. The knowledge base is frozen
+    (every index built and stored in tuples and integer arrays, see
+    KnowledgeBase.freeze), then everything allocated so far is moved out of
+    the garbage collector's reach with gc.freeze, so collections in the
+    workers do not write to (and copy) every shared object they would
+    otherwise scan. Call it last thing before forking.
+    """
+    knowledge_base.freeze()
+    gc.collect()
+    gc.freeze()
+    return knowledge_base
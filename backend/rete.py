@@ -0,0 +1,88 @@
+from array import array
+from collections import deque
+
+
+class ReteNetwork:
+    """Agenda-based forward chaining over derivation rules
+
+    Derivation rules have the form used by InferenceEngine.forward_chain:
+    {'conditions': ['fact', ...], 'conclusion': 'fact'}. Each fact has an
+    alpha memory listing the rules that test it, and each rule keeps a count
+    of its conditions not yet satisfied. Asserting a fact only visits the
+    rules in its alpha memory; a rule whose count reaches zero is activated
+    and its conclusion goes on the agenda to be asserted in turn. Every
+    condition is therefore checked once per run instead of once per pass
+    over all rules.
+
+    Facts are matched lowercased, like symptoms in the inference engine.
+    """
+
+    def __init__(self, rules, version=0):
+        self.version = version
+        self.rules = list(rules)
+
+        # Per-rule data, indexed by position in the rule list
+        self.conclusions = []       # lowercased conclusion, None if the rule has none
+        self.condition_counts = []  # number of distinct conditions
+
+        # Alpha memories: fact -> indexes of the rules testing it
+        self.alpha_memories = {}
+        # Rules with no conditions, active from the start
+        self.unconditional = []
+
+        for rule_index, rule in enumerate(self.rules):
+            conditions = {c.lower() for c in rule.get('conditions', [])}
+            conclusion = rule.get('conclusion')
+            self.conclusions.append(conclusion.lower() if conclusion else None)
+            self.condition_counts.append(len(conditions))
+            if not conditions:
+                self.unconditional.append(rule_index)
+            for fact in conditions:
+                self.alpha_memories.setdefault(fact, []).append(rule_index)
+
+    def freeze(self):
+        """Replace the rule lists with tuples and int arrays (see KnowledgeBase.freeze)"""
+        self.rules = tuple(self.rules)
+        self.conclusions = tuple(self.conclusions)
+        self.condition_counts = array('i', self.condition_counts)
+        self.unconditional = array('i', self.unconditional)
+        self.alpha_memories = {fact: array('i', rule_indexes) for fact, rule_indexes in self.alpha_memories.items()}
+
+    def run(self, facts):
+        """
+        Assert facts and fire rules until nothing new can be derived
+        Returns (known facts, derivations): the set of initial and derived
+        facts, and a list of (fact, rule index) for each derived fact in the
+        order it was concluded.
+        """
+        # Facts asserted or waiting on the agenda; each is asserted once
+        known = set()
+        derivations = []
+        remaining = {}
+        agenda = deque()
+
+        for fact in facts:
+            fact = fact.lower()
+            if fact not in known:
+                known.add(fact)
+                agenda.append(fact)
+
+        def conclude(rule_index):
+            conclusion = self.conclusions[rule_index]
+            if conclusion is not None and conclusion not in known:
+                known.add(conclusion)
+                derivations.append((conclusion, rule_index))
+                agenda.append(conclusion)
+
+        for rule_index in self.unconditional:
+            conclude(rule_index)
+
+        while agenda:
+            fact = agenda.popleft()
+            for rule_index in self.alpha_memories.get(fact, ()):
+                count = remaining.get(rule_index, self.condition_counts[rule_index]) - 1
+                remaining[rule_index] = count
+                if count == 0:
+                    conclude(rule_index)
+
+        return known, derivations
@@ -0,0 +1,119 @@
+import sys
+from collections.abc import Mapping
+
+
+class Rule(Mapping):
+    """A diagnostic rule of the knowledge base
+
+    Read-only and dict-compatible: rule['condition'], rule.get('id') and
+    iteration work as on the rule dicts it is built from (see
+    KnowledgeBase), and to_dict gives that dict back. Fields live in
+    __slots__ instead of a per-rule dict, and symptoms are tuples of
+    interned strings, so a symptom named by many rules is stored once.
+    Fields other than the standard ones are kept in extra.
+    """
+
+    __slots__ = ('condition', 'symptoms', 'required_symptoms', 'description', 'recommendations', 'id', 'extra')
+
+    FIELDS = ('condition', 'symptoms', 'required_symptoms', 'description', 'recommendations')
+
+    def __init__(self, condition, symptoms, required_symptoms=(), description='', recommendations='',
+                 id=None, extra=None):
+        self.condition = condition
+        self.symptoms = tuple(sys.intern(s) for s in symptoms)
+        self.required_symptoms = tuple(sys.intern(s) for s in required_symptoms)
+        self.description = description
+        self.recommendations = recommendations
+        self.id = id
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, rule):
+        """Rule from a rule dict in the KnowledgeBase format (a Rule is returned as is)"""
+        if isinstance(rule, Rule):
+            return rule
+        extra = {key: value for key, value in rule.items() if key not in cls.FIELDS and key != 'id'}
+        return cls(rule['condition'], rule['symptoms'], rule.get('required_symptoms', ()),
+                   rule.get('description', ''), rule.get('recommendations', ''), rule.get('id'), extra)
+
+    def to_dict(self):
+        return {key: list(value) if isinstance(value, tuple) else value for key, value in self.items()}
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        if key == 'id' and self.id is not None:
+            return self.id
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        yield from self.FIELDS
+        if self.id is not None:
+            yield 'id'
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return len(self.FIELDS) + (self.id is not None) + len(self.extra or ())
+
+    def __repr__(self):
+        return f'Rule({self.condition!r})'
+
+
+class Diagnosis(Mapping):
+    """One result of InferenceEngine.diagnose
+
+    Dict-compatible like Rule, with the keys 'condition', 'confidence',
+    'matched_symptoms', 'missing_symptoms', 'description' and
+    'recommendations'. The condition, description and recommendations are
+    read from the rule the diagnosis references rather than copied. Use
+    to_dict (or json_default) where results are serialized.
+    """
+
+    __slots__ = ('rule', 'confidence', 'matched_symptoms', 'missing_symptoms')
+
+    KEYS = ('condition', 'confidence', 'matched_symptoms', 'missing_symptoms', 'description', 'recommendations')
+
+    def __init__(self, rule, confidence, matched_symptoms, missing_symptoms):
+        self.rule = rule
+        self.confidence = confidence
+        self.matched_symptoms = matched_symptoms
+        self.missing_symptoms = missing_symptoms
+
+    @property
+    def condition(self):
+        return self.rule['condition']
+
+    @property
+    def description(self):
+        return self.rule.get('description', '')
+
+    @property
+    def recommendations(self):
+        return self.rule.get('recommendations', '')
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.KEYS}
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return f'Diagnosis({self.condition!r}, {self.confidence!r})'
+
+
+def json_default(value):
+    """default= hook for json.dumps: Rule and Diagnosis objects serialize as their dicts"""
+    if isinstance(value, (Rule, Diagnosis)):
+        return value.to_dict()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
@@ -0,0 +1,366 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def new_session(username=None):
+    """Fresh conversation state for /api/chat"""
+    return {
+        'symptoms': [],
+        'history': [],
+        'state': 'initial',
+        'username': username
+    }
+
+
+class SessionStore:
+    """Where /api/chat keeps per-conversation state
+
+    Use ``with store.session(session_id, username) as session:`` to get the
+    session (created if missing); changes made inside the block are kept
+    when it exits.
+    """
+
+    def session(self, session_id, username=None):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def stats(self):
+        """Counters describing the store, for monitoring"""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """In-process sessions with LRU eviction, idle expiry and a history cap
+
+    At most max_sessions sessions are kept (the least recently used one is
+    evicted first), sessions idle for more than idle_ttl seconds expire, and
+    each session keeps only its last max_history chat messages.
+    """
+
+    def __init__(self, max_sessions=10000, idle_ttl=30 * 60, max_history=100, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_history = max_history
+        self._clock = clock
+
+        # session_id -> [session, last access], least recently used first
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.evicted_capacity = 0
+        self.evicted_expired = 0
+        self.history_trimmed = 0
+
+    @contextmanager
+    def session(self, session_id, username=None):
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            slot = self._sessions.get(session_id)
+            if slot is None:
+                slot = [new_session(username), now]
+                self._sessions[session_id] = slot
+                self.created += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted_capacity += 1
+            else:
+                self._sessions.move_to_end(session_id)
+
+        session = slot[0]
+        try:
+            yield session
+        finally:
+            with self._lock:
+                history = session['history']
+                if len(history) > self.max_history:
+                    self.history_trimmed += len(history) - self.max_history
+                    del history[:-self.max_history]
+                slot[1] = self._clock()
+
+    def _expire(self, now):
+        """Drop sessions idle for longer than idle_ttl (caller holds the lock)"""
+        while self._sessions:
+            session_id, (session, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evicted_expired += 1
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'created': self.created,
+                'evicted_capacity': self.evicted_capacity,
+                'evicted_expired': self.evicted_expired,
+                'history_trimmed': self.history_trimmed
+            }
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# Roles in chat history are stored as one letter
+ROLE_CODES = {'user': 'u', 'bot': 'b'}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+# Serialized sessions longer than this are zlib-compressed
+COMPRESS_THRESHOLD = 512
+
+
+def encode_session(session):
+    """
+    Compact bytes for a session
+    Known fields use short keys, history messages become
+    [role, message, timestamp] triples, and large payloads are compressed.
+    The first byte says how the rest is encoded ('j' JSON, 'z' zlib JSON).
+    """
+    data = {
+        's': session['symptoms'],
+        't': session['state'],
+        'u': session.get('username'),
+        'h': [[ROLE_CODES.get(m['role'], m['role']), m['message'], m['timestamp']]
+              for m in session['history']]
+    }
+    extra = {k: v for k, v in session.items() if k not in ('symptoms', 'state', 'username', 'history')}
+    if extra:
+        data['x'] = extra
+
+    payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    if len(payload) > COMPRESS_THRESHOLD:
+        return b'z' + zlib.compress(payload, 1)
+    return b'j' + payload
+
+
+def decode_session(blob):
+    """Inverse of encode_session"""
+    payload = blob[1:]
+    if blob[:1] == b'z':
+        payload = zlib.decompress(payload)
+    data = json.loads(payload)
+
+    session = {
+        'symptoms': data['s'],
+        'history': [{'role': ROLE_NAMES.get(role, role), 'message': message, 'timestamp': timestamp}
+                    for role, message, timestamp in data['h']],
+        'state': data['t'],
+        'username': data['u']
+    }
+    session.update(data.get('x', {}))
+    return session
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file shared by every worker process on the host
+
+    Concurrent requests for the same conversation (from any thread or
+    process) are applied one after another instead of overwriting each
+    other: a session() block first claims a lease on its session row in a
+    short transaction, waiting while another holder has it, and writes the
+    session back and releases the lease in a second one. The database is
+    not locked while the block runs, so requests for other sessions go
+    ahead in parallel. A lease left behind by a crashed process expires
+    after lease_timeout seconds. Capacity, idle expiry and the history cap
+    behave as in InMemorySessionStore; stale sessions are purged at most
+    every purge_interval seconds.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id  TEXT PRIMARY KEY,
+            data        BLOB NOT NULL,
+            last_access REAL NOT NULL,
+            lease_owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access);
+        CREATE TABLE IF NOT EXISTS session_counters (
+            name  TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    COUNTERS = ('created', 'evicted_capacity', 'evicted_expired', 'history_trimmed', 'lease_waits')
+
+    def __init__(self, db_path='sessions.db', max_sessions=10000, idle_ttl=30 * 60, max_history=100,
+                 purge_interval=30, lease_timeout=30, clock=time.time):
+        self.db_path = db_path
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_history = max_history
+        self.purge_interval = purge_interval
+        self.lease_timeout = lease_timeout
+        self._clock = clock
+        self._next_purge = 0
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        # Databases created before leases were added
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(sessions)')}
+        if 'lease_owner' not in columns:
+            conn.execute('ALTER TABLE sessions ADD COLUMN lease_owner TEXT')
+            conn.execute('ALTER TABLE sessions ADD COLUMN lease_until REAL NOT NULL DEFAULT 0')
+        conn.executemany('INSERT OR IGNORE INTO session_counters (name, value) VALUES (?, 0)',
+                         [(name,) for name in self.COUNTERS])
+        conn.commit()
+
+    def _connection(self):
+        """
+        Per-thread connection in autocommit mode; transactions are explicit
+        A connection inherited from the parent of a forked process is not reused.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _count(conn, name, amount=1):
+        conn.execute('UPDATE session_counters SET value = value + ? WHERE name = ?', (amount, name))
+
+    def _claim(self, conn, session_id, username, owner):
+        """
+        Take the lease on a session (creating or resetting it as needed)
+        Returns the session, or None if another holder has it.
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = self._clock()
+            row = conn.execute(
+                'SELECT data, last_access, lease_until FROM sessions WHERE session_id = ?', (session_id,)
+            ).fetchone()
+            if row is not None and row[2] > now:
+                conn.execute('COMMIT')
+                return None
+
+            if row is not None and now - row[1] > self.idle_ttl:
+                self._count(conn, 'evicted_expired')
+                row = None
+            if row is None:
+                session = new_session(username)
+                self._count(conn, 'created')
+                data = encode_session(session)
+            else:
+                data = row[0]
+                session = decode_session(data)
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, data, last_access, lease_owner, lease_until) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (session_id, data, now, owner, now + self.lease_timeout)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return session
+
+    @contextmanager
+    def session(self, session_id, username=None):
+        conn = self._connection()
+        owner = uuid.uuid4().hex
+        delay = 0.001
+        while True:
+            session = self._claim(conn, session_id, username, owner)
+            if session is not None:
+                break
+            self._count(conn, 'lease_waits')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+        try:
+            yield session
+        except BaseException:
+            conn.execute('UPDATE sessions SET lease_owner = NULL, lease_until = 0 '
+                         'WHERE session_id = ? AND lease_owner = ?', (session_id, owner))
+            raise
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            history = session['history']
+            if len(history) > self.max_history:
+                self._count(conn, 'history_trimmed', len(history) - self.max_history)
+                del history[:-self.max_history]
+            now = self._clock()
+            updated = conn.execute(
+                'UPDATE sessions SET data = ?, last_access = ?, lease_owner = NULL, lease_until = 0 '
+                'WHERE session_id = ? AND lease_owner = ?',
+                (encode_session(session), now, session_id, owner)
+            ).rowcount
+            if not updated:
+                # The lease expired and the row was purged or taken over; keep
+                # the other holder's changes if there are any
+                conn.execute(
+                    'INSERT OR IGNORE INTO sessions (session_id, data, last_access) VALUES (?, ?, ?)',
+                    (session_id, encode_session(session), now)
+                )
+            if now >= self._next_purge:
+                self._purge(conn, now)
+                self._next_purge = now + self.purge_interval
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _purge(self, conn, now):
+        """Drop expired sessions, then the least recently used ones over capacity"""
+        # Sessions leased to a request in progress are left alone
+        expired = conn.execute('DELETE FROM sessions WHERE last_access < ? AND lease_until <= ?',
+                               (now - self.idle_ttl, now)).rowcount
+        if expired:
+            self._count(conn, 'evicted_expired', expired)
+
+        excess = conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] - self.max_sessions
+        if excess > 0:
+            # Fewer than excess when some of the oldest sessions are leased
+            evicted = conn.execute(
+                'DELETE FROM sessions WHERE session_id IN '
+                '(SELECT session_id FROM sessions WHERE lease_until <= ? ORDER BY last_access LIMIT ?)',
+                (now, excess)
+            ).rowcount
+            if evicted:
+                self._count(conn, 'evicted_capacity', evicted)
+
+    def delete(self, session_id):
+        self._connection().execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def stats(self):
+        conn = self._connection()
+        stats = {'sessions': len(self), 'max_sessions': self.max_sessions}
+        stats.update(conn.execute('SELECT name, value FROM session_counters').fetchall())
+        return stats
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+def create_session_store(kind='memory', db_path='sessions.db', **options):
+    """Create the session store named by kind ('memory' or 'sqlite')"""
+    if kind == 'memory':
+        return InMemorySessionStore(**options)
+    if kind == 'sqlite':
+        return SQLiteSessionStore(db_path, **options)
+    raise ValueError(f"Unknown session store: {kind}")
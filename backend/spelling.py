@@ -0,0 +1,279 @@
+import re
+from array import array
+
+from spellchecker import SpellChecker
+
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+# Loaded by english_words on first use
+_english_words = None
+
+
+def english_words():
+    """
+    Correctly spelled English words, from pyspellchecker's English word list
+    Only words long enough to be corrected are kept (see SpellingIndex).
+    """
+    global _english_words
+    if _english_words is None:
+        _english_words = frozenset(word for word in SpellChecker(language='en').word_frequency.keys()
+                                   if len(word) >= SpellingIndex.MIN_WORD_LENGTH and WORD_PATTERN.fullmatch(word))
+    return _english_words
+
+
+class SpellingIndex:
+    """SymSpell-style index for correcting misspelled words
+
+    Every vocabulary word is stored under each string obtained by deleting
+    up to max_distance characters from its first prefix_length characters.
+    A misspelled word is looked up by generating its own deletions the same
+    way: any vocabulary word within the edit distance shares at least one
+    of them. Words longer than prefix_length are also looked up by the
+    deletions of their last prefix_length characters, and only candidates
+    found both ways have their real distance computed: words sharing a
+    prefix are common, words sharing both ends are not.
+
+    Words shorter than MIN_WORD_LENGTH are never corrected (too many short
+    words are one edit apart); LONG_WORD_LENGTH and longer words tolerate
+    two edits, others one. Correctly spelled English words (known_words,
+    english_words by default) are left alone ("never" is one edit from
+    "fever", "rough" from "cough"), unless the correction completes one of
+    phrases, the multi-word terms of the vocabulary, with the words around
+    it: "sore threat" becomes "sore throat".
+    """
+
+    MIN_WORD_LENGTH = 5
+    LONG_WORD_LENGTH = 9
+
+    def __init__(self, words, phrases=(), known_words=None, prefix_length=7):
+        self.prefix_length = prefix_length
+        # Correctly spelled words outside the vocabulary; None for
+        # english_words(), which is not stored so pickles stay small
+        self.known_words = known_words
+        if known_words is None:
+            # Load it now rather than on the first lookup
+            english_words()
+
+        # Word -> the phrases (word tuples) containing it, for the words
+        # long enough to be corrected
+        self.phrases = {}
+        for phrase in phrases:
+            for word in set(phrase):
+                if len(word) >= self.MIN_WORD_LENGTH:
+                    self.phrases.setdefault(word, []).append(tuple(phrase))
+        # Every word of a phrase: a known word is only checked for a
+        # correction when one of its neighbours is among them
+        self.phrase_words = frozenset(word for phrase in phrases for word in phrase)
+
+        # Word -> number of vocabulary terms using it, to break distance ties
+        self.frequencies = {}
+        for word in words:
+            self.frequencies[word] = self.frequencies.get(word, 0) + 1
+        self.words = sorted(self.frequencies)
+
+        # Deletion of the prefix (_deletes) or suffix (_suffix_deletes) ->
+        # word ID, or a list of IDs (an array once frozen) when several
+        # words share it
+        self._deletes = {}
+        self._suffix_deletes = {}
+        for word_id, word in enumerate(self.words):
+            # Queries are at least MIN_WORD_LENGTH long and one edit away,
+            # or LONG_WORD_LENGTH long and two edits away, so shorter words
+            # never need the matching deletions
+            if len(word) < self.MIN_WORD_LENGTH - 1:
+                continue
+            distance = 2 if len(word) >= self.LONG_WORD_LENGTH - 2 else 1
+            self._add(self._deletes, word[:prefix_length], distance, word_id)
+            # Suffixes are only looked up for queries longer than
+            # prefix_length, at most two edits from these words
+            if len(word) >= prefix_length - 1:
+                self._add(self._suffix_deletes, word[-prefix_length:], distance, word_id)
+
+    def _add(self, deletes, part, distance, word_id):
+        for deletion in self._deletions(part, distance):
+            existing = deletes.get(deletion)
+            if existing is None:
+                deletes[deletion] = word_id
+            elif isinstance(existing, list):
+                existing.append(word_id)
+            else:
+                deletes[deletion] = [existing, word_id]
+
+    def freeze(self):
+        """Store shared deletions as int arrays instead of lists (see KnowledgeBase.freeze)"""
+        if self.known_words is None:
+            # Loaded before forking so workers share it
+            english_words()
+        self.words = tuple(self.words)
+        for word, phrases in self.phrases.items():
+            self.phrases[word] = tuple(phrases)
+        for deletes in (self._deletes, self._suffix_deletes):
+            for deletion, ids in deletes.items():
+                if isinstance(ids, list):
+                    deletes[deletion] = array('i', ids)
+
+    @staticmethod
+    def _deletions(part, distance):
+        """part with up to distance characters deleted"""
+        found = {part}
+        frontier = [part]
+        for _ in range(distance):
+            next_frontier = []
+            for item in frontier:
+                for position in range(len(item)):
+                    deletion = item[:position] + item[position + 1:]
+                    if deletion not in found:
+                        found.add(deletion)
+                        next_frontier.append(deletion)
+            frontier = next_frontier
+        return found
+
+    def max_distance(self, word):
+        return 2 if len(word) >= self.LONG_WORD_LENGTH else 1
+
+    def is_known(self, word):
+        """True for vocabulary words, correctly spelled words and words too short to correct"""
+        if word in self.frequencies or len(word) < self.MIN_WORD_LENGTH:
+            return True
+        known_words = self.known_words if self.known_words is not None else english_words()
+        return word in known_words
+
+    def correct(self, word):
+        """
+        The closest vocabulary word to a lowercased word, or None
+        Known words (see is_known) are returned as is.
+        """
+        if self.is_known(word):
+            return word
+        return self.closest(word)
+
+    def closest(self, word):
+        """The closest vocabulary word to a lowercased word, or None"""
+        max_distance = self.max_distance(word)
+        candidates = self._candidates(self._deletes, word[:self.prefix_length], max_distance)
+        if len(word) > self.prefix_length and candidates:
+            candidates &= self._candidates(self._suffix_deletes, word[-self.prefix_length:], max_distance)
+
+        best, best_key = None, None
+        for word_id in candidates:
+            candidate = self.words[word_id]
+            if abs(len(candidate) - len(word)) > max_distance:
+                continue
+            distance = edit_distance(word, candidate, max_distance)
+            if distance > max_distance:
+                continue
+            # Closest first, then the most used, then alphabetical
+            key = (distance, -self.frequencies[candidate], candidate)
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+    def _candidates(self, deletes, part, distance):
+        """IDs of the words stored under a deletion of part"""
+        candidates = set()
+        for deletion in self._deletions(part, distance):
+            ids = deletes.get(deletion)
+            if ids is None:
+                continue
+            if isinstance(ids, int):
+                candidates.add(ids)
+            else:
+                candidates.update(ids)
+        return candidates
+
+    def correct_text(self, text):
+        """Lowercased text with each correctable misspelled word replaced"""
+        matches = list(WORD_PATTERN.finditer(text))
+        words = [match.group() for match in matches]
+        corrected = [self.correct(word) or word for word in words]
+
+        # Known words outside the vocabulary next to a phrase word may be a
+        # misspelling completing the phrase
+        for i, word in enumerate(words):
+            if word in self.frequencies or len(word) < self.MIN_WORD_LENGTH or corrected[i] != word:
+                continue
+            if not ((i > 0 and corrected[i - 1] in self.phrase_words)
+                    or (i + 1 < len(words) and corrected[i + 1] in self.phrase_words)):
+                continue
+            candidate = self.closest(word)
+            if candidate is not None and self._completes_phrase(corrected, i, candidate):
+                corrected[i] = candidate
+
+        if corrected == words:
+            return text
+        parts, end = [], 0
+        for match, word in zip(matches, corrected):
+            parts.append(text[end:match.start()])
+            parts.append(word)
+            end = match.end()
+        parts.append(text[end:])
+        return ''.join(parts)
+
+    def _completes_phrase(self, words, position, candidate):
+        """True if candidate at words[position] forms a phrase with the words around it"""
+        for phrase in self.phrases.get(candidate, ()):
+            for offset, phrase_word in enumerate(phrase):
+                if phrase_word != candidate:
+                    continue
+                start = position - offset
+                if start < 0 or start + len(phrase) > len(words):
+                    continue
+                if all(words[start + j] == phrase[j] for j in range(len(phrase)) if j != offset):
+                    return True
+        return False
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance (Levenshtein plus adjacent
+    transpositions) between a and b, or max_distance + 1 once it is known
+    to exceed max_distance
+    """
+    if a == b:
+        return 0
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+
+    # Shared prefixes and suffixes cost nothing; trim them (keeping one
+    # character so a transposition across the cut is still seen)
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    start = max(0, start - 1)
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    end_a, end_b = min(len(a), end_a + 1), min(len(b), end_b + 1)
+    a, b = a[start:end_a], b[start:end_b]
+
+    # Only cells within max_distance of the diagonal can stay within
+    # max_distance; the rest are left at too_far
+    n, m = len(a), len(b)
+    previous_previous = None
+    previous = [j if j <= max_distance else too_far for j in range(m + 1)]
+    for i in range(1, n + 1):
+        current = [too_far] * (m + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_minimum = current[0]
+        char = a[i - 1]
+        for j in range(max(1, i - max_distance), min(m, i + max_distance) + 1):
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] \
+                    and previous_previous[j - 2] + 1 < value:
+                value = previous_previous[j - 2] + 1
+            if value > too_far:
+                value = too_far
+            current[j] = value
+            if value < row_minimum:
+                row_minimum = value
+        if row_minimum > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return previous[m]
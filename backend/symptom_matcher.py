@@ -0,0 +1,130 @@
+from array import array
+from collections import deque
+
+from spelling import WORD_PATTERN, SpellingIndex
+
+
+class SymptomMatcher:
+    """Aho-Corasick automaton that finds every known symptom in one scan
+
+    Built once from the knowledge base symptoms and the synonym table.
+    Symptoms must appear as whole words (the same rule as the regex ``\\b``
+    anchors used before); synonyms match anywhere in the text, as the old
+    plain substring check did.
+
+    With fuzzy matching, misspelled words are corrected against the words
+    of the symptoms and synonyms (see SpellingIndex) and symptoms found only
+    in the corrected text are reported after the exact matches.
+    """
+
+    def __init__(self, symptoms, symptom_variations, fuzzy=True):
+        # Canonical symptoms in the order they are reported
+        self.symptoms = sorted(symptoms)
+        self.variation_symptoms = list(symptom_variations)
+
+        # Automaton: per-node goto table, failure link and matched patterns
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        # Each pattern payload is (needs word boundaries, canonical index)
+        # where the index is into self.symptoms or self.variation_symptoms
+        for index, symptom in enumerate(self.symptoms):
+            if symptom:
+                self._add(symptom.lower(), (True, index))
+        for index, symptom in enumerate(self.variation_symptoms):
+            for variation in symptom_variations[symptom]:
+                if variation:
+                    self._add(variation, (False, index))
+        self._build_failure_links()
+
+        self._spelling = None
+        if fuzzy:
+            terms = [WORD_PATTERN.findall(symptom.lower()) for symptom in self.symptoms]
+            for variations in symptom_variations.values():
+                terms += [WORD_PATTERN.findall(variation.lower()) for variation in variations]
+            words = [word for term in terms for word in term]
+            self._spelling = SpellingIndex(words, [term for term in terms if len(term) > 1])
+
+    def _add(self, pattern, payload):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append((len(pattern), payload))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                # Inherit the matches of the longest proper suffix
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def freeze(self):
+        """Replace the automaton lists with tuples and int arrays (see KnowledgeBase.freeze)"""
+        self.symptoms = tuple(self.symptoms)
+        self.variation_symptoms = tuple(self.variation_symptoms)
+        self._goto = tuple(self._goto)
+        self._fail = array('i', self._fail)
+        self._output = tuple(tuple(matches) for matches in self._output)
+        if self._spelling is not None:
+            self._spelling.freeze()
+
+    def find(self, text):
+        """Return the canonical symptoms mentioned in lowercased text"""
+        detected_symptoms = self._find_exact(text)
+        if self._spelling is not None:
+            corrected = self._spelling.correct_text(text)
+            if corrected != text:
+                for symptom in self._find_exact(corrected):
+                    if symptom not in detected_symptoms:
+                        detected_symptoms.append(symptom)
+        return detected_symptoms
+
+    def _find_exact(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+        found_symptoms = set()
+        found_variations = set()
+
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for length, (whole_word, index) in output[node]:
+                if not whole_word:
+                    found_variations.add(index)
+                elif index not in found_symptoms and _at_word_boundaries(text, position + 1 - length, position + 1):
+                    found_symptoms.add(index)
+
+        detected_symptoms = [self.symptoms[i] for i in sorted(found_symptoms)]
+        for index in sorted(found_variations):
+            symptom = self.variation_symptoms[index]
+            if symptom not in detected_symptoms:
+                detected_symptoms.append(symptom)
+        return detected_symptoms
+
+
+def _is_word_char(char):
+    """Same definition of a word character as the re module's \\w"""
+    return char.isalnum() or char == '_'
+
+
+def _at_word_boundaries(text, start, end):
+    """True when text[start:end] is bounded like r'\\b...\\b' would require"""
+    before = _is_word_char(text[start - 1]) if start > 0 else False
+    after = _is_word_char(text[end]) if end < len(text) else False
+    return (before != _is_word_char(text[start])) and (after != _is_word_char(text[end - 1]))
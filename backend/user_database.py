@@ -1,87 +1,219 @@
-import json
-import os
+import atexit
+import threading
 from datetime import datetime
+from history_compaction import compact_entry, hydrate_entry
+from history_writer import HistoryWriteBehind
+from metrics import timed
+from passwords import hash_password, needs_rehash, verify_password
+from rules import Diagnosis
+from user_storage import create_backend
 
 class UserDatabase:
-    """Simple JSON-based user database for authentication and history"""
+    """User database for authentication and history
+
+    Storage is delegated to a StorageBackend: a single JSON file by default,
+    a JSON snapshot plus journal with mode='journal' (synced to disk
+    according to fsync, see JournaledJSONStorageBackend), shard_count JSON files
+    each with its own lock with mode='sharded', or SQLite when db_path ends
+    in .db/.sqlite/.sqlite3 (see user_storage.py).
+    
+    Given a knowledge_base, history entries are stored in compact form with
+    diagnoses referencing conditions by ID, and re-hydrated from the
+    knowledge base when read (see history_compaction.py).
+    
+    Passwords are stored as salted PBKDF2 hashes; password_iterations sets
+    the hash cost (default PASSWORD_HASH_ITERATIONS, see passwords.py).
     
-    def __init__(self, db_path='users_db.json'):
+    With write_behind=True, add_diagnosis_to_history queues entries and a
+    background thread writes them in batches (see history_writer.py); reads
+    of a user with queued entries wait for them to be written first. Pass
+    write_behind_options (batch_size, batch_delay, max_pending) to tune it.
+    """
+    
+    def __init__(self, db_path='users_db.json', backend=None, mode=None, knowledge_base=None,
+                 password_iterations=None, write_behind=False, write_behind_options=None, shard_count=8,
+                 fsync='interval'):
         self.db_path = db_path
-        self.users = self._load_database()
-    
-    def _load_database(self):
-        """Load users from JSON file"""
-        if os.path.exists(self.db_path):
-            try:
-                with open(self.db_path, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
-    
-    def _save_database(self):
-        """Save users to JSON file"""
-        with open(self.db_path, 'w') as f:
-            json.dump(self.users, f, indent=2)
-    
-    def create_user(self, username, email, password):
-        """Create a new user"""
-        if username in self.users:
-            return False, "Username already exists"
-        
-        if any(user.get('email') == email for user in self.users.values()):
-            return False, "Email already registered"
+        self.backend = backend if backend is not None else create_backend(db_path, mode, shard_count, fsync)
+        self.knowledge_base = knowledge_base
+        self.password_iterations = password_iterations
+        # Makes the username/email checks and the insert of create_user one
+        # step, so concurrent signups cannot register the same email (the
+        # sharded backend keeps emails in several files)
+        self._create_lock = threading.Lock()
+        self.history_writer = None
+        if write_behind:
+            self.history_writer = HistoryWriteBehind(self.backend, **(write_behind_options or {}))
+            atexit.register(self.history_writer.close)
+    
+    def _settle(self, username):
+        """Make sure queued history entries for username are written before reading"""
+        if self.history_writer is not None and self.history_writer.has_pending(username):
+            self.history_writer.flush()
+    
+    def _hydrate(self, entry):
+        """Expand a stored history entry for callers"""
+        if self.knowledge_base is None:
+            return entry
+        return hydrate_entry(entry, self.knowledge_base)
+    
+    @timed('user_db.create_user')
+    def create_user(self, username, email, password, password_hash=None):
+        """
+        Create a new user
+        password_hash may be hash_password(password) computed by the caller,
+        e.g. on another thread than the one doing storage (see asgi.py).
+        """
+        message = self._signup_conflict(username, email)
+        if message is not None:
+            return False, message
         
-        self.users[username] = {
+        # Hashed outside the lock: it is slow on purpose
+        record = {
             'email': email,
-            'password': password,  # In production, use proper password hashing
-            'created_at': datetime.now().isoformat(),
-            'medical_history': []
+            'password': password_hash or hash_password(password, self.password_iterations),
+            'created_at': datetime.now().isoformat()
         }
-        self._save_database()
+        with self._create_lock:
+            message = self._signup_conflict(username, email)
+            if message is not None:
+                return False, message
+            if not self.backend.create_user(username, record):
+                # Registered by another process since the check (the SQLite
+                # backend rejects duplicate emails itself)
+                return False, self._signup_conflict(username, email) or "Username already exists"
         return True, "User created successfully"
     
+    def _signup_conflict(self, username, email):
+        """Why username and email cannot be registered, or None if they can"""
+        if self.backend.user_exists(username):
+            return "Username already exists"
+        if self.backend.email_exists(email):
+            return "Email already registered"
+        return None
+    
+    @timed('user_db.authenticate_user')
     def authenticate_user(self, username, password):
         """Authenticate a user"""
-        if username not in self.users:
+        user = self.backend.get_account(username)
+        if user is None:
             return False, "User not found"
         
-        if self.users[username]['password'] != password:
+        if not verify_password(password, user['password']):
             return False, "Invalid password"
         
+        # Upgrade plaintext passwords and hashes made with an older cost
+        if needs_rehash(user['password'], self.password_iterations):
+            self.backend.set_password(username, hash_password(password, self.password_iterations))
+        
         return True, "Authentication successful"
     
+    def set_password_hash(self, username, password_hash):
+        """Replace a user's stored password hash; False if the user does not exist"""
+        return self.backend.set_password(username, password_hash)
+    
     def get_user(self, username):
         """Get user data"""
-        return self.users.get(username)
+        self._settle(username)
+        user = self.backend.get_user(username)
+        if user is not None and self.knowledge_base is not None:
+            user = dict(user, medical_history=[self._hydrate(e) for e in user.get('medical_history', [])])
+        return user
     
+    def get_account(self, username):
+        """Get user data without the medical history"""
+        return self.backend.get_account(username)
+    
+    @timed('user_db.add_diagnosis_to_history')
     def add_diagnosis_to_history(self, username, diagnosis_data):
         """Add a diagnosis to user's medical history"""
-        if username not in self.users:
+        if not self.backend.user_exists(username):
             return False, "User not found"
         
+        diagnoses = diagnosis_data.get('diagnoses', [])
+        if isinstance(diagnoses, (list, tuple)):
+            # Diagnosis objects from /api/chat; anything else a client sent is kept as is
+            diagnoses = [d.to_dict() if isinstance(d, Diagnosis) else d for d in diagnoses]
         history_entry = {
             'timestamp': datetime.now().isoformat(),
             'symptoms': diagnosis_data.get('symptoms', []),
-            'diagnoses': diagnosis_data.get('diagnoses', []),
+            'diagnoses': diagnoses,
             'session_id': diagnosis_data.get('session_id', '')
         }
+        if self.knowledge_base is not None:
+            history_entry = compact_entry(history_entry, self.knowledge_base)
         
-        self.users[username]['medical_history'].append(history_entry)
-        self._save_database()
+        if self.history_writer is not None:
+            self.history_writer.submit(username, history_entry)
+        elif not self.backend.append_history(username, history_entry):
+            return False, "User not found"
         return True, "Diagnosis added to history"
     
+    @timed('user_db.get_medical_history')
     def get_medical_history(self, username):
         """Get user's medical history"""
-        if username not in self.users:
-            return []
-        
-        return self.users[username].get('medical_history', [])
+        self._settle(username)
+        return [self._hydrate(entry) for entry in self.backend.get_history(username)]
+    
+    @timed('user_db.get_history_page')
+    def get_history_page(self, username, cursor=None, limit=50, since=None, until=None):
+        """
+        Get one page of a user's medical history, oldest first
+        Returns (entries, next_cursor); next_cursor is None on the last page.
+        since/until are ISO timestamps (since inclusive, until exclusive).
+        """
+        self._settle(username)
+        entries, next_cursor = self.backend.get_history_page(username, cursor, limit, since, until)
+        return [self._hydrate(entry) for entry in entries], next_cursor
+    
+    def iter_medical_history(self, username, since=None, until=None):
+        """Yield a user's history entries without loading them all at once"""
+        self._settle(username)
+        return (self._hydrate(entry) for entry in self.backend.iter_history(username, since, until))
     
+    @timed('user_db.clear_history')
     def clear_history(self, username):
         """Clear user's medical history"""
-        if username in self.users:
-            self.users[username]['medical_history'] = []
-            self._save_database()
-            return True
-        return False
+        self._settle(username)
+        return self.backend.clear_history(username)
+    
+    def stats(self):
+        """Write-behind queue counters (flushes, batch sizes, backpressure), or None"""
+        if self.history_writer is None:
+            return None
+        return self.history_writer.stats()
+    
+    def compact_history(self, batch_size=1000):
+        """
+        Rewrite every stored history entry in compact form
+        Entries already compact are left alone. Returns the number of entries
+        rewritten; requires a knowledge_base.
+        """
+        if self.knowledge_base is None:
+            raise ValueError("compact_history needs a knowledge_base")
+        
+        if self.history_writer is not None:
+            self.history_writer.flush()
+        
+        rewritten = 0
+        pending = {}
+        for username in self.backend.usernames():
+            history = self.backend.get_history(username)
+            compacted = [compact_entry(entry, self.knowledge_base) for entry in history]
+            changed = sum(1 for old, new in zip(history, compacted) if old != new)
+            if not changed:
+                continue
+            rewritten += changed
+            pending[username] = compacted
+            if len(pending) >= batch_size:
+                self.backend.replace_histories(pending)
+                pending = {}
+        if pending:
+            self.backend.replace_histories(pending)
+        return rewritten
+    
+    def close(self):
+        """Write any queued history entries and release the storage backend"""
+        if self.history_writer is not None:
+            self.history_writer.close()
+        self.backend.close()
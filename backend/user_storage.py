@@ -0,0 +1,768 @@
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class StorageBackend:
+    """Where UserDatabase keeps user accounts and their medical history
+
+    User records are dicts with 'email', 'password' (a hash from passwords.py)
+    and 'created_at'; history entries are the dicts built by
+    UserDatabase.add_diagnosis_to_history.
+    """
+
+    def get_user(self, username):
+        """Return the user record (including 'medical_history') or None"""
+        raise NotImplementedError
+
+    def get_account(self, username):
+        """Return the user record without its history (cheap, for logins) or None"""
+        raise NotImplementedError
+
+    def user_exists(self, username):
+        raise NotImplementedError
+
+    def email_exists(self, email):
+        raise NotImplementedError
+
+    def create_user(self, username, record):
+        """
+        Store a new user; return False if the username is already taken (or,
+        where the backend enforces it, the email)
+        """
+        raise NotImplementedError
+
+    def set_password(self, username, password):
+        """Replace a user's stored password hash; return False if the user does not exist"""
+        raise NotImplementedError
+
+    def append_history(self, username, entry):
+        """Append one history entry; return False if the user does not exist"""
+        raise NotImplementedError
+
+    def append_history_batch(self, entries):
+        """
+        Append a list of (username, entry) pairs with as few writes as possible
+        Entries for unknown users are skipped. Returns the number appended.
+        """
+        return sum(1 for username, entry in entries if self.append_history(username, entry))
+
+    def get_history(self, username):
+        """Return the user's history entries, oldest first"""
+        raise NotImplementedError
+
+    def clear_history(self, username):
+        """Remove all history entries; return False if the user does not exist"""
+        raise NotImplementedError
+
+    def usernames(self):
+        """Return the names of all users"""
+        raise NotImplementedError
+
+    def replace_histories(self, histories):
+        """Overwrite the history of each user in a {username: entries} mapping; unknown users are skipped"""
+        raise NotImplementedError
+
+    def get_history_page(self, username, cursor=None, limit=50, since=None, until=None):
+        """
+        Return (entries, next_cursor) for up to limit history entries
+        Entries come oldest first, starting after cursor (None for the
+        beginning) and restricted to since <= timestamp < until when given.
+        next_cursor is None once there is nothing more to read; otherwise
+        pass it back to continue. Cursors are non-negative integers.
+        """
+        history = self.get_history(username)
+        entries = []
+        position = cursor or 0
+        while position < len(history) and len(entries) < limit:
+            entry = history[position]
+            position += 1
+            if _in_range(entry.get('timestamp', ''), since, until):
+                entries.append(entry)
+        return entries, (position if position < len(history) else None)
+
+    def iter_history(self, username, since=None, until=None, batch_size=500):
+        """Yield history entries one at a time, reading batch_size at once"""
+        cursor = None
+        while True:
+            entries, cursor = self.get_history_page(username, cursor, batch_size, since, until)
+            yield from entries
+            if cursor is None:
+                return
+
+    def close(self):
+        pass
+
+
+def _in_range(timestamp, since, until):
+    """ISO timestamps compare correctly as strings"""
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+
+class JSONStorageBackend(StorageBackend):
+    """All users in a single JSON file, rewritten on every change
+
+    An email -> username index is kept alongside the users so that
+    email_exists does not scan every account. Changes are serialized by a
+    lock, so the backend can be shared with a background writer thread.
+    """
+
+    def __init__(self, db_path='users_db.json'):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.users = self._load_database()
+        self._usernames_by_email = {}
+        for username, user in self.users.items():
+            self._index_user(username, user)
+
+    def _index_user(self, username, user):
+        self._usernames_by_email.setdefault(user.get('email'), username)
+
+    def _load_database(self):
+        """Load users from JSON file"""
+        if os.path.exists(self.db_path):
+            try:
+                with open(self.db_path, 'r') as f:
+                    return json.load(f)
+            except:
+                return {}
+        return {}
+
+    def _save_database(self):
+        """Save users to JSON file, replacing it atomically so readers never see a partial write"""
+        temp_path = self.db_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.users, f, indent=2)
+        os.replace(temp_path, self.db_path)
+
+    def get_user(self, username):
+        return self.users.get(username)
+
+    def get_account(self, username):
+        user = self.users.get(username)
+        if user is None:
+            return None
+        return {key: value for key, value in user.items() if key != 'medical_history'}
+
+    def user_exists(self, username):
+        return username in self.users
+
+    def email_exists(self, email):
+        return email in self._usernames_by_email
+
+    def create_user(self, username, record):
+        with self._lock:
+            if username in self.users:
+                return False
+            self.users[username] = dict(record, medical_history=[])
+            self._index_user(username, record)
+            self._save_database()
+        return True
+
+    def set_password(self, username, password):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self.users[username]['password'] = password
+            self._save_database()
+        return True
+
+    def append_history(self, username, entry):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self.users[username]['medical_history'].append(entry)
+            self._save_database()
+        return True
+
+    def append_history_batch(self, entries):
+        appended = 0
+        with self._lock:
+            for username, entry in entries:
+                if username in self.users:
+                    self.users[username]['medical_history'].append(entry)
+                    appended += 1
+            if appended:
+                self._save_database()
+        return appended
+
+    def get_history(self, username):
+        if username not in self.users:
+            return []
+        return self.users[username].get('medical_history', [])
+
+    def clear_history(self, username):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self.users[username]['medical_history'] = []
+            self._save_database()
+        return True
+
+    def usernames(self):
+        return list(self.users)
+
+    def replace_histories(self, histories):
+        with self._lock:
+            for username, entries in histories.items():
+                if username in self.users:
+                    self.users[username]['medical_history'] = list(entries)
+            self._save_database()
+
+
+class JournaledJSONStorageBackend(JSONStorageBackend):
+    """users_db.json snapshot plus an append-only JSON-lines journal
+
+    create_user, append_history and clear_history append one small record to
+    <db_path>.journal instead of rewriting the snapshot. Startup replays the
+    snapshot and then the journal; a torn final line left by a crash is
+    ignored and cut off. Once the journal passes compact_threshold bytes a
+    background thread writes a fresh snapshot and starts a new journal.
+
+    fsync controls durability of journal appends: 'always' syncs every
+    record, 'interval' at most once per fsync_interval seconds, 'never'
+    leaves it to the OS. With 'interval' a write that is not synced right
+    away is synced by a timer once the interval is up, so the last write
+    before a quiet period is not left unsynced.
+    """
+
+    FSYNC_POLICIES = ('always', 'interval', 'never')
+
+    def __init__(self, db_path='users_db.json', fsync='interval', fsync_interval=1.0,
+                 compact_threshold=4 * 1024 * 1024):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(self.FSYNC_POLICIES)}")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_threshold = compact_threshold
+        self.journal_path = db_path + '.journal'
+        # Journal being folded into a new snapshot by compact()
+        self.rotated_path = self.journal_path + '.old'
+
+        self._compact_lock = threading.Lock()
+        self._compaction = None
+        self._last_fsync = time.monotonic()
+        self._fsync_timer = None
+
+        super().__init__(db_path)
+        self._replay(self.rotated_path)
+        self._replay(self.journal_path)
+        if os.path.exists(self.rotated_path):
+            # A compaction was interrupted; finish it before journaling again
+            self._write_snapshot(json.dumps(self.users, indent=2))
+            os.remove(self.rotated_path)
+
+        self._journal = open(self.journal_path, 'ab')
+        self._journal_size = self._journal.tell()
+
+    def _replay(self, path):
+        """Apply the records of a journal file to the in-memory users"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            lines = f.readlines()
+
+        for line in lines[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self._apply(record)
+
+        if not lines:
+            return
+        try:
+            torn = not lines[-1].endswith(b'\n')
+            record = None if torn else json.loads(lines[-1])
+        except ValueError:
+            torn = True
+        if not torn:
+            self._apply(record)
+            return
+
+        # A crash mid-append left a partial last line: ignore it and cut it
+        # off so that new records start on a clean line
+        with open(path, 'r+b') as f:
+            f.truncate(sum(len(line) for line in lines[:-1]))
+
+    def _apply(self, record):
+        """Apply one journal record; safe to re-apply records already in the snapshot"""
+        op, username = record.get('op'), record.get('user')
+        if op == 'create':
+            if username not in self.users:
+                self.users[username] = dict(record['record'], medical_history=[])
+                self._index_user(username, record['record'])
+        elif op == 'password' and username in self.users:
+            self.users[username]['password'] = record['password']
+        elif op == 'append' and username in self.users:
+            history = self.users[username]['medical_history']
+            # Entries already folded into the snapshot sit at or past this index
+            if len(history) <= record['index']:
+                history.append(record['entry'])
+        elif op == 'clear' and username in self.users:
+            self.users[username]['medical_history'] = []
+        elif op == 'replace' and username in self.users:
+            self.users[username]['medical_history'] = list(record['entries'])
+
+    def _write(self, record):
+        """Apply a record in memory and append it to the journal (caller holds the lock)"""
+        self._apply(record)
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        self._journal.write(line)
+        self._journal.flush()
+        self._journal_size += len(line)
+
+        now = time.monotonic()
+        if self.fsync == 'always' or (self.fsync == 'interval' and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._journal.fileno())
+            self._last_fsync = now
+        elif self.fsync == 'interval' and (self._fsync_timer is None or not self._fsync_timer.is_alive()):
+            # A timer still waiting to run covers this record too
+            self._fsync_timer = threading.Timer(self.fsync_interval - (now - self._last_fsync), self._deferred_fsync)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+        if self._journal_size >= self.compact_threshold and self._compaction is None:
+            self._compaction = threading.Thread(target=self.compact, daemon=True)
+            self._compaction.start()
+
+    def _deferred_fsync(self):
+        """Sync records appended since the last fsync ('interval' policy)"""
+        with self._lock:
+            if not self._journal.closed:
+                os.fsync(self._journal.fileno())
+                self._last_fsync = time.monotonic()
+
+    def create_user(self, username, record):
+        with self._lock:
+            if username in self.users:
+                return False
+            self._write({'op': 'create', 'user': username, 'record': record})
+        return True
+
+    def set_password(self, username, password):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self._write({'op': 'password', 'user': username, 'password': password})
+        return True
+
+    def append_history(self, username, entry):
+        with self._lock:
+            if username not in self.users:
+                return False
+            index = len(self.users[username]['medical_history'])
+            self._write({'op': 'append', 'user': username, 'index': index, 'entry': entry})
+        return True
+
+    def append_history_batch(self, entries):
+        appended = 0
+        with self._lock:
+            for username, entry in entries:
+                if username in self.users:
+                    index = len(self.users[username]['medical_history'])
+                    self._write({'op': 'append', 'user': username, 'index': index, 'entry': entry})
+                    appended += 1
+        return appended
+
+    def clear_history(self, username):
+        with self._lock:
+            if username not in self.users:
+                return False
+            self._write({'op': 'clear', 'user': username})
+        return True
+
+    def replace_histories(self, histories):
+        with self._lock:
+            for username, entries in histories.items():
+                if username in self.users:
+                    self._write({'op': 'replace', 'user': username, 'entries': entries})
+
+    def compact(self):
+        """Write a new snapshot containing every journaled change and start an empty journal"""
+        with self._compact_lock:
+            with self._lock:
+                snapshot = json.dumps(self.users, indent=2)
+                self._journal.close()
+                os.replace(self.journal_path, self.rotated_path)
+                self._journal = open(self.journal_path, 'ab')
+                self._journal_size = 0
+
+            # Until the snapshot is in place the rotated journal still counts
+            self._write_snapshot(snapshot)
+            os.remove(self.rotated_path)
+            self._compaction = None
+
+    def _write_snapshot(self, snapshot):
+        """Atomically replace the snapshot file"""
+        temp_path = self.db_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.db_path)
+
+    def close(self):
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        with self._lock:
+            if self._fsync_timer is not None:
+                self._fsync_timer.cancel()
+            if not self._journal.closed:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+
+
+class ShardedJSONStorageBackend(StorageBackend):
+    """Users partitioned by username hash across shard_count JSON files
+
+    Each shard is a JSONStorageBackend with its own lock, so changes to users
+    in different shards do not wait for each other's lock and each one
+    rewrites only that shard's file (JSON encoding still holds the GIL, so
+    they do not run fully in parallel). Shard files sit next to db_path, named after it
+    (users_db.json -> users_db.shard-3-of-8.json); the count is part of the
+    name, so changing it starts from db_path again instead of losing users
+    to the wrong shard. When no shard files exist yet, the users in db_path
+    (if any) are split across new shards.
+    """
+
+    def __init__(self, db_path='users_db.json', shard_count=8):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.db_path = db_path
+        self.shard_count = shard_count
+        paths = [self.shard_path(index) for index in range(shard_count)]
+        fresh = not any(os.path.exists(path) for path in paths)
+        self.shards = [JSONStorageBackend(path) for path in paths]
+        if fresh and os.path.exists(db_path):
+            self._split(JSONStorageBackend(db_path).users)
+
+    def shard_path(self, index):
+        root, ext = os.path.splitext(self.db_path)
+        return f"{root}.shard-{index}-of-{self.shard_count}{ext or '.json'}"
+
+    def _shard_index(self, username):
+        # crc32 rather than hash(): it must not change between processes
+        return zlib.crc32(username.encode('utf-8')) % self.shard_count
+
+    def _shard(self, username):
+        return self.shards[self._shard_index(username)]
+
+    def _split(self, users):
+        for username, user in users.items():
+            shard = self._shard(username)
+            shard.users[username] = dict(user, medical_history=list(user.get('medical_history', [])))
+            shard._index_user(username, user)
+        for shard in self.shards:
+            with shard._lock:
+                shard._save_database()
+
+    def get_user(self, username):
+        return self._shard(username).get_user(username)
+
+    def get_account(self, username):
+        return self._shard(username).get_account(username)
+
+    def user_exists(self, username):
+        return self._shard(username).user_exists(username)
+
+    def email_exists(self, email):
+        return any(shard.email_exists(email) for shard in self.shards)
+
+    def create_user(self, username, record):
+        return self._shard(username).create_user(username, record)
+
+    def set_password(self, username, password):
+        return self._shard(username).set_password(username, password)
+
+    def append_history(self, username, entry):
+        return self._shard(username).append_history(username, entry)
+
+    def append_history_batch(self, entries):
+        # One write per shard touched by the batch
+        by_shard = {}
+        for username, entry in entries:
+            by_shard.setdefault(self._shard_index(username), []).append((username, entry))
+        return sum(self.shards[index].append_history_batch(shard_entries)
+                   for index, shard_entries in by_shard.items())
+
+    def get_history(self, username):
+        return self._shard(username).get_history(username)
+
+    def clear_history(self, username):
+        return self._shard(username).clear_history(username)
+
+    def usernames(self):
+        return [username for shard in self.shards for username in shard.usernames()]
+
+    def replace_histories(self, histories):
+        by_shard = {}
+        for username, entries in histories.items():
+            by_shard.setdefault(self._shard_index(username), {})[username] = entries
+        for index, shard_histories in by_shard.items():
+            self.shards[index].replace_histories(shard_histories)
+
+
+class SQLiteStorageBackend(StorageBackend):
+    """Users and history entries in SQLite (WAL mode), one row per history entry
+
+    Appending a history entry is a single-row INSERT, so write cost no longer
+    grows with the number of users or the length of their history. Emails
+    are unique in the database itself, so processes sharing the file cannot
+    register one twice.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username   TEXT PRIMARY KEY,
+            email      TEXT NOT NULL,
+            password   TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            username  TEXT NOT NULL REFERENCES users (username),
+            timestamp TEXT NOT NULL,
+            entry     TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_user ON history (username, id);
+    """
+
+    def __init__(self, db_path='users.db'):
+        self.db_path = db_path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+        self._create_email_index()
+
+    def _create_email_index(self):
+        """Unique index on users.email, replacing the plain one of older databases"""
+        conn = self._connection()
+        try:
+            with conn:
+                conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_email_unique ON users (email)')
+                conn.execute('DROP INDEX IF EXISTS users_email')
+        except sqlite3.IntegrityError:
+            # Accounts registered twice before the index existed
+            logger.warning("%s has duplicate emails; they are only checked before each signup", self.db_path)
+            with conn:
+                conn.execute('CREATE INDEX IF NOT EXISTS users_email ON users (email)')
+
+    def _connection(self):
+        """
+        Per-thread connection; sqlite3 connections must not be shared across
+        threads, nor used in a process forked after they were opened
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get_user(self, username):
+        user = self.get_account(username)
+        if user is not None:
+            user['medical_history'] = self.get_history(username)
+        return user
+
+    def get_account(self, username):
+        row = self._connection().execute(
+            'SELECT email, password, created_at FROM users WHERE username = ?', (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'email': row[0], 'password': row[1], 'created_at': row[2]}
+
+    def user_exists(self, username):
+        return self._connection().execute(
+            'SELECT 1 FROM users WHERE username = ?', (username,)
+        ).fetchone() is not None
+
+    def email_exists(self, email):
+        return self._connection().execute(
+            'SELECT 1 FROM users WHERE email = ?', (email,)
+        ).fetchone() is not None
+
+    def create_user(self, username, record):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    'INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)',
+                    (username, record['email'], record['password'], record['created_at'])
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def set_password(self, username, password):
+        with self._connection() as conn:
+            updated = conn.execute(
+                'UPDATE users SET password = ? WHERE username = ?', (password, username)
+            ).rowcount
+        return updated > 0
+
+    def append_history(self, username, entry):
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    'INSERT INTO history (username, timestamp, entry) VALUES (?, ?, ?)',
+                    (username, entry.get('timestamp', ''), json.dumps(entry))
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def append_history_batch(self, entries):
+        appended = 0
+        with self._connection() as conn:
+            for username, entry in entries:
+                try:
+                    conn.execute(
+                        'INSERT INTO history (username, timestamp, entry) VALUES (?, ?, ?)',
+                        (username, entry.get('timestamp', ''), json.dumps(entry))
+                    )
+                except sqlite3.IntegrityError:
+                    continue
+                appended += 1
+        return appended
+
+    def get_history(self, username):
+        rows = self._connection().execute(
+            'SELECT entry FROM history WHERE username = ? ORDER BY id', (username,)
+        )
+        return [json.loads(row[0]) for row in rows]
+
+    def clear_history(self, username):
+        if not self.user_exists(username):
+            return False
+        with self._connection() as conn:
+            conn.execute('DELETE FROM history WHERE username = ?', (username,))
+        return True
+
+    def usernames(self):
+        return [row[0] for row in self._connection().execute('SELECT username FROM users')]
+
+    def replace_histories(self, histories):
+        # Rows are updated in place so their ids, and so history cursors, stay valid
+        with self._connection() as conn:
+            for username, entries in histories.items():
+                ids = [row[0] for row in conn.execute(
+                    'SELECT id FROM history WHERE username = ? ORDER BY id', (username,)
+                )]
+                if len(ids) == len(entries):
+                    conn.executemany(
+                        'UPDATE history SET timestamp = ?, entry = ? WHERE id = ?',
+                        [(entry.get('timestamp', ''), json.dumps(entry), row_id)
+                         for row_id, entry in zip(ids, entries)]
+                    )
+                    continue
+                if not self.user_exists(username):
+                    continue
+                conn.execute('DELETE FROM history WHERE username = ?', (username,))
+                conn.executemany(
+                    'INSERT INTO history (username, timestamp, entry) VALUES (?, ?, ?)',
+                    [(username, entry.get('timestamp', ''), json.dumps(entry)) for entry in entries]
+                )
+
+    def get_history_page(self, username, cursor=None, limit=50, since=None, until=None):
+        # The cursor is the id of the last row returned
+        query = 'SELECT id, entry FROM history WHERE username = ? AND id > ?'
+        params = [username, cursor or 0]
+        if since is not None:
+            query += ' AND timestamp >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND timestamp < ?'
+            params.append(until)
+        query += ' ORDER BY id LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._connection().execute(query, params).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(row[1]) for row in rows[:limit]], next_cursor
+
+    def import_users(self, users):
+        """
+        Bulk-load a {username: record} mapping in the users_db.json layout
+        Users that already exist are skipped, so importing twice is harmless.
+        Returns the number of users imported.
+        """
+        imported = 0
+        with self._connection() as conn:
+            for username, record in users.items():
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)',
+                    (username, record.get('email', ''), record.get('password', ''), record.get('created_at', ''))
+                )
+                if cursor.rowcount == 0:
+                    if conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone() is None:
+                        logger.warning("Skipped user %s: email %r is already registered",
+                                       username, record.get('email', ''))
+                    continue
+                conn.executemany(
+                    'INSERT INTO history (username, timestamp, entry) VALUES (?, ?, ?)',
+                    [(username, entry.get('timestamp', ''), json.dumps(entry))
+                     for entry in record.get('medical_history', [])]
+                )
+                imported += 1
+        return imported
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+
+def create_backend(db_path, mode=None, shard_count=8, fsync='interval'):
+    """
+    Create a storage backend
+    mode is 'json', 'journal', 'sharded' or 'sqlite'; by default SQLite is
+    picked for .db/.sqlite/.sqlite3 paths and a plain JSON file otherwise.
+    shard_count only applies to 'sharded' and fsync (the journal's fsync
+    policy, see JournaledJSONStorageBackend) to 'journal'.
+    """
+    if mode is None:
+        mode = 'sqlite' if db_path.endswith(SQLITE_EXTENSIONS) else 'json'
+    if mode == 'sqlite':
+        return SQLiteStorageBackend(db_path)
+    if mode == 'journal':
+        return JournaledJSONStorageBackend(db_path, fsync)
+    if mode == 'sharded':
+        return ShardedJSONStorageBackend(db_path, shard_count)
+    if mode == 'json':
+        return JSONStorageBackend(db_path)
+    raise ValueError(f"Unknown storage mode: {mode}")
+
+
+def migrate_json_to_sqlite(json_path, sqlite_path):
+    """One-shot copy of a users_db.json file into a SQLite database"""
+    users = JSONStorageBackend(json_path).users
+    backend = SQLiteStorageBackend(sqlite_path)
+    try:
+        return backend.import_users(users)
+    finally:
+        backend.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: python user_storage.py <users_db.json> <users.db>')
+    count = migrate_json_to_sqlite(sys.argv[1], sys.argv[2])
+    print(f'Migrated {count} users from {sys.argv[1]} to {sys.argv[2]}')